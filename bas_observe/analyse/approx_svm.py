@@ -0,0 +1,137 @@
+"""
+Approximate One Class SVM, which scales linearly with the number of training windows
+
+The RBF kernel is approximated by an explicit feature map (Nyström or random Fourier
+features), in which a linear One Class SVM is trained by stochastic gradient descent
+on mini-batches. It mimics the interface of sklearn.svm.OneClassSVM.
+"""
+import math
+
+import numpy as np
+
+from sklearn.base import BaseEstimator
+from sklearn.kernel_approximation import Nystroem, RBFSampler
+from sklearn.utils import check_array, check_random_state
+
+
+KERNEL_APPROXIMATIONS = ('nystroem', 'rff')
+
+# number of rows mapped at once when calibrating the offset
+_CALIBRATION_BLOCK_SIZE = 4096
+
+
+class ApproxOneClassSVM(BaseEstimator):
+    """Linear One Class SVM on an approximated RBF kernel feature map
+
+    Solves min_{w, rho} nu/2 * ||w||^2 - nu * rho + mean(max(0, rho - <w, phi(x)>))
+    which has the same solution as the kernelised problem of OneClassSVM (up to the
+    approximation of phi). coef_ is the average of the SGD iterates, and offset_ is
+    calibrated to the nu-quantile of the scores of the training rows, so about nu of
+    them are flagged, however far the few gradient steps on small data got.
+
+    Attributes:
+        nu                  Upper bound of the fraction of training errors
+        gamma               Kernel coefficient of the RBF kernel ('auto' is 1 / n_features)
+        approximation       Feature map approximating the kernel ('nystroem' or 'rff')
+        n_components        Dimension of the feature map
+        batch_size          Number of samples per gradient step
+        n_epochs            Minimum number of passes over the data in fit()
+        min_steps           Minimum number of gradient steps in fit(), i.e. small data
+                            is passed over more often
+        eta0                Initial learning rate
+        random_state        Seed of the feature map and the shuffling
+    """
+
+    def __init__(self, nu: float=0.01, gamma='auto', approximation: str='nystroem', n_components: int=300,
+                 batch_size: int=256, n_epochs: int=5, min_steps: int=200, eta0: float=1.0, random_state=None):
+        self.nu = nu
+        self.gamma = gamma
+        self.approximation = approximation
+        self.n_components = n_components
+        self.batch_size = batch_size
+        self.n_epochs = n_epochs
+        self.min_steps = min_steps
+        self.eta0 = eta0
+        self.random_state = random_state
+
+    def _init_feature_map(self, X: np.ndarray) -> None:
+        if self.approximation not in KERNEL_APPROXIMATIONS:
+            raise ValueError(f"Unknown kernel approximation '{self.approximation}'. Use one of {', '.join(KERNEL_APPROXIMATIONS)}")
+
+        gamma = 1.0 / X.shape[1] if self.gamma == 'auto' else self.gamma
+        if self.approximation == 'nystroem':
+            # the landmarks are drawn from the first batch seen
+            feature_map = Nystroem(gamma=gamma, n_components=min(self.n_components, X.shape[0]), random_state=self.random_state)
+        else:
+            feature_map = RBFSampler(gamma=gamma, n_components=self.n_components, random_state=self.random_state)
+
+        self.feature_map_ = feature_map.fit(X)
+        n_features = self.feature_map_.transform(X[:1]).shape[1]
+
+        self.coef_ = np.zeros(n_features)
+        self.offset_ = 0.0
+        self.t_ = 0
+        # current SGD iterate, coef_ is its running average
+        self.sgd_coef_ = np.zeros(n_features)
+        self.sgd_offset_ = 0.0
+
+    def _step(self, Z: np.ndarray) -> None:
+        """One gradient step on a mini-batch of mapped samples"""
+        self.t_ += 1
+        eta = self.eta0 / (1.0 + self.eta0 * self.nu * self.t_)
+
+        violated = Z.dot(self.sgd_coef_) < self.sgd_offset_
+        grad_coef = self.nu * self.sgd_coef_ - Z[violated].sum(axis=0) / Z.shape[0]
+        grad_offset = np.count_nonzero(violated) / Z.shape[0] - self.nu
+
+        self.sgd_coef_ -= eta * grad_coef
+        self.sgd_offset_ -= eta * grad_offset
+        self.coef_ += (self.sgd_coef_ - self.coef_) / self.t_
+
+    def _calibrate_offset(self, X: np.ndarray) -> None:
+        """Sets offset_ to the nu-quantile of the scores of the rows in X"""
+        scores = np.concatenate([self.feature_map_.transform(X[i:i + _CALIBRATION_BLOCK_SIZE]).dot(self.coef_)
+                                 for i in range(0, X.shape[0], _CALIBRATION_BLOCK_SIZE)])
+        self.offset_ = float(np.percentile(scores, 100. * self.nu))
+
+    def _fit_batches(self, X: np.ndarray, random_state) -> None:
+        order = random_state.permutation(X.shape[0])
+        for i in range(0, X.shape[0], self.batch_size):
+            self._step(self.feature_map_.transform(X[order[i:i + self.batch_size]]))
+
+    def fit(self, X, y=None):
+        X = check_array(X, accept_sparse='csr', dtype=np.float64)
+        random_state = check_random_state(self.random_state)
+        self._init_feature_map(X)
+
+        n_batches = math.ceil(X.shape[0] / self.batch_size)
+        for epoch in range(max(self.n_epochs, math.ceil(self.min_steps / n_batches))):
+            self._fit_batches(X, random_state)
+
+        self._calibrate_offset(X)
+        return self
+
+    def partial_fit(self, X, y=None):
+        """Updates the model with one pass over X, e.g. the windows of a new day"""
+        X = check_array(X, accept_sparse='csr', dtype=np.float64)
+        if not hasattr(self, 'feature_map_'):
+            self._init_feature_map(X)
+        elif not hasattr(self, 'sgd_coef_'):
+            # model fitted before the iterates were averaged
+            self.sgd_coef_ = self.coef_.copy()
+            self.sgd_offset_ = self.offset_
+
+        self._fit_batches(X, check_random_state(self.random_state))
+        self._calibrate_offset(X)
+        return self
+
+    def decision_function(self, X) -> np.ndarray:
+        """Signed distance to the separating hyperplane (positive for inliers)
+        Returns shape (n_samples, 1) like OneClassSVM
+        """
+        Z = self.feature_map_.transform(check_array(X, accept_sparse='csr', dtype=np.float64))
+        return (Z.dot(self.coef_) - self.offset_).reshape(-1, 1)
+
+    def predict(self, X) -> np.ndarray:
+        """Returns +1 for inliers and -1 for outliers"""
+        return np.where(self.decision_function(X)[:, 0] >= 0, 1, -1)
@@ -0,0 +1,125 @@
+"""
+Offline backtest scoring historical windows without AMQP
+
+The time range is split into chunks, which worker processes score in parallel.
+Each worker reads the windows of its chunk directly from the storage and scores
+them in large batches. Windows parsed from a dump are scored in batches as well.
+The results are written in bulk by the main process.
+"""
+import logging
+from multiprocessing import Pool
+import time
+
+import attr
+
+from .base import BaseAnalyser
+from .. import datamodel, misc
+
+
+# analyser of a worker process, created by _init_worker
+_analyser = None
+
+
+def _init_worker(analyser_class, kwargs: {}, conf, model_path: str):
+    global _analyser
+    _analyser = analyser_class(conf, model_path, **kwargs)
+    _analyser.prepare_scoring()
+
+
+def _batches(windows, batch_size: int):
+    batch = []
+    for window in windows:
+        batch.append(window)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+def _score_batch(windows: [datamodel.Window]) -> [{}]:
+    return _analyser.score_windows(windows)
+
+
+def _score_range(job) -> [{}]:
+    """Scores all stored windows of the chunk in batches"""
+    start, end, batch_size = job
+    points = []
+    # get_windows excludes start and end
+    for batch in _batches(_analyser.get_storage().get_windows(start - 1, end), batch_size):
+        points.extend(_analyser.score_windows(batch))
+
+    return points
+
+
+class Backtest(object):
+    LOGGER_NAME = 'BACKTEST'
+
+    def __init__(self, analyser: BaseAnalyser, jobs: int=1, chunk_length: int=24 * 60 * 60 * misc.NS_PER_SECOND,
+                 batch_size: int=10000, measurement_suffix: str=None):
+        """Scores historical windows with the saved model of an analyser
+
+        Attributes:
+            analyser            Analyser, whose class, options and model path are used for scoring
+            jobs                Number of worker processes
+            chunk_length        Length of the time range scored by one job in nanoseconds
+            batch_size          Number of windows scored at once
+            measurement_suffix  Appended to the measurement of the results (e.g. lof_<suffix>),
+                                so they do not replace the results of the running analysers
+        """
+        self.analyser = analyser
+        self.jobs = jobs
+        self.chunk_length = chunk_length
+        self.batch_size = batch_size
+        self.measurement_suffix = measurement_suffix
+
+        self.log = logging.getLogger(self.LOGGER_NAME)
+
+    def _map(self, func, jobs):
+        """Runs func for all jobs in the worker processes (or in this process with one job)
+        and yields the results in the order they are finished
+        """
+        analyser = self.analyser
+        if self.jobs <= 1:
+            _init_worker(analyser.__class__, analyser.get_init_kwargs(), analyser.conf, analyser.model_path)
+            yield from map(func, jobs)
+            return
+
+        # connections cannot be shared with the workers, they open their own ones
+        conf = attr.evolve(analyser.conf, amqp_connection=None, influxdb_connection=None, storage=None)
+        initargs = (analyser.__class__, analyser.get_init_kwargs(), conf, analyser.model_path)
+        with Pool(self.jobs, initializer=_init_worker, initargs=initargs) as pool:
+            yield from pool.imap_unordered(func, jobs)
+
+    def _write(self, points: [{}]) -> None:
+        if self.measurement_suffix:
+            for point in points:
+                point['measurement'] = f"{point['measurement']}_{self.measurement_suffix}"
+
+        self.analyser.get_storage().write_results(points)
+
+    def _run(self, func, jobs) -> int:
+        begin = time.perf_counter()
+        count = 0
+        for points in self._map(func, jobs):
+            if not points:
+                continue
+
+            self._write(points)
+            count += len(points)
+            self.log.info(f"Scored {count} windows ({count / (time.perf_counter() - begin):.0f} windows/s)")
+
+        self.log.info(f"Scored {count} windows in {time.perf_counter() - begin:.1f}s")
+        return count
+
+    def run(self, start: int, end: int) -> int:
+        """Scores the stored windows starting between start and end and returns their number"""
+        jobs = [(chunk_start, min(chunk_start + self.chunk_length, end), self.batch_size)
+                for chunk_start in range(start, end, self.chunk_length)]
+        self.log.info(f"Score {len(jobs)} chunks with {max(self.jobs, 1)} processes")
+        return self._run(_score_range, jobs)
+
+    def run_windows(self, windows) -> int:
+        """Scores the windows of an iterable (e.g. parsed from a dump) and returns their number"""
+        return self._run(_score_batch, _batches(windows, self.batch_size))
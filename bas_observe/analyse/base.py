@@ -2,30 +2,98 @@
 Abstract base implementation of an analyser class
 """
 import logging
-from datetime import datetime
 from collections import OrderedDict
+from datetime import datetime
+from multiprocessing import Pool, get_context
 import json
 import os.path
-
+import shutil
+import signal
+import tempfile
+import threading
+import time
+
+import attr
+import numpy as np
 from sklearn.externals import joblib
 
-from ..config import Config
-from .. import misc, datamodel
+from ..config import Config, setup_logging
+from .. import datamodel, misc, features, metrics, tracing, vectoriser
+from .model_cache import ModelCache
+from .projection import Projection
 
 
 class JsonSetEncoder(json.JSONEncoder):
-    """Encodes python sets as JSON lists"""
+    """Encodes python sets (and numpy arrays) as JSON lists"""
     # from https://stackoverflow.com/a/8230505
 
     def default(self, obj):
         if isinstance(obj, set):
             return list(obj)
+        elif isinstance(obj, np.ndarray):
+            return obj.tolist()
         return json.JSONEncoder.default(self, obj)
 
 
+def _fit_model(job):
+    """Fits one model on its rows of the memory-mapped training matrix and dumps it
+    Runs in a worker process of BaseSkLearnAnalyser.fit_models
+    """
+    agent, model, matrix_path, rows, model_path = job
+    # the matrix is shared between all workers via the page cache, it is never copied
+    X = joblib.load(matrix_path, mmap_mode='r')
+    if 'n_jobs' in model.get_params():
+        # the pool already keeps all cores busy
+        model.set_params(n_jobs=1)
+
+    model.fit(X[rows])
+    with misc.atomic_write(model_path, mode='wb') as fp:
+        joblib.dump(model, fp)
+
+    return agent
+
+
+def _retrain_models(analyser_class, kwargs: {}, conf: Config, model_path: str, start: int, end: int, log_level: int):
+    """Trains a fresh set of models into model_path
+    Runs in a subprocess of BaseSkLearnAnalyser.retrain_models, so it does not compete with the scoring
+    """
+    # the subprocess is spawned, so it does not inherit the logging set up of the analyser
+    setup_logging(level=log_level)
+    analyser = analyser_class(conf, model_path, **kwargs)
+    analyser.train(start, end)
+
+
+TRAIN_ON_WINDOWS = 'windows'
+TRAIN_ON_MATRIX = 'matrix'
+
+# version of the manifest format written by BaseSkLearnAnalyser
+MODEL_MANIFEST_VERSION = 2
+
+
+def read_model_manifest(path: str) -> {}:
+    """Reads the model manifest of a BaseSkLearnAnalyser
+    Returns the manifest with at least the keys models (dict mapping agents to model files),
+    generation, projection (file of the fitted projection or None) and features
+    (options of the feature vectors the models were trained on).
+    Manifests of older versions are a plain dict mapping agents to model files.
+    """
+    with open(path, mode='r') as fp:
+        data = json.load(fp)
+
+    if not (isinstance(data.get('models'), dict) and 'version' in data):
+        data = {'version': 1, 'models': data}
+
+    data.setdefault('generation', 0)
+    data.setdefault('projection', None)
+    data.setdefault('features', {'sparse': False, 'addr_histogram': False})
+    return data
+
+
 class BaseAnalyser(object):
     """Abstract base implementation of an analyser class"""
     LOGGER_NAME = 'ANALYSER'
+    # data the analyser is trained on, either the stream of windows or the feature matrix
+    TRAINING_INPUT = TRAIN_ON_WINDOWS
 
     def __init__(self, conf: Config, model: str):
         self.conf = conf
@@ -33,7 +101,7 @@ class BaseAnalyser(object):
 
         self.log = None
         self.channel = None
-        self.influxdb = None
+        self.storage = None
         self.model = None
 
         self._init_log()
@@ -47,18 +115,100 @@ class BaseAnalyser(object):
 
         return self.channel
 
-    def get_influxdb(self):
-        if not self.influxdb:
-            self.influxdb = self.conf.get_influxdb_connection()
+    def get_storage(self):
+        if not self.storage:
+            self.storage = self.conf.get_storage()
+
+        return self.storage
 
-        return self.influxdb
+    def get_init_kwargs(self) -> {}:
+        """Keyword arguments for creating an analyser with the same model options (e.g. for backtests)"""
+        return {}
 
-    def train(self, start: datetime, end: datetime):
-        raise NotImplemented("train function is not implemented")
+    def train(self, start: int, end: int):
+        """Trains the model from the windows between start and end and saves it"""
+        if self.TRAINING_INPUT == TRAIN_ON_MATRIX:
+            self.train_matrix(self.get_training_matrix(start, end))
+        else:
+            self.train_windows(self.get_storage().get_windows(start, end))
+
+        self.save_model()
+
+    def train_windows(self, windows):
+        raise NotImplementedError("train_windows function is not implemented")
+
+    def train_matrix(self, matrix: features.FeatureMatrix):
+        raise NotImplementedError("train_matrix function is not implemented")
 
     def analyse(self):
         raise NotImplemented("analyse function is not implemented")
 
+    def prepare_scoring(self):
+        """Loads the model, so windows can be scored"""
+        self.load_model()
+        if not self.model:
+            self.model = {}
+
+    def score_windows(self, windows: [datamodel.Window]) -> [{}]:
+        """Scores the windows and returns the results as points (cf. BaseStorage)"""
+        raise NotImplementedError("score_windows function is not implemented")
+
+    def get_result_tags(self, window: datamodel.Window) -> {}:
+        """Tags of the result points of the window
+        Results of rolled-up windows are tagged with their resolution, so they are kept apart
+        from the results of the agent windows in the same measurement.
+        """
+        tags = {
+            'project': self.conf.project_name,
+            'agent': window.agent,
+        }
+        if self.conf.resolution:
+            tags['resolution'] = self.conf.resolution
+
+        return tags
+
+    def on_message(self, channel, method, properties, body):
+        received = misc.now_epoch()
+
+        try:
+            with metrics.timed(self.LOGGER_NAME, 'decode'):
+                windows = [datamodel.Window.from_dict(data_entry) for data_entry in json.loads(body)]
+            self.log.info(f"Got new message from collector with {len(windows)} windows")
+
+            with metrics.timed(self.LOGGER_NAME, 'score', windows=len(windows)):
+                data = self.score_windows(windows)
+            scored = misc.now_epoch()
+
+            # write the results to the storage
+            self.log.debug(f"Push data to storage\n{data}")
+            with metrics.timed(self.LOGGER_NAME, 'write', windows=len(windows)):
+                self.get_storage().write_results(data)
+            written = misc.now_epoch()
+
+            # ack message
+            with metrics.timed(self.LOGGER_NAME, 'ack'):
+                channel.basic_ack(delivery_tag=method.delivery_tag)
+
+            self.write_latencies(windows, analyser=received, scored=scored, written=written)
+        except json.decoder.JSONDecodeError as e:
+            tmp_file = f"json_body_dump_{datetime.now()}.json"
+            with open(tmp_file, 'wb') as fp:
+                fp.write(body)
+
+            self.log.exception(f"Could not parse json message. Message dump is stored at '{tmp_file}'")
+            # ack message -> do not do this kids!
+            channel.basic_ack(delivery_tag=method.delivery_tag)
+
+    def write_latencies(self, windows: [datamodel.Window], **stages) -> None:
+        """Records the end-to-end latencies of the windows and writes the sampled ones to the storage"""
+        try:
+            points = tracing.latency_points(windows, self.LOGGER_NAME, self.conf.project_name, self.conf.trace_sample_rate, **stages)
+            if points:
+                self.get_storage().write_results(points)
+        except Exception:
+            # the latencies are diagnostics only, the results are already written
+            self.log.exception("Could not write the latencies of the windows")
+
     def load_model(self):
         with open(self.model_path, mode='r') as fp:
             self.model = json.load(fp)
@@ -66,118 +216,559 @@ class BaseAnalyser(object):
         return self.model
 
     def save_model(self):
-        with open(self.model_path, mode='w') as fp:
+        # a running analyser may be killed while saving, so never leave a truncated model behind
+        with misc.atomic_write(self.model_path, mode='w') as fp:
             json.dump(self.model, fp, cls=JsonSetEncoder)
 
-    def get_windows(self, start: datetime, end: datetime):
+    def get_windows(self, start: int, end: int):
         windows = OrderedDict()  # {time: [window, window, ...], time: [...]}
 
-        result = self.get_influxdb().query('SELECT * FROM "agent_status" WHERE "project" = \'{project}\' and time > \'{start}\' and time < \'{end}\' ORDER BY time DESC'.format(
-            project=self.conf.project_name,
-            start=misc.format_influx_datetime(start),
-            end=misc.format_influx_datetime(end),
-        ))
-
-        for data in result.get_points('agent_status'):
-            # construct window datamodel
-            self.log.debug(data)
-            window = datamodel.Window(
-                misc.parse_influxdb_datetime(data['time']),
-                data['agent'],
-                misc.parse_influxdb_datetime(data['end'])
-            )
-
-            # fill it with the measurements
-            window = self._query_measurements(window)
-
+        for window in self.get_storage().get_windows(start, end):
             key = misc.get_uncertain_date_key(windows, window.start)
             if not key:
                 windows[window.start] = [window]
-                self.log.debug(f"window key \"{window.start}\" does not exist yet. Gets created")
+                self.log.debug(f"window key \"{misc.format_epoch(window.start)}\" does not exist yet. Gets created")
             else:
                 # entry already exists, so add this row as well
                 windows[key].append(window)
 
                 # recalc key timestamp
-                new_key = datetime.fromtimestamp(sum([e.start.timestamp() for e in windows[key]]) / len(windows[key]))
-                self.log.info(f"File window into \"{key}\". Updated key is now \"{new_key}\"")
+                new_key = sum([e.start for e in windows[key]]) // len(windows[key])
+                self.log.info(f"File window into \"{misc.format_epoch(key)}\". Updated key is now \"{misc.format_epoch(new_key)}\"")
 
                 windows[new_key] = windows.pop(key)
 
         return windows
 
-    def _query_measurements(self, window: datamodel.Window):
-        queries = []
-
-        for measure in misc.MEASUREMENTS:
-            queries.append(
-                'SELECT * FROM "{measurement}" WHERE "project" = \'{project}\' and "agent" = \'{agent}\' and time = \'{time}\' LIMIT 1'.format(
-                    project=self.conf.project_name,
-                    agent=window.agent,
-                    time=misc.format_influx_datetime(window.start),
-                    measurement=measure,
-                )
-            )
+    def get_feature_builder(self):
+        """Returns an empty builder for the feature matrix this analyser is trained on"""
+        return features.FeatureMatrixBuilder()
 
-        self.log.debug(f"Execute InfluxDB queries: \"{'; '.join(queries)}\"")
-        result = self.get_influxdb().query('; '.join(queries))
-        for resultset in result:
-            if len(resultset.items()) <= 0:
-                # no items in resultset
-                self.log.warn(f"Got empty resultset for InfluxDB query\"{queries[result.index(resultset)]}\"")
-                continue
+    def get_training_matrix(self, start: int, end: int) -> features.FeatureMatrix:
+        """Vectorises all windows between start and end into one feature matrix
+        The windows are streamed from the storage, so they are never held in memory all at once.
+        If a feature cache is configured, already vectorised time slots are read from there.
+        """
+        if self.conf.feature_cache:
+            store = features.FeatureStore(
+                self.conf.feature_cache, self.conf.project_name, resolution=self.conf.resolution,
+                lag=misc.duration_to_ns(misc.parse_duration(self.conf.feature_cache_lag)))
+            matrix = store.build_matrix(start, end, self.get_storage().get_windows)
+            self.log.info(f"Assembled {len(matrix)} feature vectors for training")
+            return matrix
 
-            (measure, group), data = resultset.items()[0]
-            data = next(data)
-            # writes values to window
-            setattr(window, measure, {k: v for k, v in data.items() if k not in ('time', 'project', 'agent')})
+        builder = self.get_feature_builder()
+        for window in self.get_storage().get_windows(start, end):
+            builder.add_window(window)
 
-        return window
+        self.log.info(f"Vectorised {len(builder)} windows for training")
+        return builder.finish()
 
 
 class BaseSkLearnAnalyser(BaseAnalyser):
+    TRAINING_INPUT = TRAIN_ON_MATRIX
+
+    def __init__(self, conf: Config, model: str, reduction: str=None, n_components: int=15, sparse: bool=False,
+                 addr_histogram: bool=False):
+        """
+        Attributes:
+            conf                Config object
+            model               Path to the model manifest
+            reduction           Projection fitted ahead of the models during training ('pca' or 'svd'),
+                                None trains on the full feature vectors
+            n_components        Number of dimensions the feature vectors are reduced to
+            sparse              Vectorise the windows into sparse CSR matrices
+            addr_histogram      Add the raw source and destination address histograms to the
+                                (sparse) feature vectors
+        """
+        super().__init__(conf, model)
+        self.reduction = reduction
+        self.n_components = n_components
+        # the address histograms span the whole address space, so they are never densified
+        self.sparse = sparse or addr_histogram
+        self.addr_histogram = addr_histogram
+        # feature vectors of the saved models, which may differ from the ones trained now
+        self._saved_features = None
+        # projection of the feature vectors the models were trained on (None for the full vectors)
+        self.projection = None
+        self._projection_file = None
+        self._projection_dirty = False
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
         # cache for de-pickled model files
-        self._model_cache = {}
+        max_bytes = self.conf.model_cache_mb * 1024 * 1024 if self.conf.model_cache_mb else None
+        self._model_cache = ModelCache(max_entries=self.conf.model_cache_entries, max_bytes=max_bytes,
+                                       on_evict=self._on_model_evicted, component=self.LOGGER_NAME)
+        metrics.MODEL_CACHE_ENTRIES.labels(self.LOGGER_NAME).set_function(lambda: len(self._model_cache))
+        metrics.MODEL_CACHE_BYTES.labels(self.LOGGER_NAME).set_function(lambda: self._model_cache.bytes)
+        metrics.MODEL_CACHE_REQUESTS.labels(self.LOGGER_NAME, 'hit').set_function(lambda: self._model_cache.hits)
+        metrics.MODEL_CACHE_REQUESTS.labels(self.LOGGER_NAME, 'miss').set_function(lambda: self._model_cache.misses)
+        # agents, whose models were created or fitted, but not yet written to disk
+        self._dirty = set()
+        # model files replaced by newer versions, removed after the next manifest was written
+        self._obsolete_files = []
+        self._generation = 0
+
+        # background job retraining or reloading the models
+        self._worker = None
+        # set by the model updated signal (SIGHUP)
+        self._reload_requested = False
+        # models loaded in the background, which are swapped in between messages as (manifest, cache, projection)
+        self._swap = None
+
+    def get_init_kwargs(self) -> {}:
+        """Keyword arguments for creating an analyser with the same model options (e.g. for retraining)"""
+        return {'reduction': self.reduction, 'n_components': self.n_components, 'sparse': self.sparse,
+                'addr_histogram': self.addr_histogram}
+
+    def get_feature_builder(self):
+        if self.sparse:
+            return features.SparseFeatureMatrixBuilder(addr_histogram=self.addr_histogram)
+
+        return super().get_feature_builder()
+
+    def get_training_matrix(self, start: int, end: int) -> features.FeatureMatrix:
+        if self.sparse and self.conf.feature_cache:
+            self.log.warn("The feature cache only holds dense feature vectors. Vectorise all windows")
+            builder = self.get_feature_builder()
+            for window in self.get_storage().get_windows(start, end):
+                builder.add_window(window)
+
+            self.log.info(f"Vectorised {len(builder)} windows for training")
+            return builder.finish()
+
+        return super().get_training_matrix(start, end)
+
+    def get_features(self) -> {}:
+        """Options of the feature vectors, stored in the manifest along with the models"""
+        return {'sparse': self.sparse, 'addr_histogram': self.addr_histogram}
+
+    def use_saved_features(self) -> None:
+        """Scores with the feature vectors the loaded models were trained on"""
+        if self._saved_features and self._saved_features != self.get_features():
+            self.log.info(f"Use the feature vectors of the models: {self._saved_features}")
+            self.sparse = self._saved_features['sparse']
+            self.addr_histogram = self._saved_features['addr_histogram']
+
+    def vectorise(self, windows: []):
+        """Vectorises the windows into a matrix (CSR for sparse analysers) with one row per window"""
+        with metrics.timed(self.LOGGER_NAME, 'vectorise', windows=len(windows)):
+            if self.sparse:
+                return vectoriser.vectorise_windows_sparse(windows, addr_histogram=self.addr_histogram)
+
+            return np.array([vectoriser.vectorise_window(window) for window in windows])
+
+    @staticmethod
+    def group_rows(windows: [datamodel.Window]) -> {str: np.ndarray}:
+        """Returns the row indices of the windows of every agent, so each model scores all its rows at once"""
+        rows = OrderedDict()
+        for i, window in enumerate(windows):
+            rows.setdefault(window.agent, []).append(i)
+
+        return OrderedDict((agent, np.array(indices)) for agent, indices in rows.items())
+
+    def prepare_scoring(self):
+        super().prepare_scoring()
+        self.use_saved_features()
+
+    def project(self, X):
+        """Applies the projection of the models to the feature vectors"""
+        if self.projection is None:
+            return X
+
+        return self.projection.transform(X)
+
+    def fit_projection(self, matrix: features.FeatureMatrix) -> features.FeatureMatrix:
+        """Fits the projection on the training matrix (if a reduction is configured)
+        and returns the projected matrix. Models of agents, which are not part of the matrix,
+        were trained on the former projection (or feature vectors), so they are dropped.
+        """
+        features_changed = self._saved_features not in (None, self.get_features())
+        if self.reduction is None and self.projection is None and not features_changed:
+            return matrix
+
+        dropped = [agent for agent in self.model.keys() if agent != '__world_model__' and agent not in matrix.agents]
+        for agent in dropped:
+            self._model_cache.pop(agent, None)
+            self._dirty.discard(agent)
+            self._replace_filename(agent, None)
+            del self.model[agent]
+
+        if dropped:
+            self.log.warn(f"Dropped the models of {len(dropped)} agents without training data, since the feature vectors changed")
+
+        self._projection_dirty = True
+        if self.reduction is None:
+            self.projection = None
+            return matrix
+
+        self.projection = Projection.fit(matrix.X, self.n_components, self.reduction)
+        self.log.info(f"Fitted {self.reduction} projection to {self.projection.n_components} dimensions")
+        return features.FeatureMatrix(self.projection.transform(matrix.X), matrix.agents)
 
     def get_world_model(self):
         return self.get_model_for_agent('__world_model__')
 
+    def get_model_filename(self, agent) -> str:
+        """Returns a new versioned file name, so writing a model never touches a file that is in use"""
+        return f'{self.conf.project_name}-{self.__class__.__name__}-{agent}.{misc.now_epoch()}.joblib'
+
+    def mark_dirty(self, agent) -> None:
+        """Marks the model of agent as changed, so it is written on the next save"""
+        self._dirty.add(agent)
+
     def get_model_for_agent(self, agent):
         # check if a model exists for this agent
         if agent not in self.model:
             # model is neither know nor loaded
 
             model = self.create_new_model()
-            # store some refs
-            self.model[agent] = f'{self.conf.project_name}-{self.__class__.__name__}-{agent}.joblib'
-            self._model_cache[agent] = model
+            # store some refs (the file name is assigned once it is written)
+            self.model[agent] = None
+            self._model_cache.put(agent, model)
+            self.mark_dirty(agent)
 
             return model
-        elif agent in self._model_cache:
-            # model is known and loaded
-            return self._model_cache[agent]
-        else:
-            # model is known but not loaded
-            try:
-                model = joblib.load(os.path.join(os.path.dirname(self.model_path), self.model[agent]))
-            except Exception as e:
-                self.log.error(f"Error while loading sklearn model {self.model[agent]}. Generating new one.")
-                model = self.create_new_model()
 
-            self._model_cache[agent] = model
+        model = self._model_cache.get(agent)
+        if model is not None:
+            # model is known and loaded
             return model
 
+        # model is known but not loaded
+        try:
+            begin = time.perf_counter()
+            try:
+                model = self._load_model_file(self.model[agent])
+            except FileNotFoundError:
+                # another process saved a newer version in the meantime
+                self.model[agent] = read_model_manifest(self.model_path)['models'][agent]
+                model = self._load_model_file(self.model[agent])
+
+            self._model_cache.put(agent, model, load_seconds=time.perf_counter() - begin)
+        except Exception as e:
+            self.log.error(f"Error while loading sklearn model {self.model[agent]}. Generating new one.")
+            model = self.create_new_model()
+            self._model_cache.put(agent, model)
+            self.mark_dirty(agent)
+
+        return model
+
+    def _load_model_file(self, filename: str):
+        """Loads a model with its arrays memory-mapped, so analyser processes share the pages"""
+        path = os.path.join(os.path.dirname(self.model_path), filename)
+        try:
+            return joblib.load(path, mmap_mode='r')
+        except ValueError:
+            # some estimators cannot work on read-only arrays
+            self.log.debug(f"Model {filename} cannot be memory-mapped. Load it into memory")
+            return joblib.load(path)
+
+    def _on_model_evicted(self, agent, model):
+        if agent in self._dirty:
+            # this model only exists in memory
+            self._dump_model(agent, model)
+
     def create_new_model(self):
         raise NotImplementedError("create_new_model is not implemented.")
 
+    def fit_models(self, matrix: features.FeatureMatrix):
+        """Fits the world model on the whole matrix and one model per agent on its rows
+        With conf.jobs > 1 the models are fitted and dumped in a process pool
+        """
+        if self.conf.jobs <= 1:
+            self.get_world_model().fit(matrix.X)
+            self.mark_dirty('__world_model__')
+            for agent in matrix.agents.keys():
+                self.get_model_for_agent(agent).fit(matrix.for_agent(agent))
+                self.mark_dirty(agent)
+
+            return
+
+        model_dir = os.path.dirname(self.model_path)
+        # the world model takes longest, so it is started first
+        rows = [('__world_model__', slice(None))] + list(matrix.agents.items())
+
+        with tempfile.TemporaryDirectory(prefix='bob-train-') as tmp_dir:
+            matrix_path = os.path.join(tmp_dir, 'matrix.joblib')
+            joblib.dump(matrix.X, matrix_path)
+
+            jobs = []
+            filenames = {}
+            for agent, agent_rows in rows:
+                filenames[agent] = self.get_model_filename(agent)
+                jobs.append((agent, self.create_new_model(), matrix_path, agent_rows, os.path.join(model_dir, filenames[agent])))
+
+            self.log.info(f"Fit {len(jobs)} models in a pool of {self.conf.jobs} processes")
+            with Pool(self.conf.jobs) as pool:
+                for agent in pool.imap_unordered(_fit_model, jobs):
+                    self.log.info(f"Fitted model for agent {agent}")
+                    self._replace_filename(agent, filenames[agent])
+                    # the fitted model is already dumped, so load it lazily on the next use
+                    self._model_cache.pop(agent, None)
+                    self._dirty.discard(agent)
+
+    def setup_model_updates(self):
+        """Sets up the retrain schedule and the model updated signal (SIGHUP) of a running analyser"""
+        signal.signal(signal.SIGHUP, self._on_model_updated_signal)
+        if self.conf.retrain_interval:
+            self.log.info(f"Retrain the models every {self.conf.retrain_interval} from the last {self.conf.retrain_period}")
+            self.setup_retrain_timeout()
+
+        if self.conf.checkpoint_interval:
+            self.setup_checkpoint_timeout()
+
+        self.setup_swap_timeout()
+
+    def setup_checkpoint_timeout(self, connection=None):
+        """
+        sets up the timeout for writing the changed models to disk
+        """
+        if not connection:
+            connection = self.conf._amqp_connection
+
+        connection.add_timeout(self.conf.checkpoint_interval, self._on_checkpoint_timeout)
+
+    def _on_checkpoint_timeout(self):
+        try:
+            if self._dirty:
+                self.save_model()
+        except Exception:
+            self.log.exception("Could not write checkpoint of the models")
+        finally:
+            # whatever happens call this method again
+            self.setup_checkpoint_timeout()
+
+    def _on_model_updated_signal(self, signum, frame):
+        # only set a flag, the reload is started from the message loop
+        self._reload_requested = True
+
+    def setup_retrain_timeout(self, connection=None):
+        """
+        sets up the timeout for retraining the models in the background
+        """
+        if not connection:
+            connection = self.conf._amqp_connection
+
+        interval = misc.parse_duration(self.conf.retrain_interval).total_seconds()
+        connection.add_timeout(interval, self._on_retrain_timeout)
+
+    def _on_retrain_timeout(self):
+        try:
+            self.start_background_job(self.retrain_models)
+        finally:
+            # whatever happens call this method again
+            self.setup_retrain_timeout()
+
+    def setup_swap_timeout(self, connection=None):
+        """
+        sets up the timeout checking for reload requests and models ready to be swapped in
+        """
+        if not connection:
+            connection = self.conf._amqp_connection
+
+        connection.add_timeout(1, self._on_swap_timeout)
+
+    def _on_swap_timeout(self):
+        try:
+            if self._reload_requested:
+                self._reload_requested = False
+                self.log.info("Got model updated signal. Reload the models in the background")
+                self.start_background_job(self.reload_models)
+
+            self.swap_models()
+        finally:
+            # whatever happens call this method again
+            self.setup_swap_timeout()
+
+    def start_background_job(self, target):
+        if self._worker and self._worker.is_alive():
+            self.log.warn(f"Models are still updated in the background. Skip {target.__name__}")
+            return
+
+        self._worker = threading.Thread(target=target, name=f'{self.LOGGER_NAME} {target.__name__}', daemon=True)
+        self._worker.start()
+
+    def retrain_models(self):
+        """Trains new models from the recent windows in a subprocess and loads them for the swap
+        Runs in the background thread
+        """
+        end = misc.now_epoch()
+        start = end - misc.duration_to_ns(misc.parse_duration(self.conf.retrain_period))
+        model_dir = os.path.dirname(self.model_path)
+
+        # connections must not be shared with the subprocess
+        conf = attr.evolve(self.conf, amqp_connection=None, influxdb_connection=None, storage=None)
+        staging_dir = tempfile.mkdtemp(prefix='.retrain-', dir=model_dir or '.')
+        staging_path = os.path.join(staging_dir, os.path.basename(self.model_path))
+
+        try:
+            self.log.info(f"Retrain models from {misc.format_epoch(start)} to {misc.format_epoch(end)}")
+            # spawned instead of forked, forking from this thread would copy the locks held by the others
+            # (e.g. of the logging handlers or the AMQP connection) in their current state
+            args = (self.__class__, self.get_init_kwargs(), conf, staging_path, start, end, logging.getLogger().level)
+            process = get_context('spawn').Process(target=_retrain_models, args=args)
+            process.start()
+            process.join()
+            if process.exitcode != 0:
+                self.log.error(f"Retraining failed with exit code {process.exitcode}. Keep the current models")
+                return
+
+            manifest = read_model_manifest(staging_path)
+
+            # file names are versioned, so the new files never replace ones in use
+            for filename in list(manifest['models'].values()) + [manifest['projection']]:
+                if filename:
+                    os.replace(os.path.join(staging_dir, filename), os.path.join(model_dir, filename))
+
+            self._swap = (manifest, self._load_models(manifest['models']), self._load_projection(manifest['projection']))
+        except Exception:
+            self.log.exception("Retraining failed. Keep the current models")
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+    def reload_models(self):
+        """Loads the models from model_path (e.g. after an external training) for the swap
+        Runs in the background thread
+        """
+        try:
+            manifest = read_model_manifest(self.model_path)
+            self._swap = (manifest, self._load_models(manifest['models']), self._load_projection(manifest['projection']))
+        except Exception:
+            self.log.exception(f"Could not reload the models from {self.model_path}")
+
+    def _load_models(self, index: {}) -> {}:
+        cache = {}
+        for agent, filename in index.items():
+            try:
+                cache[agent] = self._load_model_file(filename)
+            except Exception:
+                self.log.exception(f"Error while loading sklearn model {filename}. Keep the current one.")
+
+        return cache
+
+    def _changes_vector_space(self, manifest: {}) -> bool:
+        """Returns True, if the models of manifest were trained on other feature vectors than the current ones"""
+        features_changed = manifest['features'] not in (None, self.get_features())
+        return features_changed or manifest['projection'] != self._projection_file
+
+    def _load_projection(self, filename: str) -> Projection:
+        if not filename:
+            return None
+
+        return Projection.load(os.path.join(os.path.dirname(self.model_path), filename))
+
+    def swap_models(self):
+        """Replaces the models by the ones loaded in the background
+        Called from the message loop, so it never happens while a message is scored
+        """
+        swap, self._swap = self._swap, None
+        if not swap:
+            return
+
+        manifest, cache, projection = swap
+        if self._changes_vector_space(manifest):
+            # the current models do not work with the new projection (or feature vectors),
+            # so the whole set is replaced, as by fit_projection
+            missing = [agent for agent in manifest['models'].keys() if agent not in cache]
+            if missing:
+                self.log.error(f"Could not load the models of {len(missing)} agents. Keep the current models")
+                return
+
+            dropped = [agent for agent in self.model.keys() if agent not in cache]
+            for agent in dropped:
+                self._model_cache.pop(agent, None)
+                self._dirty.discard(agent)
+                self._replace_filename(agent, None)
+                del self.model[agent]
+
+            if dropped:
+                self.log.warn(f"Dropped the models of {len(dropped)} agents without new models, since the feature vectors changed")
+
+        for agent in cache.keys():
+            self._replace_filename(agent, manifest['models'][agent])
+
+        # models and projection are always swapped together, they only work with each other
+        self.projection = projection
+        if self._projection_file and self._projection_file != manifest['projection']:
+            self._obsolete_files.append(self._projection_file)
+        self._projection_file = manifest['projection']
+        self._saved_features = manifest['features']
+        self.use_saved_features()
+
+        self._model_cache.update(cache)
+        self._dirty.difference_update(cache.keys())
+        # the model files are already in place, only the manifest needs to be written
+        self.write_manifest()
+        self.log.info(f"Swapped in {len(cache)} updated models")
+
+    def _replace_filename(self, agent, filename: str) -> None:
+        old_filename = self.model.get(agent)
+        self.model[agent] = filename
+        if old_filename and old_filename != filename:
+            # still referenced by the manifest on disk until the next one is written
+            self._obsolete_files.append(old_filename)
+
+    def _dump_model(self, agent, model):
+        """Writes the model atomically to a new versioned file"""
+        filename = self.get_model_filename(agent)
+        with misc.atomic_write(os.path.join(os.path.dirname(self.model_path), filename), mode='wb') as fp:
+            joblib.dump(model, fp)
+
+        self._replace_filename(agent, filename)
+        self._dirty.discard(agent)
+
+    def load_model(self):
+        manifest = read_model_manifest(self.model_path)
+        self.model = manifest['models']
+        self._generation = manifest['generation']
+        self._projection_file = manifest['projection']
+        self.projection = self._load_projection(self._projection_file)
+        self._saved_features = manifest['features']
+        return self.model
+
+    def write_manifest(self):
+        """Atomically replaces the manifest and removes the model files it no longer references"""
+        self._generation += 1
+        manifest = {
+            'version': MODEL_MANIFEST_VERSION,
+            'generation': self._generation,
+            'saved': misc.now_epoch(),
+            'analyser': self.__class__.__name__,
+            'models': {agent: filename for agent, filename in self.model.items() if filename},
+            'projection': self._projection_file,
+            'features': self.get_features(),
+        }
+        with misc.atomic_write(self.model_path, mode='w') as fp:
+            json.dump(manifest, fp)
+
+        obsolete, self._obsolete_files = self._obsolete_files, []
+        for filename in obsolete:
+            try:
+                # processes still using the file keep their mapping
+                os.unlink(os.path.join(os.path.dirname(self.model_path), filename))
+            except FileNotFoundError:
+                pass
+
     def save_model(self):
         # extend save_model to also save the LoF models
-        for agent, filename in self.model.items():
-            if agent in self._model_cache:
-                joblib.dump(self._model_cache[agent], os.path.join(os.path.dirname(self.model_path), self.model[agent]))
+        # only changed models are written, unchanged ones are (possibly memory-mapped) in use
+        dirty = [agent for agent in self._dirty if agent in self._model_cache]
+        for agent in dirty:
+            self._dump_model(agent, self._model_cache[agent])
+
+        if self._projection_dirty:
+            if self._projection_file:
+                self._obsolete_files.append(self._projection_file)
+
+            self._projection_file = None
+            if self.projection is not None:
+                self._projection_file = f'{self.conf.project_name}-{self.__class__.__name__}-projection.{misc.now_epoch()}.npz'
+                self.projection.save(os.path.join(os.path.dirname(self.model_path), self._projection_file))
+
+            self._projection_dirty = False
+
+        self.write_manifest()
+        self.log.debug(f"Saved {len(dirty)} changed models (generation {self._generation})")
 
-        # save the json model
-        super().save_model()
+    def log_cache_stats(self):
+        self.log.info(f"Model cache: {json.dumps(self._model_cache.stats())}")
@@ -1,146 +1,172 @@
 """
 Analyser module, calculates the entropy for each dimension of the feature vector
 """
-from datetime import datetime
 import math
-import json
 
 import numpy as np
 # import pandas as pd
 from scipy import stats
 
-from .base import BaseAnalyser
-from .. import datamodel, misc, vectoriser
+from .base import BaseAnalyser, TRAIN_ON_MATRIX
+from .. import vectoriser
 
 
 class EntropyAnalyser(BaseAnalyser):
     LOGGER_NAME = 'ENTROPY ANALYSER'
+    TRAINING_INPUT = TRAIN_ON_MATRIX
     NUM_TIME_BUCKETS = 7 * 24  # one for every hour in the week (actual number of buckets is double this)
 
-    def train(self, start: datetime, end: datetime):
+    def __init__(self, conf, model: str, online: bool=False, decay: float=1.0, update_threshold: float=None,
+                 snapshot_interval: int=300):
+        """
+        Attributes:
+            conf                Config object
+            model               Path to the model
+            online              Update the baseline with every scored window
+            decay               Weight of the former windows of a bucket, when a new one is added
+                                (1.0 keeps the plain mean, lower values follow drift faster)
+            update_threshold    Only windows with an entropy below this update the baseline
+                                (None updates with all windows)
+            snapshot_interval   Interval (in seconds) in which the online baseline is written to disk
+        """
+        super().__init__(conf, model)
+        self.online = online
+        self.decay = decay
+        self.update_threshold = update_threshold
+        self.snapshot_interval = snapshot_interval
+
+    def train_matrix(self, matrix):
         # bootstrap model data struct
         self.model = {}  # {agent: {buckets: [np.array...], count: np.array}}
 
-        # get the training data
-        window_dict = self.get_windows(start, end)
-        for windows in window_dict.values():
-            for window in windows:
-                if window.agent not in self.model:
-                    # bootstrap the model for this agent
-                    self.log.info(f"Bootstrap model entry for agent \"{window.agent}\"")
-                    self.model[window.agent] = {
-                        'buckets': [None] * self.NUM_TIME_BUCKETS * 2,
-                        'count': np.zeros(self.NUM_TIME_BUCKETS * 2)
-                        }
-
-                vect = vectoriser.vectorise_window(window)
-                bucket1, bucket2 = self._get_bucket_by_time(vect[0])
-
-                # vect is truncated, because in [0] the time is encoded
-                if self.model[window.agent]['buckets'][bucket1] is None:
-                    # if this bucket was not yet filled, put the unmodified vector
-                    self.model[window.agent]['buckets'][bucket1] = vect[1:]
-                else:
-                    # otherwise casually add the feature vector
-                    self.model[window.agent]['buckets'][bucket1] += vect[1:]
-
-                if self.model[window.agent]['buckets'][bucket2] is None:
-                    # if this bucket was not yet filled, put the unmodified vector
-                    self.model[window.agent]['buckets'][bucket2] = vect[1:]
-                else:
-                    # otherwise casually add the feature vector
-                    self.model[window.agent]['buckets'][bucket2] += vect[1:]
-
-                # increase the counter (to allow calculating the mean later)
-                self.model[window.agent]['count'][bucket1] += 1
-                self.model[window.agent]['count'][bucket2] += 1
-
-        for agent in self.model.keys():
-            self.model[agent]['buckets'] = [b.tolist() if b is not None else None for b in self.model[agent]['buckets']]
-            self.log.info(f"Count Vector for Agent {agent}: {self.model[agent]['count']}")
-            self.model[agent]['count'] = self.model[agent]['count'].tolist()
-
-        self.save_model()
+        for agent in matrix.agents.keys():
+            self.log.info(f"Bootstrap model entry for agent \"{agent}\"")
+            X = matrix.for_agent(agent)
+            bucket1, bucket2 = self._get_buckets_by_time(X[:, 0])
+
+            # sum up the feature vectors per bucket (vect is truncated, because in [0] the time is encoded)
+            sums = np.zeros((self.NUM_TIME_BUCKETS * 2, X.shape[1] - 1))
+            np.add.at(sums, bucket1, X[:, 1:])
+            np.add.at(sums, bucket2, X[:, 1:])
+            # count the vectors per bucket (to allow calculating the mean later)
+            count = np.bincount(np.concatenate((bucket1, bucket2)), minlength=self.NUM_TIME_BUCKETS * 2)
+
+            self.log.info(f"Count Vector for Agent {agent}: {count}")
+            self.model[agent] = {
+                # buckets, which were not filled, stay empty
+                'buckets': [sums[i].tolist() if count[i] > 0 else None for i in range(self.NUM_TIME_BUCKETS * 2)],
+                'count': count.astype(float).tolist(),
+            }
+
+    def prepare_scoring(self):
+        super().prepare_scoring()
+
+        # keep the buckets as arrays, so they neither need to be converted per window nor for updates
+        for agent_model in self.model.values():
+            agent_model['buckets'] = [np.array(b, dtype=float) if b is not None else None for b in agent_model['buckets']]
+            agent_model['count'] = np.array(agent_model['count'], dtype=float)
 
     def analyse(self):
         # load the model
-        self.load_model()
-        if not self.model:
-            self.model = {}
+        self.prepare_scoring()
 
         # get the AMQP channel and subscribe to relevant topics
         self.log.info("Connect to AMQP server")
         channel = self.get_channel()
         channel.basic_consume(self.on_message, queue=self.conf.name_queue_analyser_entropy, no_ack=False)
 
-        # get influxdb client
-        self.get_influxdb()
+        # get storage backend
+        self.get_storage()
 
         # run the loop
         try:
+            if self.online:
+                self.log.info(f"Update the baseline online with decay {self.decay}")
+                self.setup_snapshot_timeout()
+
             self.log.info("Start waiting for messages")
             channel.start_consuming()
         except KeyboardInterrupt:
             channel.stop_consuming()
         finally:
             self.conf._amqp_connection.close()
+            if self.online:
+                self.save_model()
+
+    def setup_snapshot_timeout(self, connection=None):
+        """
+        sets up the timeout for writing snapshots of the online updated baseline
+        """
+        if not connection:
+            connection = self.conf._amqp_connection
 
-    def on_message(self, channel, method, properties, body):
+        connection.add_timeout(self.snapshot_interval, self._on_snapshot_timeout)
 
+    def _on_snapshot_timeout(self):
         try:
-            windows = [datamodel.Window.from_dict(data_entry) for data_entry in json.loads(body)]
-            self.log.info(f"Got new message from collector with {len(windows)} windows")
-
-            data = []
-            for window in windows:
-                # get model entry for this agent
-                agent_model = self.model.get(window.agent,
-                                             {'buckets': [None] * self.NUM_TIME_BUCKETS * 2,
-                                              'count': np.zeros(self.NUM_TIME_BUCKETS * 2)}
-                                             )
-                vect = vectoriser.vectorise_window(window)
-                bucket1, bucket2 = self._get_bucket_by_time(vect[0])
-
-                entropy1 = stats.entropy(
-                    np.array(agent_model['buckets'][bucket1]) / agent_model['count'][bucket1],
-                    vect[1:]
-                )
-                entropy2 = stats.entropy(
-                    np.array(agent_model['buckets'][bucket2]) / agent_model['count'][bucket2],
-                    vect[1:]
-                )
-                # entropy is a sum (interally) anyway, so sum the both - I guess :D
-                entropy = entropy1 + entropy2
-
-                data.append({
-                    'time': misc.format_influx_datetime(window.start),
-                    'measurement': 'entropy',
-                    'tags': {
-                        'project': self.conf.project_name,
-                        'agent': window.agent,
-                    },
-                    'fields': {
-                        'entropy': entropy if entropy < math.inf else float(99999.9),
-                        'entropy1': entropy1 if entropy1 < math.inf else float(99999.9),
-                        'entropy2': entropy2 if entropy2 < math.inf else float(99999.9),
-                    }
-                })
-
-            self.log.debug(f"Push data to influxdb\n{data}")
-            self.get_influxdb().write_points(data)
-
-            # ack message
-            channel.basic_ack(delivery_tag=method.delivery_tag)
-        except json.decoder.JSONDecodeError as e:
-            tmp_file = f"json_body_dump_{datetime.now()}.json"
-            with open(tmp_file, 'wb') as fp:
-                fp.write(body)
-
-            self.log.exception(f"Could not parse json message. Message dump is stored at '{tmp_file}'")
-            # ack message -> do not do this kids!
-            channel.basic_ack(delivery_tag=method.delivery_tag)
+            self.save_model()
+            self.log.debug("Wrote snapshot of the baseline")
+        except Exception:
+            self.log.exception("Could not write snapshot of the baseline")
         finally:
-            pass
+            # whatever happens call this method again
+            self.setup_snapshot_timeout()
+
+    def update_baseline(self, agent_model: {}, bucket: int, vect: np.ndarray):
+        """Adds the feature vector (without time) to the bucket, after decaying the former ones"""
+        if agent_model['buckets'][bucket] is None:
+            agent_model['buckets'][bucket] = np.array(vect, dtype=float)
+            agent_model['count'][bucket] = 1
+        else:
+            agent_model['buckets'][bucket] *= self.decay
+            agent_model['buckets'][bucket] += vect
+            agent_model['count'][bucket] = agent_model['count'][bucket] * self.decay + 1
+
+    def _get_entropy(self, agent_model: {}, bucket: int, vect: np.ndarray) -> float:
+        if agent_model['buckets'][bucket] is None:
+            # nothing is known about this time of the week
+            return math.inf
+
+        return stats.entropy(np.asarray(agent_model['buckets'][bucket]) / agent_model['count'][bucket], vect)
+
+    def score_windows(self, windows):
+        data = []
+        for window in windows:
+            # get model entry for this agent
+            empty_model = {'buckets': [None] * self.NUM_TIME_BUCKETS * 2,
+                           'count': np.zeros(self.NUM_TIME_BUCKETS * 2)}
+            if self.online:
+                # new agents are learned from scratch
+                agent_model = self.model.setdefault(window.agent, empty_model)
+            else:
+                agent_model = self.model.get(window.agent, empty_model)
+
+            vect = vectoriser.vectorise_window(window)
+            bucket1, bucket2 = self._get_bucket_by_time(vect[0])
+
+            entropy1 = self._get_entropy(agent_model, bucket1, vect[1:])
+            entropy2 = self._get_entropy(agent_model, bucket2, vect[1:])
+            # entropy is a sum (interally) anyway, so sum the both - I guess :D
+            entropy = entropy1 + entropy2
+
+            if self.online:
+                for bucket, bucket_entropy in ((bucket1, entropy1), (bucket2, entropy2)):
+                    # empty buckets are always filled, otherwise they would never get a baseline
+                    if self.update_threshold is None or bucket_entropy < self.update_threshold or agent_model['buckets'][bucket] is None:
+                        self.update_baseline(agent_model, bucket, vect[1:])
+
+            data.append({
+                'time': window.start,
+                'measurement': 'entropy',
+                'tags': self.get_result_tags(window),
+                'fields': {
+                    'entropy': entropy if entropy < math.inf else float(99999.9),
+                    'entropy1': entropy1 if entropy1 < math.inf else float(99999.9),
+                    'entropy2': entropy2 if entropy2 < math.inf else float(99999.9),
+                }
+            })
+
+        return data
 
     def _get_bucket_by_time(self, time: float):
         """Returns the 2 bucket IDs based on the normalised time"""
@@ -148,3 +174,10 @@ class EntropyAnalyser(BaseAnalyser):
         bucket2 = (math.floor((time + (1 / (self.NUM_TIME_BUCKETS * 2))) * self.NUM_TIME_BUCKETS) % self.NUM_TIME_BUCKETS) + self.NUM_TIME_BUCKETS
 
         return bucket1, bucket2
+
+    def _get_buckets_by_time(self, times: np.ndarray):
+        """Vectorised version of _get_bucket_by_time for a whole column of normalised times"""
+        bucket1 = np.floor(times * self.NUM_TIME_BUCKETS).astype(int) % self.NUM_TIME_BUCKETS
+        bucket2 = (np.floor((times + (1 / (self.NUM_TIME_BUCKETS * 2))) * self.NUM_TIME_BUCKETS).astype(int) % self.NUM_TIME_BUCKETS) + self.NUM_TIME_BUCKETS
+
+        return bucket1, bucket2
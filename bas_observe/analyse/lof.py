@@ -1,16 +1,14 @@
 """
 Analyser module, which utilizes the Local Outlier Factor to determine
 """
-from datetime import datetime
 import json
-import pandas as pd
 import numpy as np
 
 from sklearn.neighbors import LocalOutlierFactor
 import baos_knx_parser as knx
 
 from .base import BaseSkLearnAnalyser
-from .. import datamodel, misc, vectoriser
+from .lof_index import IndexedLof, evaluate_lof
 
 
 APCI_KEYS = list(knx.APCI(None)._attr_map.keys())
@@ -19,42 +17,64 @@ APCI_KEYS = list(knx.APCI(None)._attr_map.keys())
 class LofAnalyser(BaseSkLearnAnalyser):
     LOGGER_NAME = 'LOF ANALYSER'
 
-    def train(self, start: datetime, end: datetime):
+    def __init__(self, conf, model: str, index: str=None, dtype: str='float64', coreset_size: int=None, evaluate: int=0,
+                 **kwargs):
+        """
+        Attributes:
+            conf                Config object
+            model               Path to the model
+            index               Neighbour index of new models ('kd_tree', 'ball_tree' or 'brute'),
+                                None uses sklearn's LocalOutlierFactor
+            dtype               dtype of the training rows stored in brute force indices
+            coreset_size        Maximum number of training rows per model (None keeps all)
+            evaluate            Number of training windows scored against an exact model
+                                to report the latency and recall after training
+            kwargs              Options of the BaseSkLearnAnalyser (e.g. reduction)
+        """
+        super().__init__(conf, model, **kwargs)
+        self.index = index
+        self.dtype = dtype
+        self.coreset_size = coreset_size
+        self.evaluate = evaluate
+
+    def get_init_kwargs(self) -> {}:
+        return dict(super().get_init_kwargs(), index=self.index, dtype=self.dtype, coreset_size=self.coreset_size)
+
+    def train_matrix(self, matrix):
         try:
             self.load_model()
         except:
             self.model = {}
 
-        sys_X = pd.DataFrame()
-        agent_X = {}
+        # train all the models!
+        matrix = self.fit_projection(matrix)
+        self.fit_models(matrix)
 
-        window_dict = self.get_windows(start, end)
-        for windows in window_dict.values():
-            for window in windows:
-                vect = [vectoriser.vectorise_window(window)]
-                sys_X = sys_X.append(vect)
-                agent_X[window.agent] = agent_X.get(window.agent, pd.DataFrame()).append(vect)
+        if self.evaluate and len(matrix) > 0:
+            self.evaluate_world_model(matrix.X)
 
-        # train all the models!
-        self.get_world_model().fit(sys_X)
-        for agent, X in agent_X.items():
-            self.get_model_for_agent(agent).fit(X)
+    def evaluate_world_model(self, X: np.ndarray):
+        """Logs latency and recall of the world model compared to an exact LOF"""
+        rows = np.random.choice(X.shape[0], min(self.evaluate, X.shape[0]), replace=False)
+        reference = IndexedLof(n_neighbors=100, contamination=0.1, index='brute').fit(X)
 
-        self.save_model()
+        result = evaluate_lof(self.get_world_model(), reference, X[np.sort(rows)])
+        self.log.info(f"Evaluation of the world model on {len(rows)} windows: {json.dumps(result)}")
 
     def analyse(self):
         # load the model
-        self.load_model()
-        if not self.model:
-            self.model = {}
+        self.prepare_scoring()
 
         # get the AMQP channel and subscribe to relevant topics
         self.log.info("Connect to AMQP server")
         channel = self.get_channel()
         channel.basic_consume(self.on_message, queue=self.conf.name_queue_analyser_lof, no_ack=False)
 
-        # get influxdb client
-        self.get_influxdb()
+        # get storage backend
+        self.get_storage()
+
+        # retrain / reload the models in the background
+        self.setup_model_updates()
 
         # run the loop
         try:
@@ -66,67 +86,51 @@ class LofAnalyser(BaseSkLearnAnalyser):
             self.conf._amqp_connection.close()
             # save the models, since this is a learn-as-you-go thingy
             self.save_model()
+            self.log_cache_stats()
 
     def create_new_model(self):
-        return LocalOutlierFactor(n_neighbors=100, algorithm='auto', p=2, contamination=0.1, n_jobs=-1)
+        if self.index:
+            return IndexedLof(n_neighbors=100, contamination=0.1, index=self.index, dtype=self.dtype,
+                              coreset_size=self.coreset_size)
 
-    def on_message(self, channel, method, properties, body):
+        return LocalOutlierFactor(n_neighbors=100, algorithm='auto', p=2, contamination=0.1, n_jobs=-1)
 
-        try:
-            windows = [datamodel.Window.from_dict(data_entry) for data_entry in json.loads(body)]
-            self.log.info(f"Got new message from collector with {len(windows)} windows")
-
-            data = []
-            # fit all windows to the world model
-            vects = pd.DataFrame([vectoriser.vectorise_window(window) for window in windows])
-            self.log.debug(vects)
-
-            # note: this is the opposite of the Local Outlier Factor
-            # cf. https://github.com/scikit-learn/scikit-learn/blob/a24c8b46/sklearn/neighbors/lof.py#L233
-            lof_world = self.get_world_model()._decision_function(vects)
-            outlier_world = np.ones(vects.shape[0])
-            outlier_world[lof_world <= self.get_world_model().threshold_] = -1
-
-            # outlier_world = self.get_world_model()._predict(vects)  # fit_predict(vects)
-
-            for window, vect, outlier, lof in zip(windows, vects.itertuples(index=False), outlier_world, lof_world):
-                # -1 means outlier / 1 is an inlier
-                # we want to count the amount of outliers, so transform to
-                # 1 means outlier / 0 means inlier
-
-                # predict it against the models
-                lof_local, = self.get_model_for_agent(window.agent)._decision_function([vect])
-                outlier_local = 1 if lof_local <= self.get_model_for_agent(window.agent).threshold_ else -1
-
-                data.append({
-                    'time': misc.format_influx_datetime(window.start),
-                    'measurement': 'lof',
-                    'tags': {
-                        'project': self.conf.project_name,
-                        'agent': window.agent,
-                    },
-                    'fields': {
-                        'local': 1 if outlier_local < 0 else 0,
-                        'local_inlier': 0 if outlier_local < 0 else 1,
-                        'local_lof': lof_local * -1,
-                        'world': 1 if outlier < 0 else 0,
-                        'world_inlier': 0 if outlier < 0 else 1,
-                        'world_lof': lof * -1,
-                    }
-                })
-
-            # write the results to influx
-            self.get_influxdb().write_points(data)
-
-            # ack message
-            channel.basic_ack(delivery_tag=method.delivery_tag)
-        except json.decoder.JSONDecodeError as e:
-            tmp_file = f"json_body_dump_{datetime.now()}.json"
-            with open(tmp_file, 'wb') as fp:
-                fp.write(body)
-
-            self.log.exception(f"Could not parse json message. Message dump is stored at '{tmp_file}'")
-            # ack message -> do not do this kids!
-            channel.basic_ack(delivery_tag=method.delivery_tag)
-        finally:
-            pass
+    def score_windows(self, windows):
+        # fit all windows to the world model
+        vects = self.project(self.vectorise(windows))
+        self.log.debug(vects)
+
+        # note: this is the opposite of the Local Outlier Factor
+        # cf. https://github.com/scikit-learn/scikit-learn/blob/a24c8b46/sklearn/neighbors/lof.py#L233
+        lof_world = self.get_world_model()._decision_function(vects)
+        outlier_world = np.ones(vects.shape[0])
+        outlier_world[lof_world <= self.get_world_model().threshold_] = -1
+
+        # predict them against the models of their agents, all rows of an agent at once
+        lof_local = np.empty(vects.shape[0])
+        outlier_local = np.ones(vects.shape[0])
+        for agent, rows in self.group_rows(windows).items():
+            model = self.get_model_for_agent(agent)
+            lof_local[rows] = model._decision_function(vects[rows])
+            outlier_local[rows[lof_local[rows] <= model.threshold_]] = -1
+
+        data = []
+        for window, outlier, lof, local, local_lof in zip(windows, outlier_world, lof_world, outlier_local, lof_local):
+            # -1 means outlier / 1 is an inlier
+            # we want to count the amount of outliers, so transform to
+            # 1 means outlier / 0 means inlier
+            data.append({
+                'time': window.start,
+                'measurement': 'lof',
+                'tags': self.get_result_tags(window),
+                'fields': {
+                    'local': 1 if local < 0 else 0,
+                    'local_inlier': 0 if local < 0 else 1,
+                    'local_lof': local_lof * -1,
+                    'world': 1 if outlier < 0 else 0,
+                    'world_inlier': 0 if outlier < 0 else 1,
+                    'world_lof': lof * -1,
+                }
+            })
+
+        return data
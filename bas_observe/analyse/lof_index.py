@@ -0,0 +1,156 @@
+"""
+Local Outlier Factor scoring on a persisted neighbour index
+
+The training rows are kept in a prebuilt KDTree / BallTree (or a float32 matrix for
+brute force search), together with the k-distances and local reachability densities
+of the training rows. Scoring a window is a single k-NN query against the index,
+nothing is recomputed after the model was loaded.
+"""
+import time
+
+import numpy as np
+from scipy import sparse
+
+from sklearn.base import BaseEstimator
+from sklearn.neighbors import BallTree, KDTree
+from sklearn.utils import check_array, check_random_state
+from sklearn.utils.extmath import row_norms, safe_sparse_dot
+
+
+INDEX_TYPES = ('kd_tree', 'ball_tree', 'brute')
+
+# number of query rows per block in the brute force search
+_BRUTE_BLOCK_SIZE = 1024
+
+
+class IndexedLof(BaseEstimator):
+    """Local Outlier Factor for novelty detection on a persisted neighbour index
+
+    Scores follow the convention of LocalOutlierFactor._decision_function, i.e. the
+    negated LOF, and rows scoring at most threshold_ are outliers.
+
+    Attributes:
+        n_neighbors         Number of neighbours (k) of the LOF
+        contamination       Fraction of outliers in the training data, determines threshold_
+        index               Type of the neighbour index ('kd_tree', 'ball_tree' or 'brute')
+        leaf_size           Leaf size of the tree indices
+        dtype               dtype of the stored training rows for the brute force index
+                            (sparse CSR training rows are kept sparse, which requires the brute index)
+        coreset_size        If set, the training data is reduced to a uniform random sample
+                            of this size, which keeps the relative densities
+        random_state        Seed of the coreset sampling
+    """
+
+    def __init__(self, n_neighbors: int=100, contamination: float=0.1, index: str='kd_tree', leaf_size: int=40,
+                 dtype: str='float64', coreset_size: int=None, random_state=None):
+        self.n_neighbors = n_neighbors
+        self.contamination = contamination
+        self.index = index
+        self.leaf_size = leaf_size
+        self.dtype = dtype
+        self.coreset_size = coreset_size
+        self.random_state = random_state
+
+    def fit(self, X, y=None):
+        if self.index not in INDEX_TYPES:
+            raise ValueError(f"Unknown index '{self.index}'. Use one of {', '.join(INDEX_TYPES)}")
+
+        X = check_array(X, accept_sparse='csr')
+        if sparse.issparse(X) and self.index != 'brute':
+            raise ValueError(f"Sparse input requires the 'brute' index, not '{self.index}'")
+
+        if self.coreset_size and X.shape[0] > self.coreset_size:
+            rows = check_random_state(self.random_state).choice(X.shape[0], self.coreset_size, replace=False)
+            X = X[np.sort(rows)]
+
+        if self.index == 'brute':
+            self.fit_X_ = X.astype(self.dtype) if sparse.issparse(X) else np.ascontiguousarray(X, dtype=self.dtype)
+            self.sq_norms_ = row_norms(self.fit_X_, squared=True)
+            self.tree_ = None
+        else:
+            tree_class = KDTree if self.index == 'kd_tree' else BallTree
+            # the tree keeps its own copy of the rows, so no further one is stored
+            self.tree_ = tree_class(X, leaf_size=self.leaf_size)
+            self.fit_X_ = None
+
+        self.n_neighbors_ = max(1, min(self.n_neighbors, X.shape[0] - 1))
+
+        # the nearest neighbour of a training row is the row itself
+        dist, ind = self.kneighbors(X, self.n_neighbors_ + 1)
+        dist, ind = dist[:, 1:], ind[:, 1:]
+
+        self.k_distance_ = dist[:, -1]
+        self.lrd_ = self._local_reachability_density(dist, ind)
+        self.negative_outlier_factor_ = -np.mean(self.lrd_[ind], axis=1) / self.lrd_
+        self.threshold_ = np.percentile(self.negative_outlier_factor_, 100. * self.contamination)
+
+        return self
+
+    def kneighbors(self, X, k: int=None) -> (np.ndarray, np.ndarray):
+        """Returns the distances and indices of the k nearest training rows"""
+        k = k or self.n_neighbors_
+        if self.tree_ is not None:
+            return self.tree_.query(X, k=k)
+
+        X = X.astype(self.fit_X_.dtype) if sparse.issparse(X) else np.asarray(X, dtype=self.fit_X_.dtype)
+        dist = np.empty((X.shape[0], k))
+        ind = np.empty((X.shape[0], k), dtype=np.intp)
+        for i in range(0, X.shape[0], _BRUTE_BLOCK_SIZE):
+            block = X[i:i + _BRUTE_BLOCK_SIZE]
+            d2 = (row_norms(block, squared=True)[:, np.newaxis] -
+                  2 * safe_sparse_dot(block, self.fit_X_.T, dense_output=True) + self.sq_norms_)
+            rows = np.arange(block.shape[0])[:, np.newaxis]
+            nearest = np.argpartition(d2, k - 1, axis=1)[:, :k]
+            d2 = d2[rows, nearest]
+            order = np.argsort(d2, axis=1)
+
+            ind[i:i + block.shape[0]] = nearest[rows, order]
+            dist[i:i + block.shape[0]] = np.sqrt(np.maximum(d2[rows, order], 0))
+
+        return dist, ind
+
+    def _local_reachability_density(self, dist: np.ndarray, ind: np.ndarray) -> np.ndarray:
+        reach_dist = np.maximum(dist, self.k_distance_[ind])
+        return 1. / (np.mean(reach_dist, axis=1) + 1e-10)
+
+    def decision_function(self, X) -> np.ndarray:
+        """Negated LOF of the rows in X (the lower, the more abnormal)"""
+        X = check_array(X, accept_sparse='csr')
+        dist, ind = self.kneighbors(X)
+        lrd = self._local_reachability_density(dist, ind)
+        return -np.mean(self.lrd_[ind], axis=1) / lrd
+
+    # name used by the LofAnalyser for sklearn's LocalOutlierFactor
+    _decision_function = decision_function
+
+    def predict(self, X) -> np.ndarray:
+        """Returns +1 for inliers and -1 for outliers"""
+        return np.where(self.decision_function(X) <= self.threshold_, -1, 1)
+
+
+def evaluate_lof(model, reference, X: np.ndarray) -> {}:
+    """Compares the scoring of model against the (exact) reference model on the rows of X
+
+    Returns the mean and 95th percentile latency of scoring one window for both
+    models in milliseconds, the recall of the outliers flagged by the reference
+    and the overall agreement of the outlier decisions.
+    """
+    result = {}
+    flagged = {}
+    for name, lof in (('model', model), ('reference', reference)):
+        latencies = []
+        scores = []
+        for i in range(X.shape[0]):
+            begin = time.perf_counter()
+            scores.append(lof._decision_function(X[i:i + 1])[0])
+            latencies.append((time.perf_counter() - begin) * 1000)
+
+        flagged[name] = np.asarray(scores) <= lof.threshold_
+        result[f'{name}_latency_mean_ms'] = float(np.mean(latencies))
+        result[f'{name}_latency_p95_ms'] = float(np.percentile(latencies, 95))
+
+    outliers = np.count_nonzero(flagged['reference'])
+    result['outlier_recall'] = float(np.count_nonzero(flagged['model'] & flagged['reference']) / outliers) if outliers else 1.0
+    result['agreement'] = float(np.mean(flagged['model'] == flagged['reference']))
+
+    return result
@@ -0,0 +1,151 @@
+"""
+Bounded LRU cache of the de-pickled per-agent models
+"""
+from collections import OrderedDict
+import logging
+
+import numpy as np
+
+from .. import metrics
+
+
+def estimate_model_size(obj, _depth: int=0) -> int:
+    """Estimates the private memory held by the numpy arrays of a (sklearn) model
+    Memory-mapped arrays are not counted, since their pages are shared and can be dropped by the OS.
+    """
+    if _depth > 4:
+        return 0
+
+    if isinstance(obj, np.ndarray):
+        return 0 if isinstance(obj, np.memmap) or isinstance(obj.base, np.memmap) else obj.nbytes
+    elif isinstance(obj, dict):
+        return sum(estimate_model_size(value, _depth + 1) for value in obj.values())
+    elif isinstance(obj, (list, tuple)):
+        return sum(estimate_model_size(value, _depth + 1) for value in obj)
+    elif hasattr(obj, 'get_arrays'):
+        # KDTree / BallTree
+        return sum(estimate_model_size(value, _depth + 1) for value in obj.get_arrays())
+    elif hasattr(obj, '__dict__'):
+        return sum(estimate_model_size(value, _depth + 1) for value in vars(obj).values())
+
+    return 0
+
+
+class ModelCache(object):
+    """LRU cache of models with an entry and memory budget
+
+    When a budget is exceeded, the least recently used models are evicted. on_evict
+    is called for each evicted model, e.g. to save models which only exist in memory.
+    """
+    LOGGER_NAME = 'MODEL CACHE'
+
+    def __init__(self, max_entries: int=None, max_bytes: int=None, on_evict=None, component: str=None):
+        """
+        Attributes:
+            max_entries         Maximum number of cached models (None for no limit)
+            max_bytes           Maximum estimated memory of the cached models (None for no limit)
+            on_evict            Callback on_evict(agent, model) for evicted models
+            component           Label of the load times in the metrics (None does not record them)
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self.component = component
+
+        self._models = OrderedDict()  # {agent: (model, estimated size)}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.load_seconds = 0.0
+        self.evictions = 0
+
+        self.log = logging.getLogger(self.LOGGER_NAME)
+
+    def __contains__(self, agent) -> bool:
+        return agent in self._models
+
+    def __len__(self) -> int:
+        return len(self._models)
+
+    def __getitem__(self, agent):
+        """Returns the cached model without counting it as access"""
+        return self._models[agent][0]
+
+    def __setitem__(self, agent, model):
+        self.put(agent, model)
+
+    def keys(self):
+        return self._models.keys()
+
+    def items(self):
+        return [(agent, model) for agent, (model, size) in self._models.items()]
+
+    def get(self, agent, default=None):
+        """Returns the cached model and marks it as recently used"""
+        if agent not in self._models:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        self._models.move_to_end(agent)
+        return self._models[agent][0]
+
+    def put(self, agent, model, load_seconds: float=None) -> None:
+        """Adds (or replaces) a model. load_seconds is the time it took to load it from disk"""
+        self.pop(agent, None)
+
+        size = estimate_model_size(model)
+        self._models[agent] = (model, size)
+        self.bytes += size
+        if load_seconds is not None:
+            self.loads += 1
+            self.load_seconds += load_seconds
+            if self.component:
+                metrics.MODEL_CACHE_LOAD_SECONDS.labels(self.component).observe(load_seconds)
+
+        self._evict(keep=agent)
+
+    def update(self, models: {}) -> None:
+        for agent, model in models.items():
+            self.put(agent, model)
+
+    def pop(self, agent, default=None):
+        if agent not in self._models:
+            return default
+
+        model, size = self._models.pop(agent)
+        self.bytes -= size
+        return model
+
+    def _over_budget(self) -> bool:
+        return ((self.max_entries is not None and len(self._models) > self.max_entries) or
+                (self.max_bytes is not None and self.bytes > self.max_bytes))
+
+    def _evict(self, keep=None) -> None:
+        while self._over_budget() and len(self._models) > 1:
+            agent = next(iter(self._models))
+            if agent == keep:
+                # the newest model may exceed the budget alone, but it is needed right now
+                self._models.move_to_end(agent)
+                agent = next(iter(self._models))
+
+            model = self.pop(agent)
+            self.evictions += 1
+            self.log.debug(f"Evicted model of agent {agent}")
+            if self.on_evict:
+                self.on_evict(agent, model)
+
+    def stats(self) -> {}:
+        requests = self.hits + self.misses
+        return {
+            'entries': len(self._models),
+            'bytes': self.bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / requests if requests else None,
+            'loads': self.loads,
+            'load_seconds': self.load_seconds,
+            'mean_load_seconds': self.load_seconds / self.loads if self.loads else None,
+            'evictions': self.evictions,
+        }
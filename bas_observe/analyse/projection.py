@@ -0,0 +1,68 @@
+"""
+Linear dimensionality reduction of the feature vectors ahead of the sklearn models
+
+Many dimensions of the window vector are (nearly) constant or correlated, e.g. the
+APCI one-hot slots and the address bits. The projection is fitted once on the training
+matrix and applied as a single matrix multiply before fitting and scoring.
+Sparse feature vectors can only be reduced with the SVD, which does not center them.
+"""
+import numpy as np
+from scipy import sparse
+
+from sklearn.decomposition import PCA, TruncatedSVD
+from sklearn.utils.extmath import safe_sparse_dot
+
+from .. import misc
+
+
+REDUCTIONS = ('pca', 'svd')
+
+
+class Projection(object):
+    """Projects feature vectors x onto x.dot(components) - offset
+
+    Attributes:
+        components      Matrix of shape (number of features, number of components)
+        offset          Projected mean, which is subtracted to center the data (zeros for the SVD)
+    """
+
+    def __init__(self, components: np.ndarray, offset: np.ndarray):
+        self.components = components
+        self.offset = offset
+
+    @property
+    def n_components(self) -> int:
+        return self.components.shape[1]
+
+    @classmethod
+    def fit(cls, X: np.ndarray, n_components: int, reduction: str='pca'):
+        if reduction not in REDUCTIONS:
+            raise ValueError(f"Unknown reduction '{reduction}'. Use one of {', '.join(REDUCTIONS)}")
+        if reduction == 'pca' and sparse.issparse(X):
+            raise ValueError("The PCA cannot be fitted on sparse feature vectors. Use the 'svd' reduction")
+
+        n_components = min(n_components, X.shape[1] - 1 if reduction == 'svd' else X.shape[1], X.shape[0])
+        if reduction == 'pca':
+            pca = PCA(n_components=n_components).fit(X)
+            components = pca.components_.T
+            offset = pca.mean_.dot(components)
+        else:
+            components = TruncatedSVD(n_components=n_components).fit(X).components_.T
+            offset = np.zeros(n_components)
+
+        return cls(np.ascontiguousarray(components), offset)
+
+    def transform(self, X: np.ndarray) -> np.ndarray:
+        if not sparse.issparse(X):
+            X = np.asarray(X, dtype=np.float64)
+
+        return safe_sparse_dot(X, self.components, dense_output=True) - self.offset
+
+    def save(self, path: str) -> None:
+        with misc.atomic_write(path, mode='wb') as fp:
+            np.savez(fp, components=self.components, offset=self.offset)
+
+    @classmethod
+    def load(cls, path: str):
+        with np.load(path) as data:
+            return cls(data['components'], data['offset'])
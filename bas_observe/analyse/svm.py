@@ -1,15 +1,12 @@
 """Analyser module, using One Class Support Vector Machines (SVM)."""
 
-from datetime import datetime
-import json
-import pandas as pd
 import numpy as np
 
 from sklearn.svm import OneClassSVM
 import baos_knx_parser as knx
 
 from .base import BaseSkLearnAnalyser
-from .. import datamodel, misc, vectoriser
+from .approx_svm import ApproxOneClassSVM
 
 
 APCI_KEYS = list(knx.APCI(None)._attr_map.keys())
@@ -18,44 +15,45 @@ APCI_KEYS = list(knx.APCI(None)._attr_map.keys())
 class SvmAnalyser(BaseSkLearnAnalyser):
     LOGGER_NAME = 'SVM ANALYSER'
 
-    def train(self, start: datetime, end: datetime):
+    def __init__(self, conf, model: str, approximation: str=None, **kwargs):
+        """
+        Attributes:
+            conf                Config object
+            model               Path to the model
+            approximation       Kernel approximation of new models ('nystroem' or 'rff'),
+                                None uses the exact OneClassSVM
+            kwargs              Options of the BaseSkLearnAnalyser (e.g. reduction)
+        """
+        super().__init__(conf, model, **kwargs)
+        self.approximation = approximation
+
+    def get_init_kwargs(self) -> {}:
+        return dict(super().get_init_kwargs(), approximation=self.approximation)
+
+    def train_matrix(self, matrix):
         try:
             self.load_model()
         except:
             self.model = {}
 
-        sys_X = pd.DataFrame()
-        agent_X = {}
-
-        window_dict = self.get_windows(start, end)
-        for windows in window_dict.values():
-            for window in windows:
-                vect = [vectoriser.vectorise_window(window)]
-                sys_X = sys_X.append(vect)
-                agent_X[window.agent] = agent_X.get(window.agent, pd.DataFrame()).append(vect)
-
-        self.log.info(f"len window_dict {len(window_dict)}")
-
         # train all the models!
-        self.get_world_model().fit(sys_X)
-        for agent, X in agent_X.items():
-            self.get_model_for_agent(agent).fit(X)
-
-        self.save_model()
+        matrix = self.fit_projection(matrix)
+        self.fit_models(matrix)
 
     def analyse(self):
         # load the model
-        self.load_model()
-        if not self.model:
-            self.model = {}
+        self.prepare_scoring()
 
         # get the AMQP channel and subscribe to relevant topics
         self.log.info("Connect to AMQP server")
         channel = self.get_channel()
         channel.basic_consume(self.on_message, queue=self.conf.name_queue_analyser_svm, no_ack=False)
 
-        # get influxdb client
-        self.get_influxdb()
+        # get storage backend
+        self.get_storage()
+
+        # retrain / reload the models in the background
+        self.setup_model_updates()
 
         # run the loop
         try:
@@ -67,63 +65,47 @@ class SvmAnalyser(BaseSkLearnAnalyser):
             self.conf._amqp_connection.close()
             # save the models, since this is a learn-as-you-go thingy
             self.save_model()
+            self.log_cache_stats()
 
     def create_new_model(self):
-        return OneClassSVM(nu=0.01, kernel="rbf", gamma='auto')
+        if self.approximation:
+            return ApproxOneClassSVM(nu=0.01, gamma='auto', approximation=self.approximation)
 
-    def on_message(self, channel, method, properties, body):
+        return OneClassSVM(nu=0.01, kernel="rbf", gamma='auto')
 
-        try:
-            windows = [datamodel.Window.from_dict(data_entry) for data_entry in json.loads(body)]
-            self.log.info(f"Got new message from collector with {len(windows)} windows")
-
-            data = []
-            # fit all windows to the world model
-            vects = pd.DataFrame([vectoriser.vectorise_window(window) for window in windows])
-            self.log.debug(vects)
-
-            outlier_world = self.get_world_model().predict(vects)
-            distance_world = self.get_world_model().decision_function(vects)
-
-            for window, vect, outlier, lof in zip(windows, vects.itertuples(index=False), outlier_world, distance_world):
-                # -1 means outlier / 1 is an inlier
-                # we want to count the amount of outliers, so transform to
-                # 1 means outlier / 0 means inlier
-
-                # predict it against the models
-                outlier_local = self.get_model_for_agent(window.agent).predict([vect])[0]
-                distance_local = self.get_model_for_agent(window.agent).decision_function([vect])[0]
-
-                data.append({
-                    'time': misc.format_influx_datetime(window.start),
-                    'measurement': 'svm',
-                    'tags': {
-                        'project': self.conf.project_name,
-                        'agent': window.agent,
-                    },
-                    'fields': {
-                        'local': 1 if outlier_local < 0 else 0,
-                        'local_inlier': 0 if outlier_local < 0 else 1,
-                        'local_distance': distance_local[0],
-                        'world': 1 if outlier < 0 else 0,
-                        'world_inlier': 0 if outlier < 0 else 1,
-                        'world_distance': distance_world[0, 0],
-                    }
-                })
-
-            # write the results to influx
-            self.log.debug(f"Push data to influxdb\n{data}")
-            self.get_influxdb().write_points(data)
-
-            # ack message
-            channel.basic_ack(delivery_tag=method.delivery_tag)
-        except json.decoder.JSONDecodeError as e:
-            tmp_file = f"json_body_dump_{datetime.now()}.json"
-            with open(tmp_file, 'wb') as fp:
-                fp.write(body)
-
-            self.log.exception(f"Could not parse json message. Message dump is stored at '{tmp_file}'")
-            # ack message -> do not do this kids!
-            channel.basic_ack(delivery_tag=method.delivery_tag)
-        finally:
-            pass
+    def score_windows(self, windows):
+        # fit all windows to the world model
+        vects = self.project(self.vectorise(windows))
+        self.log.debug(vects)
+
+        outlier_world = self.get_world_model().predict(vects)
+        distance_world = self.get_world_model().decision_function(vects).reshape(-1)
+
+        # predict them against the models of their agents, all rows of an agent at once
+        outlier_local = np.empty(vects.shape[0])
+        distance_local = np.empty(vects.shape[0])
+        for agent, rows in self.group_rows(windows).items():
+            model = self.get_model_for_agent(agent)
+            outlier_local[rows] = model.predict(vects[rows])
+            distance_local[rows] = model.decision_function(vects[rows]).reshape(-1)
+
+        data = []
+        for window, outlier, distance, local, local_distance in zip(windows, outlier_world, distance_world, outlier_local, distance_local):
+            # -1 means outlier / 1 is an inlier
+            # we want to count the amount of outliers, so transform to
+            # 1 means outlier / 0 means inlier
+            data.append({
+                'time': window.start,
+                'measurement': 'svm',
+                'tags': self.get_result_tags(window),
+                'fields': {
+                    'local': 1 if local < 0 else 0,
+                    'local_inlier': 0 if local < 0 else 1,
+                    'local_distance': local_distance,
+                    'world': 1 if outlier < 0 else 0,
+                    'world_inlier': 0 if outlier < 0 else 1,
+                    'world_distance': distance,
+                }
+            })
+
+        return data
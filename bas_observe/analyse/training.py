@@ -0,0 +1,83 @@
+"""
+Trains multiple analysers from a single pass over the stored windows
+"""
+from collections import OrderedDict
+import itertools
+import logging
+
+from .base import BaseAnalyser, TRAIN_ON_MATRIX, TRAIN_ON_WINDOWS
+from .. import features, vectoriser
+
+
+log = logging.getLogger('TRAINING')
+
+_DENSE_KIND = (features.FeatureMatrixBuilder.__name__, vectoriser.WINDOW_VECTOR_SIZE)
+
+
+def _vectorise_into(windows, builders: []):
+    """Passes the windows through, while adding them to the feature matrices"""
+    for window in windows:
+        for builder in builders:
+            builder.add_window(window)
+        yield window
+
+
+def _feature_kind(analyser: BaseAnalyser) -> (str, int):
+    """Analysers with the same kind of feature vectors share one training matrix"""
+    builder = analyser.get_feature_builder()
+    return builder.__class__.__name__, builder.width
+
+
+def train_analysers(analysers: [BaseAnalyser], start: int, end: int) -> None:
+    """Trains all analysers from the windows between start and end
+
+    The windows are fetched from the storage once. Analysers trained on windows consume
+    that stream, while it is vectorised into one feature matrix per kind of feature vectors
+    (dense or sparse), each shared by all analysers trained on that kind of matrix.
+    With a feature cache, the dense matrix is mostly read from the cache instead.
+    All models are saved after every analyser was trained.
+    """
+    window_analysers = [analyser for analyser in analysers if analyser.TRAINING_INPUT == TRAIN_ON_WINDOWS]
+    matrix_analysers = [analyser for analyser in analysers if analyser.TRAINING_INPUT == TRAIN_ON_MATRIX]
+    # all analysers share the config, hence the storage
+    storage = analysers[0].get_storage()
+
+    kinds = OrderedDict()  # {kind: first analyser of that kind}
+    for analyser in matrix_analysers:
+        kinds.setdefault(_feature_kind(analyser), analyser)
+
+    builders = {}  # {kind: builder}, for all matrices vectorised from the stream
+    for kind, analyser in kinds.items():
+        if not (analyser.conf.feature_cache and kind == _DENSE_KIND):
+            builders[kind] = analyser.get_feature_builder()
+
+    if window_analysers or builders:
+        windows = storage.get_windows(start, end)
+        if builders:
+            windows = _vectorise_into(windows, list(builders.values()))
+
+        if window_analysers:
+            # further consumers get the windows buffered by tee
+            streams = itertools.tee(windows, len(window_analysers)) if len(window_analysers) > 1 else [windows]
+            for analyser, stream in zip(window_analysers, streams):
+                log.info(f"Train {analyser.__class__.__name__}")
+                analyser.train_windows(stream)
+        else:
+            # only the matrices consume the windows
+            for window in windows:
+                pass
+
+    matrices = {}
+    for kind, analyser in kinds.items():
+        if kind in builders:
+            log.info(f"Vectorised {len(builders[kind])} windows for training")
+            matrices[kind] = builders.pop(kind).finish()
+        else:
+            matrices[kind] = analyser.get_training_matrix(start, end)
+
+    for analyser in matrix_analysers:
+        log.info(f"Train {analyser.__class__.__name__}")
+        analyser.train_matrix(matrices[_feature_kind(analyser)])
+
+    for analyser in analysers:
+        analyser.save_model()
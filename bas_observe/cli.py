@@ -4,19 +4,66 @@ BAS Observe
 Main entrypoint for the command line interface.
 Called in __module__.py
 """
+import json
 import logging
-from datetime import datetime, timedelta
+import os
+from datetime import timedelta
 
 import click
 import baos_knx_parser as knx
 
-from . import config, misc
+from . import config, metrics, misc, profiling
 from .manage.agent import SimulatedAgent
 from .manage.collector import Collector
+from .manage.rollup import WindowRollup, resolution_to_ns
+from .manage.pipeline import Pipeline, StorageSink, FileSink
+from .manage.loadgen import LoadGenerator
+from .synthetic import TrafficProfile, DEFAULT_APCI_MIX
 from .analyse.addr import AddrAnalyser
 from .analyse.lof import LofAnalyser
 from .analyse.entropy import EntropyAnalyser
 from .analyse.svm import SvmAnalyser
+from .analyse.approx_svm import KERNEL_APPROXIMATIONS
+from .analyse.lof_index import INDEX_TYPES
+from .analyse.training import train_analysers
+from .analyse.projection import REDUCTIONS
+from .analyse.backtest import Backtest
+
+
+ANALYSER_CLASSES = {
+    'addr': AddrAnalyser,
+    'entropy': EntropyAnalyser,
+    'lof': LofAnalyser,
+    'svm': SvmAnalyser,
+}
+
+
+def validate_resolution(ctx, param, value):
+    """Checks that a resolution (or each of multiple) is a finite duration like 15m"""
+    for resolution in (value if isinstance(value, tuple) else [value]):
+        try:
+            if resolution:
+                resolution_to_ns(resolution)
+        except ValueError as e:
+            raise click.BadParameter(str(e))
+
+    return value
+
+
+def parse_agent_filter(agent: [(str, int, int)], log) -> {knx.bitmask.Bitmask: str}:
+    """Creates the agent filter of a SimulatedAgent from <AGENT_NAME ADDR_FILTER ADDR_FILTER_MASK> options"""
+    agent_filter = {}
+    for a in agent:
+        if a[1] == 0 and a[2] == 0:
+            mask = None  # None mask means, that every traffic matches
+        else:
+            mask = knx.bitmask.Bitmask(a[1], a[2])
+        agent_filter[mask] = a[0]
+        log.info(f"Defined agent {a[0]} with {mask}")
+
+    agent_set = set(agent_filter.values())
+    log.info(f"{len(agent_set)} agents defined: {', '.join(agent_set)}")
+    return agent_filter
 
 
 @click.group()
@@ -24,9 +71,25 @@ from .analyse.svm import SvmAnalyser
 @click.option('-l', '--log-level', default='INFO', type=click.Choice(['DEBUG', 'INFO', 'WARN', 'ERROR', 'CRITICAL']))
 @click.option('--project', prompt=True, help="project name")
 @click.option('--amqp', default='amqp://localhost:5672', help="URL to the AMQP/RabbitMQ server")
-@click.option('--influxdb', default='http://localhost:8086/bob', help="URL to the InfluxDB server")
+@click.option('--storage', '--influxdb', 'storage', default='http://localhost:8086/bob',
+              help="URL to the InfluxDB server (http, https, udp) or a local SQLite file (sqlite:///path.db)")
+@click.option('--schema', default=misc.SCHEMA_SPLIT, type=click.Choice(misc.SCHEMAS),
+              help="Layout in which new windows are stored (split: one point per measurement, single: one point per window)")
+@click.option('--retention', multiple=True, type=str,
+              help="Retention of the raw or a rolled-up series as <SERIES=DURATION>, e.g. raw=90d, 1m=365d "
+                   "or windows_15m=180d for the windows rolled up to 15m (default: INF)")
+@click.option('--metrics-port', type=int, default=None,
+              help="Serve metrics in the Prometheus text format on http://localhost:<PORT>/metrics")
+@click.option('--trace-sample', type=float, default=0.01,
+              help="Share of the windows, whose end-to-end latency is written to the storage as pipeline_latency")
+@click.option('--profile', default=None, type=click.Choice(profiling.PROFILES),
+              help="Profile the command with cProfile (main thread) or by sampling the stacks of all threads")
+@click.option('--profile-out', default='profiles', help="Directory of the profile snapshots")
+@click.option('--profile-interval', type=int, default=60,
+              help="Seconds between the profile snapshots (0 only writes them on SIGUSR1 and on exit)")
 @click.pass_context
-def cli(ctx, log_file, log_level, project, amqp, influxdb):
+def cli(ctx, log_file, log_level, project, amqp, storage, schema, retention, metrics_port, trace_sample, profile, profile_out,
+        profile_interval):
     """Bas OBserve (BOb)."""
     config.setup_logging(level=log_level, logfile=log_file)
     log = logging.getLogger('CLI')  # re initiate logger
@@ -37,7 +100,28 @@ def cli(ctx, log_file, log_level, project, amqp, influxdb):
         ctx.exit()
     log.info(f"Started Bas OBserve with project {project}")
 
-    ctx.obj['CONF'] = config.Config(project_name=project, amqp_url=amqp, influxdb_url=influxdb)
+    retention_durations = {}
+    for entry in retention:
+        series, sep, duration = entry.partition('=')
+        windows = series.startswith('windows_')
+        if not sep or not windows and series not in ('raw', ) + tuple(name for name, seconds in misc.ROLLUPS):
+            raise click.BadParameter(f"Expected <SERIES=DURATION> with series raw, one of the roll-ups or windows_<RESOLUTION>, not '{entry}'", param_hint='--retention')
+        if windows:
+            validate_resolution(ctx, None, series[len('windows_'):])
+        misc.parse_duration(duration)  # validate
+        retention_durations[series] = duration
+
+    if not 0 <= trace_sample <= 1:
+        raise click.BadParameter(f"Expected a share between 0 and 1, not {trace_sample}", param_hint='--trace-sample')
+
+    ctx.obj['CONF'] = config.Config(project_name=project, amqp_url=amqp, storage_url=storage, storage_schema=schema,
+                                    retention=retention_durations, trace_sample_rate=trace_sample)
+
+    if metrics_port:
+        metrics.start_http_server(metrics_port)
+
+    if profile:
+        profiling.start(profile, profile_out, interval=profile_interval)
 
 
 @cli.command('simulate', short_help="simulates agents by injecting packets from a log file")
@@ -49,59 +133,221 @@ def cli(ctx, log_file, log_level, project, amqp, influxdb):
               help="Length of a window in seconds")
 @click.option('--limit', type=int, default=0,
               help="Maximum amount of KNX packets to parse")
-@click.option('--start', type=datetime, default=None,
+@click.option('--start', default=None,
               help="Timestamp where to start parsing the log")
-@click.option('--end', type=datetime, default=None,
+@click.option('--end', default=None,
               help="Timestamp where to stop parsing the log")
 @click.pass_context
 def simulate(ctx, dump, dump_format, agent, length, limit, start, end):
-    log = ctx.obj['LOG']
-    agent_filter = {}
-    for a in agent:
-        if a[1] == 0 and a[2] == 0:
-            mask = None  # None mask means, that every traffic matches
-        else:
-            mask = knx.bitmask.Bitmask(a[1], a[2])
-        agent_filter[mask] = a[0]
-        log.info(f"Defined agent {a[0]} with {mask}")
-
-    agent_set = set(agent_filter.values())
-    log.info(f"{len(agent_set)} agents defined: {', '.join(agent_set)}")
-
     agent = SimulatedAgent(
         ctx.obj['CONF'],
         dump,
         log_format=dump_format,
-        agent_filter=agent_filter,
+        agent_filter=parse_agent_filter(agent, ctx.obj['LOG']),
         window_length=timedelta(seconds=length) if length > 0 else None,
-        start=start,
-        end=end,
+        start=misc.parse_datetime(start) if start else None,
+        end=misc.parse_datetime(end) if end else None,
         limit=limit
     )
     agent.run()
 
 
-@cli.command('collector', short_help="collects agent windows to InfluxDB and forwards them to the analysers")
+@cli.command('loadgen', short_help="publishes synthetic windows of many agents at a target rate")
+@click.option('-n', '--agents', type=int, default=10, help="Number of simulated agents")
+@click.option('--prefix', default='load', help="Prefix of the agent names (e.g. load-0001)")
+@click.option('--rate', type=float, default=None,
+              help="Target rate in windows per second of all agents (default: real-time pace of the agents)")
+@click.option('--duration', type=float, default=None, help="Seconds to publish (default: until interrupted)")
+@click.option('--length', type=int, default=10, help="Length of a window in seconds")
+@click.option('--seed', default='0', help="Seed of the synthetic traffic")
+@click.option('--devices', type=int, default=64, help="Number of device (source) addresses per agent")
+@click.option('--groups', type=int, default=256, help="Number of group (destination) addresses per agent")
+@click.option('--skew', type=float, default=1.0, help="Skew of the address popularity (0 for uniform)")
+@click.option('--telegram-rate', type=float, default=5.0, help="Mean telegrams per second and agent")
+@click.option('--apci', multiple=True, help="Weight of an APCI in the mix as <NAME=WEIGHT>, e.g. GroupValueRead=10")
+@click.option('--burst-interval', type=int, default=0, help="Seconds between the starts of two bursts (0 disables bursts)")
+@click.option('--burst-length', type=int, default=10, help="Duration of a burst in seconds")
+@click.option('--burst-factor', type=float, default=10.0, help="Multiplier of the telegram rate during a burst")
+@click.option('--distinct', type=int, default=100, help="Distinct rounds of windows generated up front and published repeatedly")
+@click.option('--confirm', is_flag=True, help="Enable publisher confirms, so the publish latency includes the broker")
+@click.option('--report-interval', type=int, default=10, help="Interval in seconds of the progress reports")
+@click.option('--report', default=None, help="Write the final report as JSON to this file")
+@click.pass_context
+def loadgen(ctx, agents, prefix, rate, duration, length, seed, devices, groups, skew, telegram_rate, apci, burst_interval,
+            burst_length, burst_factor, distinct, confirm, report_interval, report):
+    apci_mix = {}
+    for entry in apci:
+        name, sep, weight = entry.partition('=')
+        try:
+            apci_mix[name] = float(weight)
+        except ValueError:
+            raise click.BadParameter(f"Expected <NAME=WEIGHT>, not '{entry}'", param_hint='--apci')
+
+    profile = TrafficProfile(devices=devices, groups=groups, skew=skew, rate=telegram_rate, burst_interval=burst_interval,
+                             burst_length=burst_length, burst_factor=burst_factor, apci_mix=apci_mix or dict(DEFAULT_APCI_MIX))
+    agent_names = [f"{prefix}-{i:04d}" for i in range(1, agents + 1)]
+    ctx.obj['LOG'].info(f"{len(agent_names)} agents defined: {agent_names[0]} .. {agent_names[-1]}")
+
+    generator = LoadGenerator(ctx.obj['CONF'], agent_names, profile=profile, rate=rate, duration=duration,
+                              window_length=length * misc.NS_PER_SECOND, seed=seed, distinct=distinct, confirm=confirm,
+                              report_interval=report_interval)
+    result = generator.run()
+
+    data = json.dumps(result, indent=2)
+    if report:
+        with open(report, mode='w') as fp:
+            fp.write(data)
+    click.echo(data)
+
+
+@cli.command('collector', short_help="collects agent windows to the storage and forwards them to the analysers")
 @click.option('-a', '--agent', nargs=1, type=str, multiple=True,
               help="defines the list of agents by name")
 @click.option('--relay/--no-relay', default=True)
+@click.option('--prefetch', type=int, default=1,
+              help="Amount of agent windows to receive and write as one batch")
+@click.option('--flush-timeout', type=int, default=1,
+              help="Maximum time in seconds to buffer an incomplete batch of agent windows")
+@click.option('--rollup', multiple=True, type=str, callback=validate_resolution,
+              help="Roll the agent windows up to this coarser resolution (e.g. 15m), stored and relayed separately")
 @click.pass_context
-def log(ctx, agent, relay):
+def log(ctx, agent, relay, prefetch, flush_timeout, rollup):
     log = ctx.obj['LOG']
     agent = set(agent)
     log.info(f"{len(agent)} agents defined: {', '.join(agent)}")
+    ctx.obj['CONF'].collector_prefetch = max(prefetch, 1)
+    ctx.obj['CONF'].collector_flush_timeout = flush_timeout
+    ctx.obj['CONF'].resolutions = list(rollup)
     log.info("Starting Collector")
     collector = Collector(ctx.obj['CONF'], agent, relay=relay)
     collector.run()
 
 
+@cli.command('rollup', short_help="rolls the stored agent windows up to a coarser resolution")
+@click.option('-r', '--resolution', required=True, callback=validate_resolution, help="Resolution of the rolled-up windows, e.g. 15m")
+@click.option('--start', help="Start date of the agent windows")
+@click.option('--end', default=None, help="End date of the agent windows")
+@click.option('--relay/--no-relay', default=False,
+              help="Leave the rolled-up windows unrelayed, so a collector with this resolution relays them")
+@click.pass_context
+def rollup(ctx, resolution, start, end, relay):
+    start = misc.parse_epoch(start)
+    end = misc.parse_epoch(end) if end else misc.now_epoch()
+    count = WindowRollup(ctx.obj['CONF'], resolution).roll_up(start, end, relayed=not relay)
+    ctx.obj['LOG'].info(f"Rolled up {count} windows to {resolution}")
+
+
+@cli.command('backtest', short_help="scores historical windows with a trained model without AMQP")
+@click.argument('analyser', type=click.Choice(sorted(ANALYSER_CLASSES)))
+@click.option('-m', '--model', help="Path to the trained model")
+@click.option('--start', default=None, help="Start date of the stored windows (or of the dump)")
+@click.option('--end', default=None, help="End date of the stored windows (or of the dump)")
+@click.option('-j', '--jobs', default=1, type=int, help="Number of processes scoring chunks in parallel (0 uses all CPUs)")
+@click.option('--chunk', default='1d', callback=validate_resolution, help="Time range of the stored windows scored by one process at once")
+@click.option('--batch-size', default=10000, type=int, help="Number of windows scored at once")
+@click.option('-r', '--resolution', default=None, callback=validate_resolution,
+              help="Score the windows rolled up to this resolution (e.g. 15m) instead of the agent windows")
+@click.option('--dump', default=None, help="Score the windows of a log file instead of the stored ones")
+@click.option('-f', '--dump-format', default='old', type=click.Choice(['old', 'new']))
+@click.option('-a', '--agent', nargs=3, type=(str, int, int), multiple=True,
+              help="defines an agent filter of the dump with <AGENT_NAME ADDR_FILTER ADDR_FILTER_MASK>")
+@click.option('--length', type=int, default=10, help="Length of a window of the dump in seconds")
+@click.option('--suffix', default=None,
+              help="Append this to the measurements of the results (e.g. lof_<SUFFIX>), so live results are kept")
+@click.pass_context
+def backtest(ctx, analyser, model, start, end, jobs, chunk, batch_size, resolution, dump, dump_format, agent, length, suffix):
+    conf = ctx.obj['CONF']
+    conf.resolution = resolution
+    runner = Backtest(ANALYSER_CLASSES[analyser](conf, model), jobs=jobs if jobs > 0 else os.cpu_count(),
+                      chunk_length=resolution_to_ns(chunk), batch_size=max(batch_size, 1), measurement_suffix=suffix)
+
+    if dump:
+        simulated_agent = SimulatedAgent(
+            conf,
+            dump,
+            log_format=dump_format,
+            agent_filter=parse_agent_filter(agent, ctx.obj['LOG']),
+            window_length=timedelta(seconds=length),
+            start=misc.parse_datetime(start) if start else None,
+            end=misc.parse_datetime(end) if end else None,
+        )
+        count = runner.run_windows(window for windows in simulated_agent.iter_windows() for window in windows)
+    elif not start:
+        raise click.BadParameter("Start date is required to score the stored windows", param_hint='--start')
+    else:
+        count = runner.run(misc.parse_epoch(start), misc.parse_epoch(end) if end else misc.now_epoch())
+
+    ctx.obj['LOG'].info(f"Backtest of {analyser} scored {count} windows")
+
+
+@cli.command('pipeline', short_help="replays a log file through agent, collector and analysers in one process")
+@click.argument('dump')
+@click.option('-f', '--dump-format', default='old', type=click.Choice(['old', 'new']))
+@click.option('-a', '--agent', nargs=3, type=(str, int, int), multiple=True,
+              help="defines an agent filter with <AGENT_NAME ADDR_FILTER ADDR_FILTER_MASK>")
+@click.option('--length', type=int, default=10, help="Length of a window in seconds")
+@click.option('--limit', type=int, default=0, help="Maximum amount of KNX packets to parse")
+@click.option('--start', default=None, help="Timestamp where to start parsing the log")
+@click.option('--end', default=None, help="Timestamp where to stop parsing the log")
+@click.option('--addr-model', default=None, help="Path to the addr model (skipped if not given)")
+@click.option('--entropy-model', default=None, help="Path to the entropy model (skipped if not given)")
+@click.option('--lof-model', default=None, help="Path to the lof model (skipped if not given)")
+@click.option('--svm-model', default=None, help="Path to the svm model (skipped if not given)")
+@click.option('-o', '--output', default=None, help="Write the results as JSON lines to this file")
+@click.option('--store/--no-store', default=None,
+              help="Write the results to the storage (default: only if no output file is given)")
+@click.option('--store-windows', is_flag=True, help="Write the agent windows to the storage, like the collector")
+@click.option('--queue-size', type=int, default=64, help="Maximum number of items waiting in front of each stage")
+@click.option('--batch-size', type=int, default=1000, help="Maximum number of queued windows an analyser scores at once")
+@click.pass_context
+def pipeline(ctx, dump, dump_format, agent, length, limit, start, end, addr_model, entropy_model, lof_model, svm_model,
+             output, store, store_windows, queue_size, batch_size):
+    conf = ctx.obj['CONF']
+    analysers = [ANALYSER_CLASSES[name](conf, model) for name, model in (
+        ('addr', addr_model), ('entropy', entropy_model), ('lof', lof_model), ('svm', svm_model)) if model]
+
+    sinks = []
+    if output:
+        sinks.append(FileSink(output))
+    if store or (store is None and not output):
+        sinks.append(StorageSink(conf))
+
+    simulated_agent = SimulatedAgent(
+        conf,
+        dump,
+        log_format=dump_format,
+        agent_filter=parse_agent_filter(agent, ctx.obj['LOG']),
+        window_length=timedelta(seconds=length),
+        start=misc.parse_datetime(start) if start else None,
+        end=misc.parse_datetime(end) if end else None,
+        limit=limit
+    )
+    Pipeline(conf, simulated_agent, analysers, sinks, queue_size=max(queue_size, 1),
+             batch_size=max(batch_size, 1), store_windows=store_windows).run()
+
+
 # -----------------------------------------------------------------------------
 
 
 @cli.group(short_help="starts one of the observation modules")
+@click.option('--retrain-interval', default=None,
+              help="Retrain the models in the background in this interval, e.g. 1d (lof and svm only)")
+@click.option('--retrain-period', default='7d', help="Duration of the recent history used for retraining")
+@click.option('--model-cache-entries', type=int, default=None, help="Maximum number of agent models kept in memory (lof and svm only)")
+@click.option('--model-cache-mb', type=int, default=None, help="Maximum memory of the agent models kept in memory (lof and svm only)")
+@click.option('--checkpoint-interval', type=int, default=None, help="Write changed models every n seconds (lof and svm only)")
+@click.option('-r', '--resolution', default=None, callback=validate_resolution,
+              help="Analyse the windows rolled up to this resolution (e.g. 15m) instead of the agent windows")
 @click.pass_context
-def analyse(ctx):
-    pass
+def analyse(ctx, retrain_interval, retrain_period, model_cache_entries, model_cache_mb, checkpoint_interval, resolution):
+    misc.parse_duration(retrain_interval)  # validate
+    misc.parse_duration(retrain_period)  # validate
+    ctx.obj['CONF'].retrain_interval = retrain_interval
+    ctx.obj['CONF'].retrain_period = retrain_period
+    ctx.obj['CONF'].model_cache_entries = model_cache_entries
+    ctx.obj['CONF'].model_cache_mb = model_cache_mb
+    ctx.obj['CONF'].checkpoint_interval = checkpoint_interval
+    ctx.obj['CONF'].resolution = resolution
 
 
 @analyse.command('addr', short_help="start address lookup observation")
@@ -114,34 +360,62 @@ def analyse_addr(ctx, model):
 
 @analyse.command('entropy', short_help="start entropy estimation")
 @click.option('-m', '--model', help="Path to the trained model")
+@click.option('--online', is_flag=True, help="Update the baseline with the scored windows")
+@click.option('--decay', type=float, default=1.0,
+              help="Weight of the former windows per update of a bucket (1.0 keeps the plain mean)")
+@click.option('--update-threshold', type=float, default=None,
+              help="Only windows with an entropy below this threshold update the baseline")
+@click.option('--snapshot-interval', type=int, default=300, help="Interval (in seconds) the online baseline is saved in")
 @click.pass_context
-def analyse_entropy(ctx, model):
-    analyser = EntropyAnalyser(ctx.obj['CONF'], model)
+def analyse_entropy(ctx, model, online, decay, update_threshold, snapshot_interval):
+    if not 0 < decay <= 1:
+        raise click.BadParameter("Decay has to be within (0, 1]", param_hint='--decay')
+
+    analyser = EntropyAnalyser(ctx.obj['CONF'], model, online=online, decay=decay, update_threshold=update_threshold,
+                               snapshot_interval=snapshot_interval)
     analyser.analyse()
 
 
 @analyse.command('lof', short_help="start local outlier factor observation")
 @click.option('-m', '--model', help="Path to the trained model")
+@click.option('--index', type=click.Choice(INDEX_TYPES), default=None, help="Neighbour index of new and retrained models")
+@click.option('--float32', is_flag=True, help="Store the training rows of brute force indices as float32")
+@click.option('--coreset', type=int, default=None, help="Reduce the training rows of new and retrained models")
 @click.pass_context
-def analyse_lof(ctx, model):
-    analyser = LofAnalyser(ctx.obj['CONF'], model)
+def analyse_lof(ctx, model, index, float32, coreset):
+    analyser = LofAnalyser(ctx.obj['CONF'], model, index=index, dtype='float32' if float32 else 'float64',
+                           coreset_size=coreset)
     analyser.analyse()
 
 
 @analyse.command('svm', short_help="start SVM observation")
 @click.option('-m', '--model', help="Path to the trained model")
+@click.option('--approximate', type=click.Choice(KERNEL_APPROXIMATIONS), default=None,
+              help="Kernel approximation used for models of agents, which were not trained")
 @click.pass_context
-def analyse_svm(ctx, model):
-    analyser = SvmAnalyser(ctx.obj['CONF'], model)
+def analyse_svm(ctx, model, approximate):
+    analyser = SvmAnalyser(ctx.obj['CONF'], model, approximation=approximate)
     analyser.analyse()
 
 
 # -----------------------------------------------------------------------------
 
-@cli.group(short_help="trains one of the observation modules from InfluxDB")
+@cli.group(short_help="trains one of the observation modules from the stored windows")
+@click.option('--feature-cache', default=None,
+              help="Directory caching the vectorised windows, so retraining only vectorises new windows")
+@click.option('--feature-cache-lag', default='1h',
+              help="Duration after the end of a day, until its windows are cached (late windows are missed otherwise)")
+@click.option('-j', '--jobs', default=1, type=int,
+              help="Number of processes fitting the per-agent models (0 uses all CPUs)")
+@click.option('-r', '--resolution', default=None, callback=validate_resolution,
+              help="Train on the windows rolled up to this resolution (e.g. 15m) instead of the agent windows")
 @click.pass_context
-def train(ctx):
-    pass
+def train(ctx, feature_cache, feature_cache_lag, jobs, resolution):
+    misc.parse_duration(feature_cache_lag)  # validate
+    ctx.obj['CONF'].feature_cache = feature_cache
+    ctx.obj['CONF'].feature_cache_lag = feature_cache_lag
+    ctx.obj['CONF'].resolution = resolution
+    ctx.obj['CONF'].jobs = jobs if jobs > 0 else os.cpu_count()
 
 
 @train.command('addr', short_help="gathers an address lookup table of a all address that have communicated")
@@ -151,8 +425,8 @@ def train(ctx):
 @click.pass_context
 def tain_addr(ctx, start, end, model):
     analyser = AddrAnalyser(ctx.obj['CONF'], model)
-    start = misc.parse_datetime(start)
-    end = misc.parse_datetime(end)
+    start = misc.parse_epoch(start)
+    end = misc.parse_epoch(end) if end else misc.now_epoch()
     analyser.train(start, end)
 
 
@@ -163,8 +437,8 @@ def tain_addr(ctx, start, end, model):
 @click.pass_context
 def train_entropy(ctx, start, end, model):
     analyser = EntropyAnalyser(ctx.obj['CONF'], model)
-    start = misc.parse_datetime(start)
-    end = misc.parse_datetime(end)
+    start = misc.parse_epoch(start)
+    end = misc.parse_epoch(end) if end else misc.now_epoch()
     analyser.train(start, end)
 
 
@@ -172,11 +446,24 @@ def train_entropy(ctx, start, end, model):
 @click.option('--start', help="Start date for the training data")
 @click.option('--end', default=None, help="End date for the training data")
 @click.option('-m', '--model', help="Path to the outputed model")
+@click.option('--index', type=click.Choice(INDEX_TYPES), default=None,
+              help="Persist a neighbour index for fast scoring instead of sklearn's LocalOutlierFactor")
+@click.option('--float32', is_flag=True, help="Store the training rows of brute force indices as float32")
+@click.option('--coreset', type=int, default=None, help="Reduce the training rows of each model to a random sample of this size")
+@click.option('--evaluate', type=int, default=0, help="Report latency and recall against an exact LOF on this many windows")
+@click.option('--reduce', type=click.Choice(REDUCTIONS), default=None,
+              help="Fit a projection ahead of the models, which reduces the feature vectors")
+@click.option('--components', type=int, default=15, help="Number of dimensions of the reduced feature vectors")
+@click.option('--sparse', is_flag=True, help="Train on sparse feature vectors (CSR matrices)")
+@click.option('--addr-histogram', is_flag=True,
+              help="Add the raw source and destination address histograms to the sparse feature vectors")
 @click.pass_context
-def train_lof(ctx, start, end, model):
-    analyser = LofAnalyser(ctx.obj['CONF'], model)
-    start = misc.parse_datetime(start)
-    end = misc.parse_datetime(end)
+def train_lof(ctx, start, end, model, index, float32, coreset, evaluate, reduce, components, sparse, addr_histogram):
+    analyser = LofAnalyser(ctx.obj['CONF'], model, index=index, dtype='float32' if float32 else 'float64',
+                           coreset_size=coreset, evaluate=evaluate, reduction=reduce, n_components=components,
+                           sparse=sparse, addr_histogram=addr_histogram)
+    start = misc.parse_epoch(start)
+    end = misc.parse_epoch(end) if end else misc.now_epoch()
     analyser.train(start, end)
 
 
@@ -184,14 +471,63 @@ def train_lof(ctx, start, end, model):
 @click.option('--start', help="Start date for the training data")
 @click.option('--end', default=None, help="End date for the training data")
 @click.option('-m', '--model', help="Path to the outputed model")
+@click.option('--approximate', type=click.Choice(KERNEL_APPROXIMATIONS), default=None,
+              help="Train a linear SVM on an approximated RBF kernel (scales to large training sets)")
+@click.option('--reduce', type=click.Choice(REDUCTIONS), default=None,
+              help="Fit a projection ahead of the models, which reduces the feature vectors")
+@click.option('--components', type=int, default=15, help="Number of dimensions of the reduced feature vectors")
+@click.option('--sparse', is_flag=True, help="Train on sparse feature vectors (CSR matrices)")
+@click.option('--addr-histogram', is_flag=True,
+              help="Add the raw source and destination address histograms to the sparse feature vectors")
 @click.pass_context
-def train_svm(ctx, start, end, model):
-    analyser = SvmAnalyser(ctx.obj['CONF'], model)
-    start = misc.parse_datetime(start)
-    end = misc.parse_datetime(end)
+def train_svm(ctx, start, end, model, approximate, reduce, components, sparse, addr_histogram):
+    analyser = SvmAnalyser(ctx.obj['CONF'], model, approximation=approximate, reduction=reduce, n_components=components,
+                           sparse=sparse, addr_histogram=addr_histogram)
+    start = misc.parse_epoch(start)
+    end = misc.parse_epoch(end) if end else misc.now_epoch()
     analyser.train(start, end)
 
 
+@train.command('all', short_help="trains multiple modules from a single pass over the windows")
+@click.option('--start', help="Start date for the training data")
+@click.option('--end', default=None, help="End date for the training data")
+@click.option('--addr-model', default=None, help="Path to the outputed addr model (skipped if not given)")
+@click.option('--entropy-model', default=None, help="Path to the outputed entropy model (skipped if not given)")
+@click.option('--lof-model', default=None, help="Path to the outputed lof model (skipped if not given)")
+@click.option('--svm-model', default=None, help="Path to the outputed svm model (skipped if not given)")
+@click.option('--lof-index', type=click.Choice(INDEX_TYPES), default=None, help="Neighbour index of the lof models")
+@click.option('--svm-approximate', type=click.Choice(KERNEL_APPROXIMATIONS), default=None,
+              help="Kernel approximation of the svm models")
+@click.option('--reduce', type=click.Choice(REDUCTIONS), default=None,
+              help="Fit a projection ahead of the models, which reduces the feature vectors")
+@click.option('--components', type=int, default=15, help="Number of dimensions of the reduced feature vectors")
+@click.option('--sparse', is_flag=True, help="Train on sparse feature vectors (CSR matrices)")
+@click.option('--addr-histogram', is_flag=True,
+              help="Add the raw source and destination address histograms to the sparse feature vectors")
+@click.pass_context
+def train_all(ctx, start, end, addr_model, entropy_model, lof_model, svm_model, lof_index, svm_approximate, reduce, components,
+              sparse, addr_histogram):
+    conf = ctx.obj['CONF']
+    analysers = []
+    if addr_model:
+        analysers.append(AddrAnalyser(conf, addr_model))
+    if entropy_model:
+        analysers.append(EntropyAnalyser(conf, entropy_model))
+    if lof_model:
+        analysers.append(LofAnalyser(conf, lof_model, index=lof_index, reduction=reduce, n_components=components,
+                                     sparse=sparse, addr_histogram=addr_histogram))
+    if svm_model:
+        analysers.append(SvmAnalyser(conf, svm_model, approximation=svm_approximate, reduction=reduce, n_components=components,
+                                     sparse=sparse, addr_histogram=addr_histogram))
+
+    if not analysers:
+        raise click.UsageError("Give the model path of at least one module to train")
+
+    start = misc.parse_epoch(start)
+    end = misc.parse_epoch(end) if end else misc.now_epoch()
+    train_analysers(analysers, start, end)
+
+
 @train.command('arm')
 @click.pass_context
 def train_arm(ctx):
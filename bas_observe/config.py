@@ -7,11 +7,15 @@ import sys
 import logging
 import urllib.parse
 
-from attr import attrs, attrib
+from attr import attrs, attrib, Factory
 import pika
 import influxdb
 
+from . import misc
 from .queue import declare_amqp_pipeline
+from .storage.base import BaseStorage
+from .storage.influx import InfluxStorage
+from .storage.sqlite import SqliteStorage
 
 
 log = logging.getLogger('CONFIG')
@@ -24,27 +28,62 @@ class Config(object):
     Attributes:
         project_name        Name of the observation project. Used to determine AMQP topics and InfluxDB database
         amqp_url            URL to the AMQP/RabbitMQ server
-        influxdb_url        URL to the InfluxDB server
+        storage_url         URL to the storage. Either an InfluxDB server (http, https, udp)
+                            or a local SQLite file (sqlite:///relative/path.db, sqlite:////absolute/path.db)
 
     """
 
     project_name = attrib()  # type: str
     amqp_url = attrib()  # type: str
-    influxdb_url = attrib()  # type: str
+    storage_url = attrib()  # type: str
     # timeout between the checks, if messages can be relayed to the analysers
     relay_timeout = attrib(default=1)  # type: int
     # maximum time to wait for all agent windows to appear
     window_wait_timeout = attrib(default=4)  # type: int
     # size of thread pool
     pool_size = attrib(default=4)  # type: int
+    # amount of unacknowledged agent windows the collector gets delivered at once
+    collector_prefetch = attrib(default=1)  # type: int
+    # maximum time (in seconds) the collector buffers agent windows before writing them
+    collector_flush_timeout = attrib(default=1)  # type: int
+    # layout in which new agent windows are stored in the InfluxDB (cf. misc.SCHEMAS)
+    storage_schema = attrib(default='split')  # type: str
+    # retention durations of the raw series ('raw'), the rolled-up series (cf. misc.ROLLUPS)
+    # and the windows rolled up to a resolution (e.g. 'windows_15m')
+    # e.g. {'raw': '90d', '1m': '365d'}. Missing entries are kept forever
+    retention = attrib(default=Factory(dict))  # type: dict
+    # interval (in seconds) in which the storage maintenance (e.g. roll-ups) is triggered
+    maintenance_interval = attrib(default=60)  # type: int
+    # directory of the on-disk cache of vectorised windows used for training (None disables it)
+    feature_cache = attrib(default=None)  # type: str
+    # duration after the end of a time slot, until its windows are considered complete and are cached
+    feature_cache_lag = attrib(default='1h')  # type: str
+    # number of processes fitting the per-agent models during training
+    jobs = attrib(default=1)  # type: int
+    # interval (as duration, e.g. 1d) in which running analysers retrain their models (None disables it)
+    retrain_interval = attrib(default=None)  # type: str
+    # duration of the recent history the models are retrained from
+    retrain_period = attrib(default='7d')  # type: str
+    # budget of the per-agent model cache of the analysers (None for no limit)
+    model_cache_entries = attrib(default=None)  # type: int
+    model_cache_mb = attrib(default=None)  # type: int
+    # interval (in seconds) in which analysers write their changed models (None only saves on shutdown)
+    checkpoint_interval = attrib(default=None)  # type: int
+    # coarser resolutions (as duration, e.g. 15m) the collector rolls the agent windows up to
+    resolutions = attrib(default=Factory(list))  # type: list
+    # resolution of the windows analysers subscribe to and train on (None for the agent windows)
+    resolution = attrib(default=None)  # type: str
+    # share of the windows (between 0 and 1), whose end-to-end latency is written to the storage
+    trace_sample_rate = attrib(default=0.01)  # type: float
 
     _amqp_connection = attrib(default=None)
     _influxdb_connection = attrib(default=None)
+    _storage = attrib(default=None)
 
     def parse_influxdb_url(self):
-        url = urllib.parse.urlparse(self.influxdb_url)
+        url = urllib.parse.urlparse(self.storage_url)
         if url.scheme not in ('http', 'https', 'udp'):
-            raise ValueError(f"Only http, https, and udp are supported as protocoll for InfluxDB, not {self.influxdb_url}")
+            raise ValueError(f"Only http, https, and udp are supported as protocoll for InfluxDB, not {self.storage_url}")
 
         result = {
             'scheme': url.scheme,
@@ -82,18 +121,18 @@ class Config(object):
 
         return self._amqp_connection
 
-    def get_amqp_channel(self) -> pika.channel.Channel:
+    def get_amqp_channel(self, prefetch_count: int=1) -> pika.channel.Channel:
         connection = self.get_amqp_connection()
         log.info("Get new AMQP channel")
         channel = connection.channel()
         # just in case declare the pipelines every time a new channel is opened
-        declare_amqp_pipeline(self, channel)
+        declare_amqp_pipeline(self, channel, prefetch_count=prefetch_count)
         return channel
 
     def get_influxdb_connection(self) -> influxdb.InfluxDBClient:
         if not self._influxdb_connection:
             param = self.parse_influxdb_url()
-            log.debug(f"Attemp connection to InfluxDB at {self.influxdb_url}")
+            log.debug(f"Attemp connection to InfluxDB at {self.storage_url}")
             self._influxdb_connection = influxdb.InfluxDBClient(
                 host=param['host'],
                 port=param['port'],
@@ -104,10 +143,40 @@ class Config(object):
                 use_udp=True if param['scheme'] == 'udp' else False,
                 udp_port=param['port']
             )
-            log.info(f"Connected to InfluxDB at {self.influxdb_url}")
+            log.info(f"Connected to InfluxDB at {self.storage_url}")
 
         return self._influxdb_connection
 
+    def get_retention(self, series: str) -> str:
+        """Returns the retention duration for the raw or a rolled-up series, or the windows of a resolution"""
+        return self.retention.get(series, misc.RETENTION_INFINITE)
+
+    def parse_sqlite_url(self) -> str:
+        """Returns the path of the SQLite database file
+        sqlite:///bob.db is relative to the working directory, sqlite:////var/bob.db is absolute
+        and sqlite:// is a volatile in-memory database
+        """
+        url = urllib.parse.urlparse(self.storage_url)
+        path = url.netloc + url.path
+        if not path:
+            return ':memory:'
+        elif path[0] == '/':
+            path = path[1:]
+
+        return path
+
+    def get_storage(self) -> BaseStorage:
+        if not self._storage:
+            scheme = urllib.parse.urlparse(self.storage_url).scheme
+            if scheme == 'sqlite':
+                self._storage = SqliteStorage(self, self.parse_sqlite_url())
+            elif scheme in ('http', 'https', 'udp'):
+                self._storage = InfluxStorage(self)
+            else:
+                raise ValueError(f"Unsupported storage URL {self.storage_url}")
+
+        return self._storage
+
     @property
     def name_exchange_agents(self) -> str:
         return f'bob-{self.project_name}-exchange-agents'
@@ -118,26 +187,36 @@ class Config(object):
 
     @property
     def name_exchange_analyser(self) -> str:
+        return self.get_name_exchange_analyser(self.resolution)
+
+    def get_name_exchange_analyser(self, resolution: str=None) -> str:
+        """Name of the exchange relaying the windows of resolution (None for the agent windows)"""
+        if resolution:
+            return f'bob-{self.project_name}-exchange-analyser-{resolution}'
+
         return f'bob-{self.project_name}-exchange-analyser'
 
-    def _name_queue_analyser(self, name) -> str:
+    def _name_queue_analyser(self, name, resolution: str=None) -> str:
+        if resolution:
+            return f'bob-{self.project_name}-queue-analyzer-{name}-{resolution}'
+
         return f'bob-{self.project_name}-queue-analyzer-{name}'
 
     @property
     def name_queue_analyser_addr(self) -> str:
-        return self._name_queue_analyser('addr')
+        return self._name_queue_analyser('addr', self.resolution)
 
     @property
     def name_queue_analyser_entropy(self) -> str:
-        return self._name_queue_analyser('entropy')
+        return self._name_queue_analyser('entropy', self.resolution)
 
     @property
     def name_queue_analyser_lof(self) -> str:
-        return self._name_queue_analyser('lof')
+        return self._name_queue_analyser('lof', self.resolution)
 
     @property
     def name_queue_analyser_svm(self) -> str:
-        return self._name_queue_analyser('svm')
+        return self._name_queue_analyser('svm', self.resolution)
 
 
 def setup_logging(level=logging.WARN, logfile=None) -> None:
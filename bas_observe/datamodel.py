@@ -1,18 +1,29 @@
 """
 Package containing all common data model classes for BOb
 """
-from datetime import datetime
-
 from . import misc
 
 
+# hops of a window through the system, in the order they are passed
+# agent         agent finished the window and publishes it
+# collector     collector received it from the agent
+# relay         collector relays it to the analysers
+# analyser      analyser received it
+# scored        analyser scored it
+# written       analyser wrote the results to the storage
+TRACE_STAGES = ('agent', 'collector', 'relay', 'analyser', 'scored', 'written')
+
+
 class Window(object):
     """Analystic window
+
+    start and end are nanoseconds since the epoch, so are the timestamps of the trace
+    record, which tells when the window passed the hops of the system (cf. TRACE_STAGES)
     """
 
-    def __init__(self, start: datetime, agent: str, end: datetime=None):
-        self.start: datetime = start
-        self.end: datetime = end
+    def __init__(self, start: int, agent: str, end: int=None):
+        self.start: int = start
+        self.end: int = end
         self.agent: str = agent
         self.finished: bool = False if not end else True
 
@@ -23,7 +34,13 @@ class Window(object):
         self.hop_count = {}
         self.priority = {}
 
-    def finish(self, end: datetime) -> None:
+        self.trace = {}  # {stage: time}
+
+    def mark(self, stage: str, time: int=None) -> None:
+        """Records that the window passed the stage (now, if no time is given)"""
+        self.trace[stage] = time if time is not None else misc.now_epoch()
+
+    def finish(self, end: int) -> None:
         if self.finished:
             raise ValueError("Cannot finish a window that is already finished")
 
@@ -31,10 +48,10 @@ class Window(object):
         self.end = end
 
     def to_dict(self) -> {}:
-        return {
+        d = {
             'agent': self.agent,
-            'start': misc.format_datetime(self.start),
-            'end': misc.format_datetime(self.end),
+            'start': self.start,
+            'end': self.end,
             'src': self.src_addr,
             'dest': self.dest_addr,
             'apci': self.apci,
@@ -42,14 +59,19 @@ class Window(object):
             'hop_count': self.hop_count,
             'priority': self.priority,
         }
+        if self.trace:
+            d['trace'] = self.trace
+
+        return d
 
     @classmethod
     def from_dict(cls, d):
         """initiates a window from a dict
         """
 
-        window = cls(start=misc.parse_datetime(d['start']), agent=d['agent'])
-        window.end = misc.parse_datetime(d['end']) if d.get('end', None) else None
+        # timestamps are sent as epoch, but messages of older agents still carry strings
+        window = cls(start=misc.parse_epoch(d['start']), agent=d['agent'])
+        window.end = misc.parse_epoch(d['end']) if d.get('end', None) else None
         window.finished = False if not window.end else True
 
         window.src_addr = d.get('src', {})
@@ -58,5 +80,58 @@ class Window(object):
         window.length = d.get('length', {})
         window.hop_count = d.get('hop_count', {})
         window.priority = d.get('priority', {})
+        # messages of older agents do not carry a trace record
+        window.trace = dict(d.get('trace', None) or {})
+
+        return window
+
+    @classmethod
+    def from_influxdb_point(cls, d):
+        """initiates a window from a point of the single point storage layout
+        """
+
+        window = cls(start=misc.parse_epoch(d['time']), agent=d['agent'])
+        # older versions stored the end as string field 'end'
+        window.end = misc.parse_epoch(d.get('end_ns', None) or d.get('end', None))
+        window.finished = False if not window.end else True
+
+        for key, value in d.items():
+            measurement, sep, counter = key.partition(misc.COUNTER_SEPARATOR)
+            if key.startswith(misc.TRACE_FIELD_PREFIX) and value is not None:
+                window.trace[key[len(misc.TRACE_FIELD_PREFIX):]] = int(value)
+                continue
+            elif not sep or measurement not in misc.MEASUREMENTS or value is None:
+                # not a counter, or a counter which is only present in other windows of the query
+                continue
+
+            getattr(window, measurement)[counter] = value
 
         return window
+
+
+def merge_counters(counters: [{}]) -> {}:
+    """Sums up the amounts of multiple counter dicts"""
+    merged = {}
+    for counter in counters:
+        for key, amount in counter.items():
+            merged[key] = merged.get(key, 0) + (amount or 0)
+
+    return merged
+
+
+def merge_windows(windows: [Window], start: int=None, end: int=None) -> Window:
+    """Merges consecutive windows of one agent into one coarser window
+    The counters are summed up, start and end default to the earliest start and latest end.
+    """
+    if not windows:
+        raise ValueError("Cannot merge an empty list of windows")
+
+    merged = Window(
+        start=start if start is not None else min(window.start for window in windows),
+        agent=windows[0].agent,
+        end=end if end is not None else max(window.end or window.start for window in windows),
+    )
+    for measurement in misc.MEASUREMENTS:
+        setattr(merged, measurement, merge_counters(getattr(window, measurement) for window in windows))
+
+    return merged
@@ -0,0 +1,288 @@
+"""
+This module contains helpers to build feature matrices from (many) windows
+and to cache the vectorised windows on disk
+"""
+import json
+import logging
+import os
+import os.path
+
+import numpy as np
+
+from . import datamodel, misc, vectoriser
+
+
+class FeatureMatrix(object):
+    """Contiguous feature matrix of all windows with the rows grouped by agent
+
+    Attributes:
+        X               Matrix with one row per window (a scipy CSR matrix for sparse features)
+        agents          Dict mapping the agent names to the slice of their rows in X
+    """
+
+    def __init__(self, X: np.ndarray, agents: {str: slice}):
+        self.X = X
+        self.agents = agents
+
+    def __len__(self):
+        return self.X.shape[0]
+
+    def for_agent(self, agent: str) -> np.ndarray:
+        """Returns the rows of one agent as view on X (no copy)"""
+        return self.X[self.agents[agent]]
+
+
+class FeatureMatrixBuilder(object):
+    """Streams feature vectors into preallocated chunks per agent
+
+    Rows are collected in fixed-size buffers, so adding a row never copies the rows
+    added before. finish() assembles them into one contiguous matrix, in which the
+    rows of every agent form one block, so the per-agent matrices are views.
+    """
+
+    def __init__(self, width: int=vectoriser.WINDOW_VECTOR_SIZE, dtype=np.float64, chunk_size: int=4096):
+        """
+        Attributes:
+            width           Number of features per row
+            dtype           dtype of the resulting matrix
+            chunk_size      Number of rows allocated at once (per agent)
+        """
+        self.width = width
+        self.dtype = dtype
+        self.chunk_size = chunk_size
+
+        self._chunks = {}  # {agent: [[np.array, number of used rows], ...]}
+        self._rows = 0
+
+    def __len__(self):
+        return self._rows
+
+    def add(self, agent: str, vect: np.ndarray) -> None:
+        chunks = self._chunks.setdefault(agent, [])
+        if not chunks or chunks[-1][1] >= chunks[-1][0].shape[0]:
+            chunks.append([np.empty((self.chunk_size, self.width), dtype=self.dtype), 0])
+
+        chunk = chunks[-1]
+        chunk[0][chunk[1]] = vect
+        chunk[1] += 1
+        self._rows += 1
+
+    def add_window(self, window: datamodel.Window) -> None:
+        self.add(window.agent, vectoriser.vectorise_window(window))
+
+    def add_block(self, agent: str, X: np.ndarray) -> None:
+        """Adds multiple rows at once (without copying them before finish() is called)
+        e.g. a memory-mapped segment of the FeatureStore
+        """
+        if X.shape[0] == 0:
+            return
+
+        # a block is always completely used, so following rows go into a new chunk
+        self._chunks.setdefault(agent, []).append([X, X.shape[0]])
+        self._rows += X.shape[0]
+
+    def finish(self) -> FeatureMatrix:
+        """Assembles the contiguous matrix and releases the chunks while copying them"""
+        X = np.empty((self._rows, self.width), dtype=self.dtype)
+        agents = {}
+
+        row = 0
+        for agent in list(self._chunks.keys()):
+            start = row
+            chunks = self._chunks.pop(agent)
+            while chunks:
+                chunk, size = chunks.pop(0)
+                X[row:row + size] = chunk[:size]
+                row += size
+
+            agents[agent] = slice(start, row)
+
+        self._rows = 0
+        return FeatureMatrix(X, agents)
+
+
+class SparseFeatureMatrixBuilder(object):
+    """Collects sparse feature vectors into a CSR matrix with the rows grouped by agent
+
+    The non-zero entries are computed from the window counters directly, so neither the
+    single vectors nor the matrix are ever densified.
+    """
+
+    def __init__(self, addr_histogram: bool=False):
+        """
+        Attributes:
+            addr_histogram  Add the raw address histograms to the feature vectors
+        """
+        self.addr_histogram = addr_histogram
+        self.width = vectoriser.sparse_vector_size(addr_histogram)
+
+        self._rows = {}  # {agent: [(indices, values), ...]}
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def add_window(self, window: datamodel.Window) -> None:
+        self._rows.setdefault(window.agent, []).append(
+            vectoriser.sparse_window_entries(window, addr_histogram=self.addr_histogram))
+        self._count += 1
+
+    def finish(self) -> FeatureMatrix:
+        rows = []
+        agents = {}
+        for agent in list(self._rows.keys()):
+            start = len(rows)
+            rows.extend(self._rows.pop(agent))
+            agents[agent] = slice(start, len(rows))
+
+        self._count = 0
+        return FeatureMatrix(vectoriser.sparse_rows_to_csr(rows, self.width), agents)
+
+
+class FeatureStore(object):
+    """On-disk cache of vectorised windows, so training only vectorises new windows
+
+    The vectors are stored per project, time slot and agent as .npy segments:
+    ```
+    <path>/<project>/manifest.json
+    <path>/<project>/<slot start>/<agent>.npy
+    ```
+    Rolled-up windows are cached separately per resolution in <path>/<project>-<resolution>.
+    The manifest lists all completely cached slots. Only slots, which ended at least lag
+    nanoseconds ago, are cached. It is assumed that no more windows (e.g. delayed by the
+    relay or rolled up late) are written to those.
+    """
+    LOGGER_NAME = 'FEATURE STORE'
+    MANIFEST = 'manifest.json'
+
+    def __init__(self, path: str, project_name: str, slot_length: int=24 * 60 * 60 * misc.NS_PER_SECOND,
+                 resolution: str=None, lag: int=60 * 60 * misc.NS_PER_SECOND):
+        """
+        Attributes:
+            path            Directory of the cache
+            project_name    Name of the observation project
+            slot_length     Length of one cached time slot in nanoseconds
+            resolution      Resolution of the cached windows (None for the agent windows)
+            lag             Nanoseconds after the end of a slot, until it is cached
+        """
+        self.directory = os.path.join(path, f'{project_name}-{resolution}' if resolution else project_name)
+        self.slot_length = slot_length
+        self.lag = lag
+        self.log = logging.getLogger(self.LOGGER_NAME)
+
+        os.makedirs(self.directory, exist_ok=True)
+        self.manifest = self._load_manifest()
+
+    def _load_manifest(self) -> {}:
+        empty = {
+            'version': vectoriser.WINDOW_VECTOR_VERSION,
+            'width': vectoriser.WINDOW_VECTOR_SIZE,
+            'slot_length': self.slot_length,
+            'slots': {},  # {slot start: {agent: number of rows}}
+        }
+
+        try:
+            with open(os.path.join(self.directory, self.MANIFEST), mode='r') as fp:
+                manifest = json.load(fp)
+        except FileNotFoundError:
+            return empty
+
+        for key in ('version', 'width', 'slot_length'):
+            if manifest.get(key) != empty[key]:
+                self.log.warning(f"Cached features have a different {key} ({manifest.get(key)} instead of {empty[key]}). Ignoring them.")
+                return empty
+
+        return manifest
+
+    def _save_manifest(self) -> None:
+        with misc.atomic_write(os.path.join(self.directory, self.MANIFEST), mode='w') as fp:
+            json.dump(self.manifest, fp)
+
+    def _segment_path(self, slot_start: int, agent: str) -> str:
+        return os.path.join(self.directory, str(slot_start), f'{agent}.npy')
+
+    def slots(self, start: int, end: int) -> [(int, int)]:
+        """Returns all slots lying completely between start (exclusive) and end"""
+        slot_start = -(-(start + 1) // self.slot_length) * self.slot_length  # ceil
+        slots = []
+        while slot_start + self.slot_length <= end:
+            slots.append((slot_start, slot_start + self.slot_length))
+            slot_start += self.slot_length
+
+        return slots
+
+    def covered_ranges(self) -> [(int, int)]:
+        """Returns the cached time ranges, merging adjacent slots"""
+        ranges = []
+        for slot_start in sorted(int(key) for key in self.manifest['slots'].keys()):
+            if ranges and ranges[-1][1] == slot_start:
+                ranges[-1] = (ranges[-1][0], slot_start + self.slot_length)
+            else:
+                ranges.append((slot_start, slot_start + self.slot_length))
+
+        return ranges
+
+    def load_slot(self, slot_start: int) -> {str: np.ndarray}:
+        """Returns the memory-mapped segments of a cached slot"""
+        return {
+            agent: np.load(self._segment_path(slot_start, agent), mmap_mode='r')
+            for agent in self.manifest['slots'][str(slot_start)].keys()
+        }
+
+    def store_slot(self, slot_start: int, segments: {str: np.ndarray}) -> None:
+        os.makedirs(os.path.join(self.directory, str(slot_start)), exist_ok=True)
+        for agent, X in segments.items():
+            with misc.atomic_write(self._segment_path(slot_start, agent), mode='wb') as fp:
+                np.save(fp, X)
+
+        # the manifest is only updated once all segments are written
+        self.manifest['slots'][str(slot_start)] = {agent: X.shape[0] for agent, X in segments.items()}
+        self._save_manifest()
+
+    def build_matrix(self, start: int, end: int, get_windows) -> FeatureMatrix:
+        """Assembles the feature matrix of all windows between start and end
+
+        Cached slots are read via mmap, all others are fetched by calling
+        get_windows(start, end) (both exclusive) and vectorised. Slots, which ended
+        more than lag ago, are added to the cache afterwards.
+        """
+        builder = FeatureMatrixBuilder()
+        now = misc.now_epoch()
+        cached = fetched = 0
+
+        position = start
+        for slot_start, slot_end in self.slots(start, end):
+            if position < slot_start - 1:
+                self._add_range(builder, position, slot_start, get_windows)
+
+            if str(slot_start) in self.manifest['slots']:
+                for agent, X in self.load_slot(slot_start).items():
+                    builder.add_block(agent, X)
+                cached += 1
+            elif slot_end + self.lag <= now:
+                segments = self._vectorise(get_windows(slot_start - 1, slot_end))
+                self.store_slot(slot_start, segments)
+                for agent, X in segments.items():
+                    builder.add_block(agent, X)
+                fetched += 1
+            else:
+                self._add_range(builder, slot_start - 1, slot_end, get_windows)
+
+            position = slot_end - 1
+
+        if position < end - 1:
+            self._add_range(builder, position, end, get_windows)
+
+        self.log.info(f"Read {cached} cached slots, vectorised and cached {fetched} slots")
+        return builder.finish()
+
+    def _add_range(self, builder: FeatureMatrixBuilder, start: int, end: int, get_windows) -> None:
+        for window in get_windows(start, end):
+            builder.add_window(window)
+
+    def _vectorise(self, windows) -> {str: np.ndarray}:
+        vects = {}
+        for window in windows:
+            vects.setdefault(window.agent, []).append(vectoriser.vectorise_window(window))
+
+        return {agent: np.array(rows, dtype=np.float64).reshape((-1, vectoriser.WINDOW_VECTOR_SIZE)) for agent, rows in vects.items()}
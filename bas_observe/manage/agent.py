@@ -1,5 +1,7 @@
 import csv
-from datetime import datetime, timedelta, timezone
+import calendar
+from datetime import datetime, timedelta
+from functools import lru_cache
 from time import sleep
 import logging
 import json
@@ -8,12 +10,23 @@ import binascii
 import baos_knx_parser as knx
 
 from ..config import Config
-from .. import datamodel
+from .. import datamodel, metrics, misc
+
+
+@lru_cache(maxsize=64)
+def _day_epoch(day: str) -> int:
+    """nanoseconds since the epoch at the start of a YYYY-MM-DD formatted day (UTC)"""
+    return calendar.timegm((int(day[0:4]), int(day[5:7]), int(day[8:10]), 0, 0, 0)) * misc.NS_PER_SECOND
+
+
+def _time_of_day(time: str) -> int:
+    """nanoseconds since midnight of a HH:MM:SS formatted time"""
+    return (int(time[0:2]) * 3600 + int(time[3:5]) * 60 + int(time[6:8])) * misc.NS_PER_SECOND
 
 
 class AgentWindow(datamodel.Window):
 
-    def __init__(self, start: datetime, agent: str):
+    def __init__(self, start: int, agent: str):
         super().__init__(start, agent)
 
     def process_telegram(self, telegram) -> None:
@@ -86,6 +99,8 @@ class SimulatedAgent(BaseAgent):
                             Defaults to the very first log entry
             end             Datetime where to stop processing the log
                             Defaults to the very last log entry
+                            (naive datetimes are considered to be in UTC,
+                            like the timestamps in the log)
             limit           Maximum amount of telegrams to process
                             Defaults to None, indicating no boundary
         """
@@ -95,9 +110,10 @@ class SimulatedAgent(BaseAgent):
         self.log_format = log_format
         self.agent_filter = agent_filter
         self.agent_set = set(agent_filter.values())
-        self.window_length = window_length
-        self.start = start
-        self.end = end
+        # internally everything is handled as nanoseconds since the epoch
+        self.window_length = misc.duration_to_ns(window_length) if window_length else None
+        self.start = misc.to_epoch(start) if start else None
+        self.end = misc.to_epoch(end) if end else None
         self.limit = limit
 
         self.log.info(f"Initialized Simulated Agent for project {self.conf.project_name}")
@@ -109,6 +125,14 @@ class SimulatedAgent(BaseAgent):
         # init connection to AMQP server
         self.get_channel()
 
+        for windows in self.iter_windows():
+            self.submit_windows(windows)
+            sleep(0.5)
+
+    def iter_windows(self):
+        """Generator returning the finished windows of all agents, one list per window length
+        """
+
         # get generator with telegrams
         if self.log_format == 'old':
             log = self.read_log()
@@ -122,8 +146,10 @@ class SimulatedAgent(BaseAgent):
         windows = None
         for telegram in log:
             if next_window and telegram.timestamp >= next_window:
-                self.submit_windows(windows, next_window)
-                sleep(0.5)
+                for window in windows.values():
+                    window.finish(next_window)
+
+                yield list(windows.values())
                 windows = None
 
             if not windows:
@@ -135,13 +161,14 @@ class SimulatedAgent(BaseAgent):
                     # when mask is None, every traffic matches
                     windows[agent].process_telegram(telegram)
 
-    def submit_windows(self, windows, end: datetime):
-        for window in windows.values():
-            window.finish(end)
-            data = json.dumps(window.to_dict())
-            self.channel.basic_publish(exchange=self.conf.name_exchange_agents, routing_key='', body=data)
+    def submit_windows(self, windows: [AgentWindow]):
+        for window in windows:
+            window.mark('agent')
+            with metrics.timed(self.LOGGER_NAME, 'publish', windows=1):
+                data = json.dumps(window.to_dict())
+                self.channel.basic_publish(exchange=self.conf.name_exchange_agents, routing_key='', body=data)
 
-    def setup_new_windows(self, start: datetime) -> {str: AgentWindow}:
+    def setup_new_windows(self, start: int) -> {str: AgentWindow}:
         windows = {}
         for agent in self.agent_set:
             windows[agent] = AgentWindow(start, agent)
@@ -195,11 +222,9 @@ class SimulatedAgent(BaseAgent):
                     yield telegram
 
     def _parse_csv_date(self, date):
-        parsed = datetime.strptime(date, '%H:%M:%S %Y-%m-%d')
-        parsed.replace(tzinfo=timezone.utc)
-        return parsed
+        # '%H:%M:%S %Y-%m-%d' in UTC, parsed by hand, since strptime is way too slow for every telegram
+        return _day_epoch(date[9:19]) + _time_of_day(date[0:8])
 
     def _parse_new_csv_date(self, date):
-        parsed = datetime.strptime(date, '%Y-%m-%d %H:%M:%S')
-        parsed.replace(tzinfo=timezone.utc)
-        return parsed
+        # '%Y-%m-%d %H:%M:%S' in UTC
+        return _day_epoch(date[0:10]) + _time_of_day(date[11:19])
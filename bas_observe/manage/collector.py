@@ -1,11 +1,11 @@
 import logging
 import json
-from datetime import datetime
 from collections import OrderedDict
 from multiprocessing.pool import ThreadPool
 
 from ..config import Config
-from .. import datamodel, misc
+from .. import datamodel, metrics, misc
+from .rollup import WindowRollup
 
 
 class CollectorWindow(datamodel.Window):
@@ -14,45 +14,6 @@ class CollectorWindow(datamodel.Window):
     def from_dict(cls, d: {}):
         return super(CollectorWindow, cls).from_dict(d)
 
-    def influxdb_json(self, project_name: str) -> {}:
-        # time_str = misc.format_datetime(self.start)
-        time_str = misc.format_influx_datetime(self.start)
-        data = [
-            {
-                'time': time_str,
-                'measurement': 'agent_status',
-                'tags': {
-                    'project': project_name,
-                    'agent': self.agent,
-                },
-                'fields': {
-                    # 'end': misc.format_datetime(self.end),
-                    'end': misc.format_influx_datetime(self.end),
-                    'length': (self.end - self.start).seconds,
-                    'relayed': False,
-                    'count': sum(self.priority.values())  # get the overall number of telegrams from the priority, because it is a value with small range (aka. faster to sum)
-                }
-            }
-        ]
-        for field in misc.MEASUREMENTS:
-            value = getattr(self, field)
-            if not value:
-                # skip fields with empty values
-                print(f"skipped {field} because '{value}' seems empty")
-                continue
-
-            data.append({
-                'time': time_str,
-                'measurement': field,
-                'tags': {
-                    'project': project_name,
-                    'agent': self.agent,
-                },
-                'fields': value
-            })
-
-        return data
-
 
 class Collector(object):
     LOGGER_NAME = 'COLLECTOR'
@@ -69,10 +30,16 @@ class Collector(object):
         self.conf = conf
         self.log = None
         self.channel = None
-        self.influxdb = None
+        self.storage = None
         self.agent_set = agent_set
         self.relay = relay
 
+        # agent windows received, but not yet written to the storage and acknowledged
+        self._pending_tags = []
+        self._pending_windows = []
+        # roll the agent windows up to the coarser resolutions
+        self.rollups = [WindowRollup(conf, resolution) for resolution in conf.resolutions]
+
         self._init_log()
 
     def _init_log(self):
@@ -80,15 +47,15 @@ class Collector(object):
 
     def get_channel(self):
         if not self.channel:
-            self.channel = self.conf.get_amqp_channel()
+            self.channel = self.conf.get_amqp_channel(prefetch_count=self.conf.collector_prefetch)
 
         return self.channel
 
-    def get_influxdb(self):
-        if not self.influxdb:
-            self.influxdb = self.conf.get_influxdb_connection()
+    def get_storage(self):
+        if not self.storage:
+            self.storage = self.conf.get_storage()
 
-        return self.influxdb
+        return self.storage
 
     def run(self):
         """Runs the collector"""
@@ -98,17 +65,23 @@ class Collector(object):
         channel = self.get_channel()
         channel.basic_consume(self.on_agent_message, queue=self.conf.name_queue_agents, no_ack=False)
 
-        # get influxdb client
-        self.get_influxdb()
+        # get storage backend and make sure the database, retention policies and roll-ups exist
+        self.get_storage().setup()
 
         # run the loop
         try:
             self.log.info(f"Relaying windows is {'off' if self.relay is False else 'on'}")
+            self.log.info(f"Prefetching up to {self.conf.collector_prefetch} agent windows")
             self.log.info("Start waiting for messages")
             self.setup_relay_timeout()
+            self.setup_flush_timeout()
+            self.setup_maintenance_timeout()
+            self.setup_rollup_timeout()
             channel.start_consuming()
         except KeyboardInterrupt:
             channel.stop_consuming()
+            # write whatever is still buffered, before the connection goes away
+            self.flush_windows()
         finally:
             self.conf._amqp_connection.close()
 
@@ -126,22 +99,107 @@ class Collector(object):
 
         connection.add_timeout(self.conf.relay_timeout, self.relay_messages)
 
+    def setup_flush_timeout(self, connection=None):
+        """
+        sets up the timeout for writing buffered agent windows, so a partially filled
+        batch does not wait for further messages forever
+        """
+        if not connection:
+            connection = self.conf._amqp_connection
+
+        connection.add_timeout(self.conf.collector_flush_timeout, self._on_flush_timeout)
+
+    def _on_flush_timeout(self):
+        try:
+            self.flush_windows()
+        finally:
+            # whatever happens call this method again
+            self.setup_flush_timeout()
+
+    def setup_maintenance_timeout(self, connection=None):
+        """
+        sets up the timeout for the storage maintenance (e.g. roll-ups in the embedded storage)
+        """
+        if not connection:
+            connection = self.conf._amqp_connection
+
+        connection.add_timeout(self.conf.maintenance_interval, self._on_maintenance_timeout)
+
+    def _on_maintenance_timeout(self):
+        try:
+            self.get_storage().maintain()
+        except Exception:
+            self.log.exception("Storage maintenance failed")
+        finally:
+            # whatever happens call this method again
+            self.setup_maintenance_timeout()
+
+    def setup_rollup_timeout(self, connection=None):
+        """
+        sets up the timeout for rolling up the completed buckets of all resolutions
+        """
+        if not self.rollups:
+            return
+
+        if not connection:
+            connection = self.conf._amqp_connection
+
+        connection.add_timeout(self.conf.relay_timeout, self._on_rollup_timeout)
+
+    def _on_rollup_timeout(self):
+        try:
+            for rollup in self.rollups:
+                rollup.roll_up_completed()
+        except Exception:
+            self.log.exception("Rolling up the agent windows failed")
+        finally:
+            # whatever happens call this method again
+            self.setup_rollup_timeout()
+
     def on_agent_message(self, channel, method, properties, body):
         """
         Callback processing AMQP messages from the agents
+        Windows are buffered until a full prefetch window was received (or the flush timeout
+        is hit) and then written to the storage in one batch
         """
-        window = CollectorWindow.from_dict(json.loads(body))
-        self.log.debug(f"Got new message from agent {window.agent} from {window.start} to {window.end}")
+        with metrics.timed(self.LOGGER_NAME, 'decode'):
+            window = CollectorWindow.from_dict(json.loads(body))
+        window.mark('collector')
+        self.log.debug(f"Got new message from agent {window.agent} from {misc.format_epoch(window.start)} to {misc.format_epoch(window.end)}")
+
+        self._pending_windows.append(window)
+        self._pending_tags.append(method.delivery_tag)
+
+        if len(self._pending_tags) >= self.conf.collector_prefetch:
+            self.flush_windows()
+
+    def flush_windows(self):
+        """
+        Writes all buffered agent windows to the storage and acknowledges them with one
+        cumulative ack. If the write fails, the messages are handed back to the broker.
+        """
+        if not self._pending_tags:
+            return
+
+        # delivery tags are increasing per channel, so the last one covers all buffered messages
+        delivery_tag = self._pending_tags[-1]
+        count = len(self._pending_tags)
+        windows = self._pending_windows
+        self._pending_tags = []
+        self._pending_windows = []
 
         try:
-            data = window.influxdb_json(self.conf.project_name)
-            self.log.debug(data)
-            self.get_influxdb().write_points(data)
+            with metrics.timed(self.LOGGER_NAME, 'write', windows=count):
+                self.get_storage().write_windows(windows)
+        except Exception:
+            self.log.exception(f"Could not write {count} agent windows to the storage. Requeue them.")
+            self.get_channel().basic_nack(delivery_tag=delivery_tag, multiple=True, requeue=True)
+            return
 
-            # ack message
-            channel.basic_ack(delivery_tag=method.delivery_tag)
-        finally:
-            pass
+        # ack all messages up to (and including) delivery_tag
+        with metrics.timed(self.LOGGER_NAME, 'ack', windows=count):
+            self.get_channel().basic_ack(delivery_tag=delivery_tag, multiple=True)
+        self.log.debug(f"Wrote and acknowledged {count} agent windows")
 
     def relay_messages(self):
         """
@@ -149,33 +207,14 @@ class Collector(object):
         Also relays incomplete windows after conf.window_wait_timeout is exceeded
         """
         try:
-            self.log.info("Query for unrelayed windows")
-            # get the unrelayed windows
-            windows = self._get_unrelayed_windows()
-
-            self.log.info(f"Found {len(windows)} unrelayed windows")
             cmds = []
-            # iterate over the windows
-            for time, entries in windows.items():
-                # get a list of all agents in this windows
-                entry_agents = map(lambda x: x[1], entries)
-                # filter the agent_set for those agents, which are already present
-                missing_agents = list(filter(lambda agent: agent not in entry_agents, self.agent_set))
-
-                if len(missing_agents) == 0:
-                    # all agents are present for this window -> relay it
-                    # self._relay_window(time, entries)
-                    cmds.append((self, time, entries))
-                elif abs(datetime.now() - time).seconds > self.conf.window_wait_timeout:
-                    # maximum waiting time exceeded -> relay window anayway
-                    self.log.warn(f"Window aroung {time} still missing agent {', '.join(missing_agents)}, but exceeded {self.conf.window_wait_timeout}s. Relaying it anyway.")
-                    # self._relay_window(time, entries)
-                    cmds.append((self, time, entries))
+            for resolution in [None] + list(self.conf.resolutions):
+                cmds.extend(self._get_relay_commands(resolution))
 
             with ThreadPool(self.conf.pool_size) as pool:
                 self.log.info(f"Submit {len(cmds)} relay-jobs to multiprocessing pool of size {self.conf.pool_size}")
                 pool.map(
-                    lambda c: c[0]._relay_window(c[1], c[2]),
+                    lambda c: c[0]._relay_window(c[1], c[2], resolution=c[3]),
                     cmds
                 )
             self.log.info("multiprocessing pool closed")
@@ -184,103 +223,78 @@ class Collector(object):
             # whatever happens call this method again
             self.setup_relay_timeout()
 
-    def _get_unrelayed_windows(self) -> {}:
+    def _get_relay_commands(self, resolution: str=None) -> [()]:
+        """
+        Returns the relay-jobs of the windows of resolution, which are complete or waited too long
+        """
+        self.log.info(f"Query for unrelayed windows{f' of resolution {resolution}' if resolution else ''}")
+        # get the unrelayed windows
+        windows = self._get_unrelayed_windows(resolution)
+
+        self.log.info(f"Found {len(windows)} unrelayed windows")
+        metrics.RELAY_BACKLOG.labels(resolution or 'agent').set(self.get_storage().count_unrelayed_windows(resolution))
+        waiting = 0
+        cmds = []
+        # iterate over the windows
+        for time, entries in windows.items():
+            # get a list of all agents in this windows
+            entry_agents = list(map(lambda x: x[1], entries))
+            # filter the agent_set for those agents, which are already present
+            missing_agents = list(filter(lambda agent: agent not in entry_agents, self.agent_set))
+
+            if len(missing_agents) == 0:
+                # all agents are present for this window -> relay it
+                # self._relay_window(time, entries)
+                cmds.append((self, time, entries, resolution))
+            elif abs(misc.now_epoch() - time) > self.conf.window_wait_timeout * misc.NS_PER_SECOND:
+                # maximum waiting time exceeded -> relay window anayway
+                self.log.warn(f"Window aroung {misc.format_epoch(time)} still missing agent {', '.join(missing_agents)}, but exceeded {self.conf.window_wait_timeout}s. Relaying it anyway.")
+                # self._relay_window(time, entries)
+                cmds.append((self, time, entries, resolution))
+            else:
+                waiting += len(entries)
+
+        metrics.WAITING_WINDOWS.labels(resolution or 'agent').set(waiting)
+        return cmds
+
+    def _get_unrelayed_windows(self, resolution: str=None) -> {}:
         """
         Gets the latest unrelayed window messages ordered around a mean timestamp
         """
         windows = OrderedDict()
-        result = self.influxdb.query(
-            'SELECT "end", "agent" FROM "agent_status" WHERE "project" = \'{project}\' and "relayed" = false GROUP BY "agent" ORDER BY time DESC LIMIT {limit}'.format(
-                limit=8,
-                project=self.conf.project_name,
-            )
-        )
-
-        for row in result.get_points('agent_status'):
+
+        for time, agent in self.get_storage().get_unrelayed_windows(limit=8, resolution=resolution):
             # check if start time is already in the dict
-            time = misc.parse_influxdb_datetime(row['time'])
             key = misc.get_uncertain_date_key(windows, time)
 
             if not key:
                 # date is not yet in the dict
-                windows[time] = [(time, row['agent'])]
+                windows[time] = [(time, agent)]
             else:
                 # entry already exists, so add this row as well
-                windows[key].append((time, row['agent']))
+                windows[key].append((time, agent))
                 # recalc key timestamp
-                new_key = datetime.fromtimestamp(sum([e[0].timestamp() for e in windows[key]]) / len(windows[key]))
+                new_key = sum([e[0] for e in windows[key]]) // len(windows[key])
                 windows[new_key] = windows.pop(key)
 
         return windows
 
-    def _relay_window(self, time_key: datetime, window) -> None:
+    def _relay_window(self, time_key: int, window, resolution: str=None) -> None:
         """
-        Relays a single window and marks it as relayed in the InfluxDB
+        Relays a single window to the analysers of its resolution and marks it as relayed in the storage
         """
-        query = []
-        agent_windows = {}
-
-        # one query per agent per measurement
-        # yes, this is super inefficient, but we can't group by agent since the
-        # timestamps might differ slightly and joining multiple measurements
-        # causes enourmous tables
-        for time, agent in window:
-            for measurement in ('agent_status', ) + misc.MEASUREMENTS:
-                query.append('SELECT * FROM "{measurement}" WHERE "project" = \'{project}\' and "agent" = \'{agent}\' and time = \'{time}\''.format(
-                    project=self.conf.project_name,
-                    agent=agent,
-                    time=misc.format_influx_datetime(time),
-                    measurement=measurement,
-                ))
-
-        try:
-            result = self.influxdb.query('; '.join(query))
-        except:
-            self.log.warn(f"InfluxDB query failed:{ '; '.join(query)}")
+        agent_windows = self.get_storage().read_windows(window, resolution=resolution)
+        if not agent_windows:
             return
 
-        agent_status = {}
-        for resultset in result:
-            if len(resultset.items()) <= 0:
-                # no items in resultset
-                self.log.warn(f"Got empty resultset for InfluxDB query\"{query[result.index(resultset)]}\"")
-                continue
-
-            # iterate over the different queries
-            (measure, nan), data = resultset.items()[0]
-            data = next(data)  # only contains one item, so we can simply pop it without heavy iteration
-            agent = data['agent']
-
-            if agent not in agent_windows:
-                agent_windows[agent] = datamodel.Window(misc.parse_influxdb_datetime(data['time']), agent)
-
-            if measure == 'agent_status':
-                # saves the exact timestamp of the agent_state measurement, so it can be used to set the 'relayed' flag
-                agent_status[agent] = data['time']
-                # sets end time of window
-                agent_windows[agent].end = misc.parse_influxdb_datetime(data['end'])
-            else:
-                # writes values to window
-                setattr(agent_windows[agent], measure, {k: v for k, v in data.items() if k not in ('time', 'project', 'agent')})
-
         # relay the data!
-        data_json = json.dumps([window.to_dict() for window in agent_windows.values()])
-        self.get_channel().basic_publish(exchange=self.conf.name_exchange_analyser, routing_key='', body=data_json)
-
-        # set the relayed timestamp
-        influxdb_data = []
-        for agent, timestamp in agent_status.items():
-            influxdb_data.append({
-                'time': timestamp,
-                'measurement': 'agent_status',
-                'tags': {
-                    'project': self.conf.project_name,
-                    'agent': agent,
-                },
-                'fields': {
-                    'relayed': True
-                }
-            })
-
-        self.get_influxdb().write_points(influxdb_data)
-        self.log.info(f"relayed {len(influxdb_data)} windows.")
+        for agent_window in agent_windows.values():
+            agent_window.mark('relay')
+        data_json = json.dumps([agent_window.to_dict() for agent_window in agent_windows.values()])
+        with metrics.timed(self.LOGGER_NAME, 'publish', windows=len(agent_windows)):
+            self.get_channel().basic_publish(exchange=self.conf.get_name_exchange_analyser(resolution), routing_key='', body=data_json)
+
+        # set the relayed flag
+        self.get_storage().mark_relayed([(agent_window.start, agent) for agent, agent_window in agent_windows.items()],
+                                        resolution=resolution)
+        self.log.info(f"relayed {len(agent_windows)} windows.")
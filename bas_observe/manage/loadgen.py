@@ -0,0 +1,208 @@
+"""
+Load generator publishing synthetic agent windows at a target rate
+
+The windows of N agents are drawn from a TrafficProfile (cf. synthetic) and published to
+the agents exchange like the windows of real agents. The window times advance by one
+window length per round of all agents, so rates above the real-time pace of the agents
+(N / window length) simulate more traffic than the agents would produce.
+"""
+import json
+import random
+import time
+
+import numpy as np
+
+from ..config import Config
+from .. import misc, synthetic
+from .agent import BaseAgent
+
+
+def _latency_summary(latencies: []) -> {}:
+    """Percentiles of the latencies (in seconds) in milliseconds"""
+    if not latencies:
+        return {}
+
+    p50, p90, p99 = np.percentile(latencies, (50, 90, 99)) * 1000
+    return {'p50_ms': float(p50), 'p90_ms': float(p90), 'p99_ms': float(p99), 'max_ms': float(max(latencies) * 1000)}
+
+
+class LatencyReservoir(object):
+    """Uniform random sample of at most size latencies (reservoir sampling)
+
+    Long runs publish far more windows than can be kept in memory, the percentiles of
+    the sample estimate the ones of all latencies. The maximum is tracked exactly.
+    """
+
+    def __init__(self, size: int=100000, seed=0):
+        """
+        Attributes:
+            size                Maximum number of sampled latencies
+            seed                Seed of the sampling
+        """
+        self.size = size
+        self.samples = []
+        self.count = 0
+        self.max = 0.0
+        self._random = random.Random(seed)
+
+    def extend(self, latencies: []) -> None:
+        for latency in latencies:
+            self.count += 1
+            self.max = max(self.max, latency)
+            if len(self.samples) < self.size:
+                self.samples.append(latency)
+                continue
+
+            # the n-th latency replaces a sampled one with probability size / n
+            index = self._random.randrange(self.count)
+            if index < self.size:
+                self.samples[index] = latency
+
+    def summary(self) -> {}:
+        summary = _latency_summary(self.samples)
+        if summary:
+            summary['max_ms'] = self.max * 1000
+
+        return summary
+
+
+class LoadGenerator(BaseAgent):
+    LOGGER_NAME = 'LOADGEN'
+
+    def __init__(self, conf: Config, agents: [str], profile: synthetic.TrafficProfile=None, rate: float=None,
+                 duration: float=None, window_length: int=10 * misc.NS_PER_SECOND, seed=0, distinct: int=100,
+                 confirm: bool=False, report_interval: int=10):
+        """Creates a new load generator.
+
+        Attributes:
+            conf                Config object
+            agents              Names of the simulated agents
+            profile             TrafficProfile of the windows of all agents
+            rate                Target rate in windows per second (of all agents together)
+                                Defaults to the real-time pace of the agents
+            duration            Seconds to publish, None publishes until interrupted
+            window_length       Length of a window in nanoseconds
+            seed                Seed of the synthetic traffic
+            distinct            Number of distinct rounds of windows generated up front, which are
+                                published over and over (with new times), so the generation does not
+                                limit the rate
+            confirm             Enable publisher confirms, so the publish latency includes the broker
+            report_interval     Interval in seconds in which the achieved rate and latencies are logged
+        """
+        super().__init__(conf)
+        self.agents = agents
+        self.profile = profile
+        self.window_length = window_length
+        self.rate = rate or len(agents) * misc.NS_PER_SECOND / window_length
+        self.duration = duration
+        self.seed = seed
+        self.distinct = max(distinct, 1)
+        self.confirm = confirm
+        self.report_interval = report_interval
+
+        # seconds the broker blocked the connection (e.g. due to a memory or disk alarm)
+        self.blocked_seconds = 0.0
+        self._blocked_since = None
+
+    def _on_blocked(self, method_frame) -> None:
+        self.log.warn("Broker blocked the connection")
+        self._blocked_since = time.perf_counter()
+
+    def _on_unblocked(self, method_frame) -> None:
+        if self._blocked_since is not None:
+            self.log.warn("Broker unblocked the connection")
+            self.blocked_seconds += time.perf_counter() - self._blocked_since
+            self._blocked_since = None
+
+    def get_queue_depth(self) -> int:
+        """Number of agent windows waiting for the collector in the broker"""
+        return self.get_channel().queue_declare(queue=self.conf.name_queue_agents, durable=True, passive=True).method.message_count
+
+    def run(self) -> {}:
+        """Publishes windows until the duration is over (or interrupted) and returns the report"""
+        channel = self.get_channel()
+        connection = self.conf.get_amqp_connection()
+        connection.add_on_connection_blocked_callback(self._on_blocked)
+        connection.add_on_connection_unblocked_callback(self._on_unblocked)
+        if self.confirm:
+            channel.confirm_delivery()
+
+        self.log.info(f"Generate {self.distinct} distinct rounds of windows for {len(self.agents)} agents")
+        agents = synthetic.SyntheticAgents(self.agents, profile=self.profile, seed=self.seed, window_length=self.window_length)
+        rounds = list(agents.iter_windows(self.distinct))
+
+        self.log.info(f"Publish {self.rate:.1f} windows/s (real-time pace of the agents "
+                      f"{len(self.agents) * misc.NS_PER_SECOND / self.window_length:.1f} windows/s)")
+        latencies = LatencyReservoir(seed=self.seed)
+        interval_latencies = []
+        sent = 0
+        nacked = 0
+        max_lag = 0.0
+        max_queue_depth = 0
+        begin = time.perf_counter()
+        last_report = begin
+        last_sent = 0
+        try:
+            end = begin + self.duration if self.duration is not None else None
+            while end is None or time.perf_counter() < end:
+                # keep the pace, a publish behind schedule means the broker (or this process) cannot keep up
+                due = begin + sent / self.rate
+                lag = time.perf_counter() - due
+                if lag < 0:
+                    if end is not None and due >= end:
+                        # the next window is not due before the end anymore
+                        connection.sleep(max(end - time.perf_counter(), 0))
+                        break
+                    connection.sleep(-lag)
+                max_lag = max(max_lag, lag)
+
+                # each round holds one window of every agent, which all start at the same time
+                round_index, agent_index = divmod(sent, len(self.agents))
+                window = rounds[round_index % len(rounds)][agent_index]
+                window.start = agents.start + round_index * self.window_length
+                window.end = window.start + self.window_length
+                window.mark('agent')
+                body = json.dumps(window.to_dict())
+
+                start = time.perf_counter()
+                if channel.basic_publish(exchange=self.conf.name_exchange_agents, routing_key='', body=body) is False:
+                    nacked += 1
+                interval_latencies.append(time.perf_counter() - start)
+                sent += 1
+
+                now = time.perf_counter()
+                if now - last_report >= self.report_interval:
+                    queue_depth = self.get_queue_depth()
+                    max_queue_depth = max(max_queue_depth, queue_depth)
+                    summary = _latency_summary(interval_latencies)
+                    self.log.info(f"Published {(sent - last_sent) / (now - last_report):.1f} windows/s, "
+                                  f"latency p50 {summary['p50_ms']:.2f}ms p99 {summary['p99_ms']:.2f}ms, "
+                                  f"{max(lag, 0):.1f}s behind schedule, {queue_depth} windows queued")
+                    latencies.extend(interval_latencies)
+                    interval_latencies = []
+                    last_report = now
+                    last_sent = sent
+        except KeyboardInterrupt:
+            self.log.info("Interrupted")
+
+        duration = time.perf_counter() - begin
+        latencies.extend(interval_latencies)
+        # still blocked
+        self._on_unblocked(None)
+        queue_depth = self.get_queue_depth()
+        report = {
+            'agents': len(self.agents),
+            'target_rate': self.rate,
+            'sent': sent,
+            'seconds': duration,
+            'rate': sent / duration if duration else None,
+            'publish_latency': latencies.summary(),
+            'nacked': nacked,
+            'max_schedule_lag_s': max_lag,
+            'blocked_s': self.blocked_seconds,
+            'queue_depth': queue_depth,
+            'max_queue_depth': max(max_queue_depth, queue_depth),
+        }
+        self.log.info(f"Published {sent} windows in {duration:.1f}s ({report['rate']:.1f} windows/s, target {self.rate:.1f})")
+        self.conf.get_amqp_connection().close()
+        return report
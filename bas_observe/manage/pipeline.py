@@ -0,0 +1,286 @@
+"""
+Broker-less pipeline running the agent, the collector window assembly and the analysers in one process
+
+The stages run in threads connected by bounded queues, which pass the Window objects
+directly (no JSON, no AMQP). The windows are traced like in the distributed setup (cf. tracing),
+so the latencies are written to the sinks as well. A full queue blocks the stage in front of it, so a slow
+analyser throttles the agent instead of buffering the whole dump in memory.
+
+    agent --> collector --+--> analyser --+--> sinks
+                          +--> analyser --+
+"""
+import json
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+from ..config import Config
+from .. import datamodel, metrics, misc, tracing
+
+
+# marks the end of the windows (or results) of a stage
+_STOP = object()
+
+
+class BaseSink(object):
+    """Abstract base class of the receivers of the analyser results"""
+
+    def write(self, points: [{}]) -> None:
+        """Writes the points (cf. BaseStorage.write_results)"""
+        raise NotImplementedError("write function is not implemented")
+
+    def close(self) -> None:
+        pass
+
+
+class StorageSink(BaseSink):
+
+    def __init__(self, conf: Config):
+        """Writes the results to the storage of the config (e.g. an embedded SQLite file)"""
+        self.conf = conf
+
+    def write(self, points: [{}]) -> None:
+        self.conf.get_storage().write_results(points)
+
+
+class FileSink(BaseSink):
+
+    def __init__(self, path: str):
+        """Writes the results as JSON lines, one point per line"""
+        self.fp = open(path, mode='w')
+
+    def write(self, points: [{}]) -> None:
+        self.fp.writelines(json.dumps(point) + '\n' for point in points)
+
+    def close(self) -> None:
+        self.fp.close()
+
+
+class WindowGrouper(object):
+
+    def __init__(self, agent_set: set, wait: int):
+        """Assembles the windows of all agents starting at (nearly) the same time, like the collector
+
+        Attributes:
+            agent_set           Set of all agent names
+            wait                Time in nanoseconds (of the windows, not the wall clock) after which
+                                a window is emitted, even if agents are still missing
+        """
+        self.agent_set = agent_set
+        self.wait = wait
+        self.groups = OrderedDict()  # {time: [window, window, ...]}
+
+    def add(self, window: datamodel.Window) -> [[datamodel.Window]]:
+        """Adds the window and returns the groups, which are complete or waited too long"""
+        key = misc.get_uncertain_date_key(self.groups, window.start)
+        if key is None:
+            key = window.start
+            self.groups[key] = []
+        self.groups[key].append(window)
+
+        ready = []
+        for key, windows in list(self.groups.items()):
+            if self.agent_set.issubset(w.agent for w in windows) or window.start - key > self.wait:
+                ready.append(self.groups.pop(key))
+
+        return ready
+
+    def flush(self) -> [[datamodel.Window]]:
+        """Returns all remaining (incomplete) groups"""
+        ready = list(self.groups.values())
+        self.groups = OrderedDict()
+        return ready
+
+
+class Pipeline(object):
+    LOGGER_NAME = 'PIPELINE'
+
+    def __init__(self, conf: Config, agent, analysers: [], sinks: [BaseSink], queue_size: int=64,
+                 batch_size: int=1000, store_windows: bool=False):
+        """Wires an agent, the window assembly and analysers together without a broker
+
+        Attributes:
+            conf                Config object
+            agent               Agent providing iter_windows() (e.g. a SimulatedAgent)
+            analysers           Analysers scoring the assembled windows
+            sinks               Receivers of the analyser results
+            queue_size          Maximum number of items waiting in front of each stage
+            batch_size          Maximum number of windows an analyser scores at once
+            store_windows       Write the assembled windows to the storage, like the collector
+        """
+        self.conf = conf
+        self.agent = agent
+        self.analysers = analysers
+        self.sinks = sinks
+        self.batch_size = batch_size
+        self.store_windows = store_windows
+
+        self.collector_queue = queue.Queue(maxsize=queue_size)
+        self.analyser_queues = [queue.Queue(maxsize=queue_size) for analyser in analysers]
+        self.sink_queue = queue.Queue(maxsize=queue_size)
+
+        # set, once any stage failed, so the others do not block on their queues forever
+        self._abort = threading.Event()
+        self.errors = []
+        self.window_count = 0
+        self.point_count = 0
+
+        self.log = logging.getLogger(self.LOGGER_NAME)
+
+    def _put(self, q: queue.Queue, item) -> None:
+        while not self._abort.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+        raise RuntimeError("Pipeline aborted")
+
+    def _get(self, q: queue.Queue):
+        while not self._abort.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+        raise RuntimeError("Pipeline aborted")
+
+    def _run_stage(self, name: str, func, *args) -> None:
+        try:
+            func(*args)
+        except Exception as e:
+            if not self._abort.is_set():
+                self.log.exception(f"Stage {name} failed. Abort the pipeline.")
+                self.errors.append(e)
+                self._abort.set()
+
+    def _run_agent(self) -> None:
+        for windows in self.agent.iter_windows():
+            for window in windows:
+                window.mark('agent')
+                self._put(self.collector_queue, window)
+
+        self._put(self.collector_queue, _STOP)
+
+    def _relay(self, windows: [datamodel.Window]) -> None:
+        if self.store_windows:
+            self.conf.get_storage().write_windows(windows)
+
+        for window in windows:
+            window.mark('relay')
+
+        self.window_count += len(windows)
+        for q in self.analyser_queues:
+            self._put(q, windows)
+
+    def _run_collector(self) -> None:
+        grouper = WindowGrouper(self.agent.agent_set, self.conf.window_wait_timeout * misc.NS_PER_SECOND)
+        while True:
+            window = self._get(self.collector_queue)
+            if window is _STOP:
+                break
+
+            window.mark('collector')
+            for windows in grouper.add(window):
+                self._relay(windows)
+
+        for windows in grouper.flush():
+            self._relay(windows)
+
+        for q in self.analyser_queues:
+            self._put(q, _STOP)
+
+    def _run_analyser(self, analyser, q: queue.Queue) -> None:
+        stopped = False
+        while not stopped:
+            windows = self._get(q)
+            if windows is _STOP:
+                break
+
+            # score everything already waiting at once, the models are way faster on larger batches
+            # the windows are shared by all analysers, so their receipt is kept next to them
+            received = [(windows, misc.now_epoch())]
+            batch = list(windows)
+            while len(batch) < self.batch_size:
+                try:
+                    windows = q.get_nowait()
+                except queue.Empty:
+                    break
+
+                if windows is _STOP:
+                    stopped = True
+                    break
+                received.append((windows, misc.now_epoch()))
+                batch.extend(windows)
+
+            with metrics.timed(analyser.LOGGER_NAME, 'score', windows=len(batch)):
+                points = analyser.score_windows(batch)
+            self._put(self.sink_queue, (analyser.LOGGER_NAME, received, misc.now_epoch(), points))
+
+        self._put(self.sink_queue, _STOP)
+
+    def _run_sinks(self) -> None:
+        running = len(self.analysers)
+        while running:
+            item = self._get(self.sink_queue)
+            if item is _STOP:
+                running -= 1
+                continue
+
+            component, received, scored, points = item
+            with metrics.timed(self.LOGGER_NAME, 'write', windows=len(points)):
+                for sink in self.sinks:
+                    sink.write(points)
+            self.point_count += len(points)
+
+            written = misc.now_epoch()
+            latencies = []
+            for windows, time in received:
+                latencies.extend(tracing.latency_points(windows, component, self.conf.project_name, self.conf.trace_sample_rate,
+                                                        analyser=time, scored=scored, written=written))
+            if latencies:
+                for sink in self.sinks:
+                    sink.write(latencies)
+
+    def run(self) -> None:
+        """Runs all stages until the agent is exhausted (or a stage failed)"""
+        for analyser in self.analysers:
+            analyser.prepare_scoring()
+
+        if self.store_windows:
+            self.conf.get_storage().setup()
+
+        stages = [('agent', self._run_agent), ('collector', self._run_collector), ('sinks', self._run_sinks)]
+        stages += [(analyser.LOGGER_NAME, self._run_analyser, analyser, q) for analyser, q in zip(self.analysers, self.analyser_queues)]
+        threads = [threading.Thread(target=self._run_stage, args=stage, name=stage[0], daemon=True) for stage in stages]
+
+        begin = time.perf_counter()
+        self.log.info(f"Start pipeline with {len(self.analysers)} analysers and {len(self.sinks)} sinks")
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                # join with a timeout, so KeyboardInterrupt is not blocked
+                while thread.is_alive():
+                    thread.join(timeout=0.5)
+        except KeyboardInterrupt:
+            self._abort.set()
+        finally:
+            for sink in self.sinks:
+                sink.close()
+
+            # analysers may have updated their models while scoring (e.g. new agents or an online baseline)
+            for analyser in self.analysers:
+                try:
+                    analyser.save_model()
+                except Exception:
+                    self.log.exception(f"Could not save the model of {analyser.LOGGER_NAME}")
+
+        duration = time.perf_counter() - begin
+        self.log.info(f"Processed {self.window_count} windows into {self.point_count} results in {duration:.1f}s "
+                      f"({self.window_count / duration if duration else 0:.0f} windows/s)")
+        if self.errors:
+            raise self.errors[0]
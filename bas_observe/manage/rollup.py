@@ -0,0 +1,104 @@
+"""
+Rolls the agent windows up to coarser resolutions by merging their counters
+
+Rolled-up windows are aligned to buckets of the resolution (starting at the epoch),
+so the windows of all agents in a bucket share the same start and end.
+"""
+import logging
+from collections import OrderedDict
+
+from ..config import Config
+from .. import datamodel, misc
+
+
+# time span of base windows read from the storage at once
+_CHUNK_LENGTH = 24 * 60 * 60 * misc.NS_PER_SECOND
+
+
+def resolution_to_ns(resolution: str) -> int:
+    """Returns the length of a resolution (e.g. 15m) in nanoseconds"""
+    duration = misc.parse_duration(resolution)
+    if not duration:
+        raise ValueError(f"Resolution '{resolution}' is not a finite duration")
+
+    return misc.duration_to_ns(duration)
+
+
+def bucket_start(time: int, length: int) -> int:
+    """Returns the start of the bucket of length (both in nanoseconds) containing time"""
+    return time - time % length
+
+
+def rollup_windows(windows, length: int) -> [datamodel.Window]:
+    """Merges the windows of each agent, which start in the same bucket of length (in nanoseconds)"""
+    buckets = OrderedDict()  # {(bucket start, agent): [window, window, ...]}
+    for window in windows:
+        buckets.setdefault((bucket_start(window.start, length), window.agent), []).append(window)
+
+    return [datamodel.merge_windows(bucket, start=start, end=start + length) for (start, agent), bucket in buckets.items()]
+
+
+class WindowRollup(object):
+    LOGGER_NAME = 'ROLLUP'
+
+    def __init__(self, conf: Config, resolution: str):
+        """Rolls the agent windows in the storage up to one resolution
+
+        Attributes:
+            conf                Config object
+            resolution          Resolution of the rolled-up windows (e.g. 15m)
+        """
+        self.conf = conf
+        self.resolution = resolution
+        self.length = resolution_to_ns(resolution)
+        self.storage = None
+        # end of the buckets already rolled up by roll_up_completed
+        # the current bucket is rolled up completely, since it is read from the storage
+        self.rolled_up_until = bucket_start(misc.now_epoch(), self.length)
+
+        self.log = logging.getLogger(self.LOGGER_NAME)
+
+    def get_storage(self):
+        if not self.storage:
+            self.storage = self.conf.get_storage()
+
+        return self.storage
+
+    def roll_up(self, start: int, end: int, relayed: bool=False) -> int:
+        """Rolls up all buckets overlapping start to end and returns the number of written windows
+        The agent windows are read in chunks, so long time ranges are never held in memory at once.
+        If relayed is set, the windows are marked as relayed, so the collector does not relay them.
+        """
+        start = bucket_start(start, self.length)
+        # chunks hold whole buckets, so no bucket is split
+        chunk_length = max(_CHUNK_LENGTH - _CHUNK_LENGTH % self.length, self.length)
+
+        count = 0
+        for chunk_start in range(start, end, chunk_length):
+            chunk_end = min(chunk_start + chunk_length, bucket_start(end - 1, self.length) + self.length)
+            # get_windows excludes start and end
+            windows = rollup_windows(self.get_storage().get_windows(chunk_start - 1, chunk_end), self.length)
+            if not windows:
+                continue
+
+            self.get_storage().write_windows(windows, resolution=self.resolution)
+            if relayed:
+                self.get_storage().mark_relayed([(window.start, window.agent) for window in windows], resolution=self.resolution)
+
+            count += len(windows)
+            self.log.debug(f"Rolled up {len(windows)} windows to {self.resolution} until {misc.format_epoch(chunk_end)}")
+
+        return count
+
+    def roll_up_completed(self) -> int:
+        """Rolls up the buckets completed since the last call
+        A bucket is complete, once the agents had window_wait_timeout to deliver its last windows.
+        """
+        completed = bucket_start(misc.now_epoch() - self.conf.window_wait_timeout * misc.NS_PER_SECOND, self.length)
+        if completed <= self.rolled_up_until:
+            return 0
+
+        count = self.roll_up(self.rolled_up_until, completed)
+        self.log.info(f"Rolled up {count} windows to {self.resolution} until {misc.format_epoch(completed)}")
+        self.rolled_up_until = completed
+        return count
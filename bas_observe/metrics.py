@@ -0,0 +1,264 @@
+"""
+Operational metrics of the running components in the Prometheus text format
+
+The metrics are kept in memory by the process and served on a local HTTP endpoint
+(GET /metrics), which is started with `bob --metrics-port <PORT>`. Without it, recording
+the metrics costs only a few counter updates per message.
+
+Stages of a message:
+    decode      JSON and window parsing of a received message
+    vectorise   vectorisation of the windows (part of score for the sklearn analysers)
+    score       scoring of the windows by an analyser
+    write       writing windows or results to the storage (InfluxDB or SQLite)
+    ack         acknowledging messages to the broker
+    publish     publishing windows to the broker
+"""
+from bisect import bisect_left
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from . import profiling
+
+
+log = logging.getLogger('METRICS')
+
+# upper bounds (in seconds) of the buckets of the latency histograms
+DEFAULT_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, math.inf)
+# upper bounds (in seconds) of the buckets of the end-to-end latencies of the windows
+LATENCY_BUCKETS = (.01, .05, .1, .25, .5, 1, 2.5, 5, 10, 15, 20, 30, 45, 60, 120, 300, math.inf)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    elif value == -math.inf:
+        return '-Inf'
+
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: (), values: (), extra: str='') -> str:
+    labels = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+
+class _Metric(object):
+    TYPE = None
+
+    def __init__(self, name: str, documentation: str, labelnames: ()=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = OrderedDict()  # {label values: child}
+        self._lock = threading.Lock()
+
+        REGISTRY.register(self)
+
+    def _new_child(self):
+        raise NotImplementedError("_new_child is not implemented")
+
+    def labels(self, *values):
+        """Returns the metric of the label values (created on first use)"""
+        values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+
+        return child
+
+    def samples(self) -> [(str, (), float)]:
+        raise NotImplementedError("samples is not implemented")
+
+    def expose(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.TYPE}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{labels} {_format_value(value)}")
+
+        return '\n'.join(lines) + '\n'
+
+
+class _Value(object):
+
+    def __init__(self):
+        self.value = 0.0
+        self.function = None
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float=1) -> None:
+        with self._lock:
+            self.value += amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def set_function(self, function) -> None:
+        """Reads the value from the function, whenever the metrics are exposed"""
+        self.function = function
+
+    def get(self) -> float:
+        if self.function:
+            try:
+                return self.function()
+            except Exception:
+                log.exception("Could not read the value of a metric")
+                return math.nan
+
+        return self.value
+
+
+class Counter(_Metric):
+    """Monotonically increasing value, its name has to end with _total"""
+    TYPE = 'counter'
+
+    def _new_child(self):
+        return _Value()
+
+    def samples(self):
+        return [('', _format_labels(self.labelnames, values), child.get()) for values, child in list(self._children.items())]
+
+
+class Gauge(Counter):
+    TYPE = 'gauge'
+
+
+class _HistogramValue(object):
+
+    def __init__(self, buckets: ()):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        # first bucket, whose upper bound is not below the value
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            self.sum += value
+            self.counts[i] += 1
+
+    @contextmanager
+    def time(self):
+        """Observes the duration of the with block (unless it raises)"""
+        start = time.perf_counter()
+        yield
+        self.observe(time.perf_counter() - start)
+
+
+class Histogram(_Metric):
+    TYPE = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: ()=(), buckets: ()=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        if self.buckets[-1] != math.inf:
+            self.buckets += (math.inf, )
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def samples(self):
+        samples = []
+        for values, child in list(self._children.items()):
+            with child._lock:
+                counts = list(child.counts)
+                total = child.sum
+
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                samples.append(('_bucket', _format_labels(self.labelnames, values, f'le="{_format_value(bound)}"'), cumulative))
+            samples.append(('_sum', _format_labels(self.labelnames, values), total))
+            samples.append(('_count', _format_labels(self.labelnames, values), cumulative))
+
+        return samples
+
+
+class Registry(object):
+
+    def __init__(self):
+        self.metrics = OrderedDict()  # {name: metric}
+
+    def register(self, metric: _Metric) -> None:
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+
+        self.metrics[metric.name] = metric
+
+    def expose(self) -> str:
+        """Returns all metrics in the Prometheus text format"""
+        return ''.join(metric.expose() for metric in self.metrics.values())
+
+
+REGISTRY = Registry()
+
+MESSAGES = Counter('bob_messages_total', "Messages processed per component and stage", ['component', 'stage'])
+WINDOWS = Counter('bob_windows_total', "Windows processed per component and stage", ['component', 'stage'])
+STAGE_SECONDS = Histogram('bob_stage_duration_seconds', "Latency of the processing stages", ['component', 'stage'])
+RELAY_BACKLOG = Gauge('bob_relay_backlog_windows', "Windows in the storage, which the collector did not relay yet", ['resolution'])
+WAITING_WINDOWS = Gauge('bob_waiting_windows', "Windows waiting for missing agents in the collector", ['resolution'])
+MODEL_CACHE_ENTRIES = Gauge('bob_model_cache_entries', "Agent models kept in memory", ['component'])
+MODEL_CACHE_BYTES = Gauge('bob_model_cache_bytes', "Estimated memory of the agent models kept in memory", ['component'])
+MODEL_CACHE_REQUESTS = Counter('bob_model_cache_requests_total', "Lookups of agent models by result (hit or miss)", ['component', 'result'])
+MODEL_CACHE_LOAD_SECONDS = Histogram('bob_model_cache_load_seconds', "Time to load an agent model missing in memory from disk", ['component'])
+WINDOW_LATENCY = Histogram('bob_window_latency_seconds', "Latency of the windows between the hops of the pipeline (cf. tracing)",
+                           ['component', 'stage'], buckets=LATENCY_BUCKETS)
+
+
+@contextmanager
+def timed(component: str, stage: str, windows: int=None):
+    """Records the duration of the with block as stage of the component, and counts the message
+    (and its windows). Nothing is recorded, if the block raises.
+    The block is also accounted to the stage by a running profiler (cf. profiling).
+    """
+    start = time.perf_counter()
+    with profiling.stage(component, stage):
+        yield
+    STAGE_SECONDS.labels(component, stage).observe(time.perf_counter() - start)
+    MESSAGES.labels(component, stage).inc()
+    if windows is not None:
+        WINDOWS.labels(component, stage).inc(windows)
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+
+        body = REGISTRY.expose().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.debug(format % args)
+
+
+def start_http_server(port: int, addr: str='127.0.0.1') -> HTTPServer:
+    """Serves the metrics on http://<addr>:<port>/metrics from a daemon thread"""
+    server = _ThreadingHTTPServer((addr, port), _MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name='metrics', daemon=True)
+    thread.start()
+    log.info(f"Serving metrics on http://{addr}:{port}/metrics")
+    return server
@@ -1,13 +1,64 @@
 """
 Package containing misc helper functions
+
+Timestamps are handled as integer nanoseconds since the epoch (UTC) internally.
+datetime objects are only used at the edges, i.e. the CLI and log output.
 """
 
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from contextlib import contextmanager
+import calendar
 import math
+import os
+import tempfile
+import time
 
 
 MEASUREMENTS = ('src_addr', 'dest_addr', 'apci', 'length', 'hop_count', 'priority')
 
+# storage layouts of agent windows in InfluxDB
+# split:  one agent_status point plus one point per entry in MEASUREMENTS
+# single: the whole window as one point in WINDOW_MEASUREMENT, counters are stored
+#         as fields named <measurement><COUNTER_SEPARATOR><key>
+SCHEMA_SPLIT = 'split'
+SCHEMA_SINGLE = 'single'
+SCHEMAS = (SCHEMA_SPLIT, SCHEMA_SINGLE)
+WINDOW_MEASUREMENT = 'window'
+COUNTER_SEPARATOR = ':'
+# the trace record of a window is stored as fields named <TRACE_FIELD_PREFIX><stage>
+TRACE_FIELD_PREFIX = 'trace_'
+
+# resolutions of the rolled-up series as (name, seconds)
+ROLLUPS = (('1m', 60), ('1h', 60 * 60), ('1d', 24 * 60 * 60))
+# how the fields of the non-counter measurements are aggregated in the rolled-up series
+# counter measurements (cf. MEASUREMENTS) are always summed up
+RESULT_AGGREGATES = {
+    'agent_status': {'count': 'sum', 'length': 'sum'},
+    'unknown_addr': {
+        'unknown_src_addr': 'sum', 'unknown_src_telegrams': 'sum',
+        'unknown_dest_addr': 'sum', 'unknown_dest_telegrams': 'sum',
+        'unknown_addr': 'sum', 'unknown_telegrams': 'sum',
+    },
+    'entropy': {'entropy': 'mean', 'entropy1': 'mean', 'entropy2': 'mean'},
+    'lof': {
+        'local': 'sum', 'local_inlier': 'sum', 'local_lof': 'mean',
+        'world': 'sum', 'world_inlier': 'sum', 'world_lof': 'mean',
+    },
+    'svm': {
+        'local': 'sum', 'local_inlier': 'sum', 'local_distance': 'mean',
+        'world': 'sum', 'world_inlier': 'sum', 'world_distance': 'mean',
+    },
+    # seconds the windows spent in the stages of the pipeline (cf. tracing)
+    'pipeline_latency': {
+        'agent': 'mean', 'collector': 'mean', 'relay': 'mean', 'analyser': 'mean', 'scored': 'mean', 'written': 'mean',
+        'total': 'mean',
+    },
+}
+# retention duration meaning to keep data forever
+RETENTION_INFINITE = 'INF'
+
+NS_PER_SECOND = 1000 * 1000 * 1000
+
 _DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S%z'
 _DATETIME_FORMAT_NO_TZ = '%Y-%m-%dT%H:%M:%S'
 _DATETIME_ISO_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
@@ -18,10 +69,6 @@ def format_datetime(dt: datetime):
     return dt.strftime(_DATETIME_FORMAT)
 
 
-def format_influx_datetime(dt: datetime):
-    return dt.strftime(_DATETIME_LEGACY_FORMAT)
-
-
 def parse_datetime(s: str):
     try:
         return datetime.strptime(s, _DATETIME_FORMAT)
@@ -41,7 +88,62 @@ def parse_influxdb_datetime(s: str):
     raise ValueError("Could not parse '{date}'. Format does not match any expected one.")
 
 
-def get_uncertain_date_key(d: {}, timestamp: datetime, delta: timedelta=timedelta(seconds=2)):
+def to_epoch(dt: datetime) -> int:
+    """Converts a datetime into nanoseconds since the epoch
+    Naive datetimes are considered to be in UTC
+    """
+    return calendar.timegm(dt.utctimetuple()) * NS_PER_SECOND + dt.microsecond * 1000
+
+
+def from_epoch(ns: int) -> datetime:
+    """Converts nanoseconds since the epoch into an (UTC aware) datetime"""
+    seconds, ns = divmod(ns, NS_PER_SECOND)
+    return datetime.fromtimestamp(seconds, tz=timezone.utc) + timedelta(microseconds=ns // 1000)
+
+
+def format_epoch(ns: int) -> str:
+    """Human readable representation of nanoseconds since the epoch, e.g. for log output"""
+    return format_datetime(from_epoch(ns)) if ns is not None else 'None'
+
+
+def parse_epoch(value) -> int:
+    """Converts a timestamp read from the wire or storage into nanoseconds since the epoch
+    Numbers are taken as they are, strings are considered to be in one of the legacy formats
+    """
+    if value is None or isinstance(value, int):
+        return value
+    elif isinstance(value, float):
+        return int(value)
+
+    try:
+        return to_epoch(parse_datetime(value))
+    except ValueError:
+        return to_epoch(parse_influxdb_datetime(value))
+
+
+def now_epoch() -> int:
+    return int(time.time() * NS_PER_SECOND)
+
+
+def duration_to_ns(duration: timedelta) -> int:
+    return int(duration.total_seconds() * NS_PER_SECOND)
+
+
+def parse_duration(s: str) -> timedelta:
+    """Parses an InfluxDB style duration (e.g. 90d, 12h, 4w)
+    Returns None for an infinite duration
+    """
+    if not s or s.upper() == RETENTION_INFINITE:
+        return None
+
+    units = {'s': 'seconds', 'm': 'minutes', 'h': 'hours', 'd': 'days', 'w': 'weeks'}
+    if s[-1] not in units:
+        raise ValueError(f"Unknown unit in duration '{s}'. Use one of {', '.join(units.keys())}")
+
+    return timedelta(**{units[s[-1]]: int(s[:-1])})
+
+
+def get_uncertain_date_key(d: {}, timestamp: int, delta: int=2 * NS_PER_SECOND):
     """Returns the first dict key, which lies within delta around the timestamp
     Otherwise returns None
     """
@@ -54,3 +156,23 @@ def get_uncertain_date_key(d: {}, timestamp: datetime, delta: timedelta=timedelt
             min_delta = abs(key - timestamp)
 
     return min_key
+
+
+@contextmanager
+def atomic_write(path: str, mode: str='w'):
+    """Context manager returning a file object, which replaces path atomically on success
+    The content is written to a temporary file in the same directory, synced to disk
+    and renamed to path afterwards. On failure path is left untouched.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=f'.{os.path.basename(path)}.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, mode) as fp:
+            yield fp
+            fp.flush()
+            os.fsync(fp.fileno())
+
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
@@ -0,0 +1,307 @@
+"""
+Profiling of any bob command in place, e.g. a collector or an analyser under real load
+
+The profiler is started with `bob --profile cprofile|sampling --profile-out DIR <command>`.
+Snapshots of the statistics gathered since the start are written to DIR periodically, whenever
+the process receives SIGUSR1 and when it exits. Every snapshot contains a per-function breakdown
+for each stage of the pipeline (cf. metrics.timed, e.g. "LOF ANALYSER/score"), time outside
+of the stages is accounted to "other".
+
+cprofile    Deterministic profiling with cProfile (one profile per stage). Only the main thread
+            is profiled, which runs the message callbacks of all consumers. The overhead is
+            considerable, so use it for short captures.
+sampling    Samples the stacks of all threads (including the relay pool and the stages of the
+            in-process pipeline) in a background thread. The overhead is low, so it may keep running.
+
+Files of a snapshot (<mode>-<pid>-<number>-<reason>):
+    .txt        report with the top functions per stage
+    .prof       cProfile statistics per stage (cprofile), readable with pstats or snakeviz
+    .folded     collapsed stacks per stage (sampling), readable by flamegraph.pl or speedscope
+"""
+import atexit
+import cProfile
+import io
+import logging
+import os
+import pstats
+import re
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+
+log = logging.getLogger('PROFILER')
+
+PROFILE_CPROFILE = 'cprofile'
+PROFILE_SAMPLING = 'sampling'
+PROFILES = (PROFILE_CPROFILE, PROFILE_SAMPLING)
+
+# stage of the code running outside of any stage
+OTHER_STAGE = 'other'
+# number of functions per stage in the reports
+REPORT_LIMIT = 30
+
+# the running profiler (at most one per process)
+_profiler = None
+
+
+@contextmanager
+def stage(component: str, name: str):
+    """Accounts the code running in the with block to the stage of the component"""
+    profiler = _profiler
+    if profiler is None:
+        yield
+        return
+
+    tag = f'{component}/{name}'
+    profiler.enter(tag)
+    try:
+        yield
+    finally:
+        profiler.exit(tag)
+
+
+def _file_tag(tag: str) -> str:
+    return re.sub(r'[^A-Za-z0-9_.-]+', '_', tag.replace('/', '.'))
+
+
+class BaseProfiler(object):
+    """Abstract base class of the profilers"""
+    MODE = None
+
+    def __init__(self, out_dir: str):
+        """
+        Attributes:
+            out_dir             Directory the snapshots are written to
+        """
+        self.out_dir = out_dir
+        self.snapshots = 0
+        self.started = None
+        # stages entered per thread {thread id: [tag, tag, ...]}
+        self._stages = {}
+
+    def current_stage(self, thread_id: int) -> str:
+        try:
+            return self._stages[thread_id][-1]
+        except (KeyError, IndexError):
+            return OTHER_STAGE
+
+    def enter(self, tag: str) -> None:
+        self._stages.setdefault(threading.get_ident(), []).append(tag)
+
+    def exit(self, tag: str) -> None:
+        stack = self._stages.get(threading.get_ident())
+        if stack:
+            stack.pop()
+
+    def start(self) -> None:
+        self.started = time.time()
+
+    def stop(self) -> None:
+        pass
+
+    def snapshot(self, reason: str) -> str:
+        """Writes the statistics gathered since the start and returns the path of the report"""
+        os.makedirs(self.out_dir, exist_ok=True)
+        self.snapshots += 1
+        base = os.path.join(self.out_dir, f'{self.MODE}-{os.getpid()}-{self.snapshots:04d}-{reason}')
+        report = io.StringIO()
+        report.write(f"{self.MODE} profile of pid {os.getpid()} ({' '.join(sys.argv)})\n")
+        report.write(f"{time.time() - self.started:.1f}s since the start, snapshot {self.snapshots} ({reason})\n")
+        self.write_snapshot(base, report)
+
+        with open(f'{base}.txt', mode='w') as fp:
+            fp.write(report.getvalue())
+
+        log.info(f"Wrote profile snapshot {base}.txt")
+        return f'{base}.txt'
+
+    def write_snapshot(self, base: str, report: io.StringIO) -> None:
+        raise NotImplementedError("write_snapshot is not implemented")
+
+
+class CProfileProfiler(BaseProfiler):
+    MODE = PROFILE_CPROFILE
+
+    def __init__(self, out_dir: str):
+        """Profiles the main thread with one cProfile profile per stage"""
+        super().__init__(out_dir)
+        self.thread_id = threading.get_ident()
+        self.profiles = {OTHER_STAGE: cProfile.Profile()}
+        self._lock = threading.Lock()
+        # set while switching between the profiles, when none of them is enabled
+        self._switching = False
+
+    def _active(self) -> cProfile.Profile:
+        return self.profiles[self.current_stage(self.thread_id)]
+
+    def _switch(self, func) -> None:
+        if threading.get_ident() != self.thread_id:
+            return
+
+        self._switching = True
+        self._active().disable()
+        func()
+        self._active().enable()
+        self._switching = False
+
+    def enter(self, tag: str) -> None:
+        if tag not in self.profiles:
+            with self._lock:
+                self.profiles.setdefault(tag, cProfile.Profile())
+
+        self._switch(lambda: super(CProfileProfiler, self).enter(tag))
+
+    def exit(self, tag: str) -> None:
+        self._switch(lambda: super(CProfileProfiler, self).exit(tag))
+
+    def start(self) -> None:
+        super().start()
+        self._active().enable()
+
+    def stop(self) -> None:
+        self._active().disable()
+
+    def write_snapshot(self, base: str, report: io.StringIO) -> None:
+        # the profiles can only be read while disabled, which only works in the profiled thread
+        main_thread = threading.get_ident() == self.thread_id and not self._switching
+        active = self._active()
+        if main_thread:
+            active.disable()
+
+        try:
+            for tag, profile in sorted(self.profiles.items()):
+                if profile is active and not main_thread:
+                    report.write(f"\n{tag}: still running, skipped in this snapshot\n")
+                    continue
+
+                try:
+                    stats = pstats.Stats(profile, stream=report)
+                except TypeError:
+                    # nothing was recorded in this stage yet
+                    continue
+
+                stats.dump_stats(f'{base}.{_file_tag(tag)}.prof')
+                report.write(f"\n{'=' * 20} {tag} {'=' * 20}\n")
+                stats.sort_stats('cumulative').print_stats(REPORT_LIMIT)
+        finally:
+            if main_thread:
+                active.enable()
+
+
+class SamplingProfiler(BaseProfiler):
+    MODE = PROFILE_SAMPLING
+
+    def __init__(self, out_dir: str, interval: float=0.005):
+        """Samples the stacks of all threads
+
+        Attributes:
+            out_dir             Directory the snapshots are written to
+            interval            Seconds between two samples
+        """
+        super().__init__(out_dir)
+        self.interval = interval
+        self.samples = Counter()  # {(stage, (frame, frame, ...)): count}, outermost frame first
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        super().start()
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            samples = []
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                samples.append((self.current_stage(thread_id), tuple(reversed(stack))))
+
+            with self._lock:
+                self.samples.update(samples)
+
+    def write_snapshot(self, base: str, report: io.StringIO) -> None:
+        with self._lock:
+            samples = Counter(self.samples)
+
+        own = Counter()  # {stage: {function: samples}}, function on top of the stack
+        cumulative = Counter()  # function anywhere on the stack
+        totals = Counter()
+        for (tag, stack), count in samples.items():
+            totals[tag] += count
+            if stack:
+                own[(tag, stack[-1])] += count
+            for function in set(stack):
+                cumulative[(tag, function)] += count
+
+        with open(f'{base}.folded', mode='w') as fp:
+            for (tag, stack), count in samples.items():
+                fp.write(';'.join((tag, ) + stack) + f' {count}\n')
+
+        report.write(f"{sum(totals.values())} samples every {self.interval * 1000:.1f}ms (all threads)\n")
+        for tag, total in totals.most_common():
+            report.write(f"\n{'=' * 20} {tag}: {total} samples {'=' * 20}\n")
+            report.write(f"{'own %':>7} {'cum %':>7}  function\n")
+            functions = sorted(((count, function) for (t, function), count in own.items() if t == tag), reverse=True)
+            for count, function in functions[:REPORT_LIMIT]:
+                report.write(f"{count / total * 100:7.1f} {cumulative[(tag, function)] / total * 100:7.1f}  {function}\n")
+
+
+def start(mode: str, out_dir: str, interval: int=60) -> BaseProfiler:
+    """Starts the profiler of mode, which writes snapshots to out_dir
+
+    Attributes:
+        mode                One of PROFILES
+        out_dir             Directory of the snapshots
+        interval            Seconds between the periodic snapshots (0 disables them)
+    """
+    global _profiler
+
+    if mode == PROFILE_CPROFILE:
+        profiler = CProfileProfiler(out_dir)
+    elif mode == PROFILE_SAMPLING:
+        profiler = SamplingProfiler(out_dir)
+    else:
+        raise KeyError(f"Unknown profiler: {mode}")
+
+    # signal handlers run in the main thread, which the cProfile profiles can only be read from
+    signal.signal(signal.SIGUSR1, lambda signum, frame: profiler.snapshot('signal'))
+    if interval:
+        signal.signal(signal.SIGALRM, lambda signum, frame: profiler.snapshot('periodic'))
+        signal.setitimer(signal.ITIMER_REAL, interval, interval)
+    atexit.register(_stop)
+
+    _profiler = profiler
+    profiler.start()
+    log.info(f"Started {mode} profiler, snapshots are written to {out_dir} every {interval}s, on SIGUSR1 and on exit")
+    return profiler
+
+
+def _stop() -> None:
+    global _profiler
+
+    profiler = _profiler
+    if profiler is None:
+        return
+
+    signal.setitimer(signal.ITIMER_REAL, 0)
+    profiler.stop()
+    _profiler = None
+    profiler.snapshot('exit')
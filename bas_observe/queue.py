@@ -8,10 +8,15 @@ from . import config
 import pika
 
 
-def declare_amqp_pipeline(conf: config, channel: pika.channel.Channel, durable: bool=True) -> None:
+# names of the analysers, each gets its own queue
+ANALYSERS = ('addr', 'entropy', 'lof', 'svm')
+
+
+def declare_amqp_pipeline(conf: config, channel: pika.channel.Channel, durable: bool=True, prefetch_count: int=1) -> None:
     """Declare AMQP Pipeline.
 
     This function declares all necessary exchanges and queues based on conf.project_name aka. does the plumbing
+    prefetch_count determines how many unacknowledged messages the broker hands to a consumer of this channel
     """
 
     # agents to collector
@@ -20,17 +25,17 @@ def declare_amqp_pipeline(conf: config, channel: pika.channel.Channel, durable:
 
     channel.queue_bind(exchange=conf.name_exchange_agents, queue=queue_agents.method.queue)
 
-    # collector to analysers
-    channel.exchange_declare(exchange=conf.name_exchange_analyser, exchange_type='fanout')
-    queue_analyser_addr = channel.queue_declare(queue=conf.name_queue_analyser_addr, durable=durable)
-    queue_analyser_entropy = channel.queue_declare(queue=conf.name_queue_analyser_entropy, durable=durable)
-    queue_analyser_lof = channel.queue_declare(queue=conf.name_queue_analyser_lof, durable=durable)
-    queue_analyser_svm = channel.queue_declare(queue=conf.name_queue_analyser_svm, durable=durable)
+    # collector to analysers, one exchange (and set of queues) per resolution of the relayed windows
+    resolutions = [None] + list(conf.resolutions)
+    if conf.resolution and conf.resolution not in resolutions:
+        resolutions.append(conf.resolution)
 
-    channel.queue_bind(exchange=conf.name_exchange_analyser, queue=queue_analyser_addr.method.queue)
-    channel.queue_bind(exchange=conf.name_exchange_analyser, queue=queue_analyser_entropy.method.queue)
-    channel.queue_bind(exchange=conf.name_exchange_analyser, queue=queue_analyser_lof.method.queue)
-    channel.queue_bind(exchange=conf.name_exchange_analyser, queue=queue_analyser_svm.method.queue)
+    for resolution in resolutions:
+        exchange = conf.get_name_exchange_analyser(resolution)
+        channel.exchange_declare(exchange=exchange, exchange_type='fanout')
+        for name in ANALYSERS:
+            queue_analyser = channel.queue_declare(queue=conf._name_queue_analyser(name, resolution), durable=durable)
+            channel.queue_bind(exchange=exchange, queue=queue_analyser.method.queue)
 
-    # only 1 packet to process at a time
-    channel.basic_qos(prefetch_count=1)
+    # by default only 1 packet to process at a time
+    channel.basic_qos(prefetch_count=prefetch_count)
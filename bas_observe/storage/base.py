@@ -0,0 +1,82 @@
+"""
+Abstract base implementation of a storage backend
+
+A storage backend persists the agent windows written by the collector, keeps
+track which of them were already relayed to the analysers and stores the
+results of the analysers. Besides the windows of the agents, windows rolled up
+to coarser resolutions (e.g. 15m) are stored separately per resolution.
+"""
+import logging
+
+from .. import datamodel
+
+
+class BaseStorage(object):
+    """Abstract base implementation of a storage backend
+
+    Timestamps are nanoseconds since the epoch.
+    The window methods take the resolution of the windows, None uses conf.resolution,
+    which defaults to the windows of the agents.
+    Analyser results are passed as list of points in the InfluxDB JSON format:
+    ```
+    {
+        'time': 1514764800000000000,
+        'measurement': 'lof',
+        'tags': {'project': 'test', 'agent': 'agent1'},
+        'fields': {'local': 1, ...},
+    }
+    ```
+    Results of analysers scoring rolled-up windows carry the resolution as additional tag.
+    """
+    LOGGER_NAME = 'STORAGE'
+
+    def __init__(self, conf):
+        """
+        Attributes:
+            conf                Config object
+        """
+        self.conf = conf
+        self.log = logging.getLogger(self.LOGGER_NAME)
+
+    def get_resolution(self, resolution: str=None) -> str:
+        """Returns the resolution the window methods work on (None for the windows of the agents)"""
+        return resolution or self.conf.resolution
+
+    def write_windows(self, windows: [datamodel.Window], resolution: str=None) -> None:
+        """Stores finished agent windows (initially marked as not relayed)"""
+        raise NotImplementedError("write_windows is not implemented")
+
+    def get_unrelayed_windows(self, limit: int=8, resolution: str=None) -> [(int, str)]:
+        """Returns (start, agent) of the latest unrelayed windows, at most limit per agent"""
+        raise NotImplementedError("get_unrelayed_windows is not implemented")
+
+    def count_unrelayed_windows(self, resolution: str=None) -> int:
+        """Returns the number of all windows, which were not relayed yet"""
+        raise NotImplementedError("count_unrelayed_windows is not implemented")
+
+    def read_windows(self, keys: [(int, str)], resolution: str=None) -> {str: datamodel.Window}:
+        """Returns the windows identified by (start, agent), indexed by agent"""
+        raise NotImplementedError("read_windows is not implemented")
+
+    def mark_relayed(self, keys: [(int, str)], resolution: str=None) -> None:
+        """Sets the relayed flag of the windows identified by (start, agent)"""
+        raise NotImplementedError("mark_relayed is not implemented")
+
+    def get_windows(self, start: int, end: int, resolution: str=None):
+        """Generator returning all windows starting between start and end, latest first"""
+        raise NotImplementedError("get_windows is not implemented")
+
+    def write_results(self, points: [{}]) -> None:
+        """Stores analyser results"""
+        raise NotImplementedError("write_results is not implemented")
+
+    def setup(self) -> None:
+        """Creates the project database including retention policies and roll-ups, if necessary"""
+        pass
+
+    def maintain(self) -> None:
+        """Periodically called by the collector, e.g. to roll up recent data or enforce retention"""
+        pass
+
+    def close(self) -> None:
+        pass
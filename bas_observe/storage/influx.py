@@ -0,0 +1,489 @@
+"""
+Storage backend persisting windows and analyser results in an InfluxDB
+
+Windows rolled up to a coarser resolution are written in the same layout into a
+retention policy per resolution (e.g. windows_15m), so the continuous queries
+of the default policy never see them.
+
+A database switched to the single layout still holds the older windows in the
+split layout, so the windows are always read from both layouts.
+"""
+from collections import OrderedDict
+
+from .base import BaseStorage
+from .. import datamodel, misc
+
+
+def detect_window_schema(influxdb) -> str:
+    """Returns the storage layout used for the agent windows in the InfluxDB
+    Databases containing the single point measurement are considered to use the single layout.
+    """
+    result = influxdb.query(f'SHOW MEASUREMENTS WITH MEASUREMENT = "{misc.WINDOW_MEASUREMENT}"')
+    if list(result.get_points()):
+        return misc.SCHEMA_SINGLE
+
+    return misc.SCHEMA_SPLIT
+
+
+# measurement holding the end, length, relayed and trace fields of the windows in each layout
+STATUS_MEASUREMENTS = OrderedDict(((misc.SCHEMA_SPLIT, 'agent_status'), (misc.SCHEMA_SINGLE, misc.WINDOW_MEASUREMENT)))
+
+
+# how long the continuous queries keep recomputing a bucket, so late results (e.g. of the analysers
+# waiting for the relay) are still rolled up
+ROLLUP_RESAMPLE = {'1m': '10m', '1h': '2h', '1d': '2d'}
+
+
+# longest time range (in seconds) of a dashboard, which shows the series of the resolution (None is raw)
+SERIES_RANGES = ((None, 6 * 60 * 60), ('1m', 7 * 24 * 60 * 60), ('1h', 90 * 24 * 60 * 60), ('1d', None))
+# retention policy and measurement of the lookup table, the dashboards select the series by the time range from
+SERIES_POLICY = 'rp_config'
+
+
+def series_points(default_policy: str) -> [{}]:
+    """Points of the lookup table mapping dashboard time ranges (in ms, like $__from and $__to) to series"""
+    points = []
+    start = 0
+    for index, (resolution, seconds) in enumerate(SERIES_RANGES):
+        end = seconds * 1000 if seconds else 2 ** 62
+        points.append({
+            'measurement': SERIES_POLICY,
+            'tags': {'idx': str(index)},
+            'time': index,
+            'fields': {
+                'rp': rollup_policy(resolution) if resolution else default_policy,
+                'start': start,
+                'end': end,
+            },
+        })
+        start = end
+
+    return points
+
+
+def rollup_policy(resolution: str) -> str:
+    """Name of the retention policy holding the series rolled up to resolution"""
+    return f'rollup_{resolution}'
+
+
+def rollup_query(database: str, measurement: str, resolution: str) -> str:
+    """Continuous query rolling measurement up into the retention policy of resolution
+    Aggregated fields keep the name of the raw field, so dashboards only need to switch the policy.
+    """
+    if measurement == misc.WINDOW_MEASUREMENT:
+        # the single points hold the status fields (e.g. end_ns, relayed and the trace epochs) next to
+        # the counters, so only the counts of the status and the counter fields are summed up
+        aggregates = misc.RESULT_AGGREGATES['agent_status']
+        counters = [f'sum(/{misc.COUNTER_SEPARATOR}/)']
+    else:
+        aggregates = misc.RESULT_AGGREGATES.get(measurement, {})
+        counters = []
+
+    select = ', '.join([f'{func}("{field}") AS "{field}"' for field, func in aggregates.items()] + counters)
+    if not select:
+        # counter fields are not known in advance (e.g. addresses), InfluxDB names them sum_<field>
+        select = 'sum(*)'
+
+    return (
+        'CREATE CONTINUOUS QUERY "bob_{measurement}_{resolution}" ON "{database}" RESAMPLE FOR {resample} BEGIN '
+        'SELECT {select} INTO "{database}"."{policy}"."{measurement}" FROM "{database}".."{measurement}" '
+        'GROUP BY time({resolution}), * END'
+    ).format(
+        measurement=measurement,
+        resolution=resolution,
+        database=database,
+        policy=rollup_policy(resolution),
+        select=select,
+        resample=ROLLUP_RESAMPLE.get(resolution, resolution),
+    )
+
+
+def window_policy(resolution: str) -> str:
+    """Name of the retention policy holding the windows rolled up to resolution"""
+    return f'windows_{resolution}'
+
+
+def window_points(window: datamodel.Window, project_name: str, schema: str=misc.SCHEMA_SPLIT) -> [{}]:
+    """Converts a window into InfluxDB points in the given storage layout"""
+    data = [
+        {
+            'time': window.start,
+            'measurement': 'agent_status',
+            'tags': {
+                'project': project_name,
+                'agent': window.agent,
+            },
+            'fields': {
+                # not stored as 'end', since that field holds strings in databases of older versions
+                'end_ns': window.end,
+                'length': (window.end - window.start) // misc.NS_PER_SECOND,
+                'relayed': False,
+                'count': sum(window.priority.values())  # get the overall number of telegrams from the priority, because it is a value with small range (aka. faster to sum)
+            }
+        }
+    ]
+    for stage, time in window.trace.items():
+        data[0]['fields'][f'{misc.TRACE_FIELD_PREFIX}{stage}'] = time
+
+    if schema == misc.SCHEMA_SINGLE:
+        # put the counters next to the status fields into one point
+        data[0]['measurement'] = misc.WINDOW_MEASUREMENT
+        for field in misc.MEASUREMENTS:
+            for key, amount in getattr(window, field).items():
+                data[0]['fields'][f'{field}{misc.COUNTER_SEPARATOR}{key}'] = amount
+
+        return data
+
+    for field in misc.MEASUREMENTS:
+        value = getattr(window, field)
+        if not value:
+            # skip fields with empty values
+            continue
+
+        data.append({
+            'time': window.start,
+            'measurement': field,
+            'tags': {
+                'project': project_name,
+                'agent': window.agent,
+            },
+            'fields': value
+        })
+
+    return data
+
+
+def _trace_from_fields(data: {}) -> {}:
+    """Returns the trace record stored in the fields of an agent_status point"""
+    prefix = misc.TRACE_FIELD_PREFIX
+    return {key[len(prefix):]: int(value) for key, value in data.items() if key.startswith(prefix) and value is not None}
+
+
+class InfluxStorage(BaseStorage):
+    """Storage backend using the InfluxDB behind conf.storage_url"""
+    LOGGER_NAME = 'INFLUXDB'
+
+    def __init__(self, conf):
+        super().__init__(conf)
+        self.influxdb = None
+        # storage layout of the stored windows, determined on first use
+        self.schema = None
+        # retention policies of the resolutions, which are known to exist
+        self._window_policies = set()
+
+    def get_influxdb(self):
+        if not self.influxdb:
+            self.influxdb = self.conf.get_influxdb_connection()
+
+        return self.influxdb
+
+    def get_schema(self) -> str:
+        """Returns the storage layout new windows are written in
+        Databases already containing single points keep the single layout, otherwise it is configured.
+        """
+        if not self.schema:
+            self.schema = detect_window_schema(self.get_influxdb())
+            if self.conf.storage_schema == misc.SCHEMA_SINGLE:
+                self.schema = misc.SCHEMA_SINGLE
+
+            self.log.info(f"Windows are stored in the {self.schema} layout")
+
+        return self.schema
+
+    def _query_status(self, query: str, resolution: str=None, **kwargs):
+        """Runs query on the status measurements of both layouts
+        The query is formatted with the qualified measurement as source.
+        Generator returning (schema, point) of the points of both layouts
+        """
+        statements = [query.format(source=self._from(measurement, resolution)) for measurement in STATUS_MEASUREMENTS.values()]
+        results = self.get_influxdb().query('; '.join(statements), **kwargs)
+
+        for (schema, measurement), result in zip(STATUS_MEASUREMENTS.items(), results):
+            for point in result.get_points(measurement):
+                yield schema, point
+
+    def _from(self, measurement: str, resolution: str=None) -> str:
+        """Returns the measurement for FROM clauses, qualified by the retention policy of resolution"""
+        resolution = self.get_resolution(resolution)
+        if not resolution:
+            return f'"{measurement}"'
+
+        return f'"{self.conf.parse_influxdb_url()["db"]}"."{window_policy(resolution)}"."{measurement}"'
+
+    def _write_window_points(self, data: [{}], resolution: str=None) -> None:
+        resolution = self.get_resolution(resolution)
+        if not resolution:
+            self.get_influxdb().write_points(data, time_precision='n')
+            return
+
+        policy = window_policy(resolution)
+        if policy not in self._window_policies and self.conf.parse_influxdb_url()['scheme'] != 'udp':
+            database = self.conf.parse_influxdb_url()['db']
+            existing = {existing['name'] for existing in self.get_influxdb().get_list_retention_policies(database)}
+            duration = self.conf.get_retention(policy)
+            if policy not in existing:
+                self.log.info(f"Create retention policy {policy} with duration {duration} for the windows rolled up to {resolution}")
+                self.get_influxdb().create_retention_policy(policy, duration, 1, database=database)
+            elif policy in self.conf.retention:
+                # only processes given the retention change it, the others (e.g. relaying) keep it
+                self.get_influxdb().alter_retention_policy(policy, database=database, duration=duration)
+
+            self._window_policies.add(policy)
+
+        self.get_influxdb().write_points(data, time_precision='n', retention_policy=policy)
+
+    def write_windows(self, windows: [datamodel.Window], resolution: str=None) -> None:
+        schema = self.get_schema()
+        data = []
+        for window in windows:
+            data.extend(window_points(window, self.conf.project_name, schema=schema))
+
+        self.log.debug(data)
+        self._write_window_points(data, resolution)
+
+    def get_unrelayed_windows(self, limit: int=8, resolution: str=None) -> [(int, str)]:
+        points = self._query_status(
+            'SELECT "agent", "relayed" FROM {{source}} WHERE "project" = \'{project}\' and "relayed" = false GROUP BY "agent" ORDER BY time DESC LIMIT {limit}'.format(
+                limit=limit,
+                project=self.conf.project_name,
+            ),
+            resolution,
+            epoch='ns'
+        )
+
+        # the latest windows of an agent may be spread over both layouts
+        agent_times = OrderedDict()
+        for schema, row in points:
+            agent_times.setdefault(row['agent'], []).append(row['time'])
+
+        return [(time, agent) for agent, times in agent_times.items() for time in sorted(times, reverse=True)[:limit]]
+
+    def count_unrelayed_windows(self, resolution: str=None) -> int:
+        points = self._query_status(
+            'SELECT count("end_ns") FROM {{source}} WHERE "project" = \'{project}\' and "relayed" = false'.format(
+                project=self.conf.project_name,
+            ),
+            resolution
+        )
+
+        return sum(row['count'] for schema, row in points)
+
+    def read_windows(self, keys: [(int, str)], resolution: str=None) -> {str: datamodel.Window}:
+        if not keys:
+            return {}
+
+        agent_windows = self._read_single_windows(keys, resolution)
+
+        # the remaining windows are stored in the split layout
+        keys = [(time, agent) for time, agent in keys if agent not in agent_windows or agent_windows[agent].start != time]
+        if keys:
+            agent_windows.update(self._read_split_windows(keys, resolution))
+
+        return agent_windows
+
+    def _read_split_windows(self, keys: [(int, str)], resolution: str=None) -> {str: datamodel.Window}:
+        """
+        Fetches the requested windows with one query per measurement and window (split layout)
+        """
+        query = []
+        agent_windows = {}
+
+        # one query per agent per measurement
+        # yes, this is super inefficient, but we can't group by agent since the
+        # timestamps might differ slightly and joining multiple measurements
+        # causes enourmous tables
+        for time, agent in keys:
+            for measurement in ('agent_status', ) + misc.MEASUREMENTS:
+                query.append('SELECT * FROM {source} WHERE "project" = \'{project}\' and "agent" = \'{agent}\' and time = {time}'.format(
+                    project=self.conf.project_name,
+                    agent=agent,
+                    time=time,
+                    source=self._from(measurement, resolution),
+                ))
+
+        try:
+            result = self.get_influxdb().query('; '.join(query), epoch='ns')
+        except:
+            self.log.warn(f"InfluxDB query failed:{ '; '.join(query)}")
+            return {}
+
+        for resultset in result:
+            if len(resultset.items()) <= 0:
+                # no items in resultset
+                self.log.warn(f"Got empty resultset for InfluxDB query\"{query[result.index(resultset)]}\"")
+                continue
+
+            # iterate over the different queries
+            (measure, nan), data = resultset.items()[0]
+            data = next(data)  # only contains one item, so we can simply pop it without heavy iteration
+            agent = data['agent']
+
+            if agent not in agent_windows:
+                agent_windows[agent] = datamodel.Window(data['time'], agent)
+
+            if measure == 'agent_status':
+                # sets end time and trace record of window
+                agent_windows[agent].end = misc.parse_epoch(data.get('end_ns') or data.get('end'))
+                agent_windows[agent].trace = _trace_from_fields(data)
+            else:
+                # writes values to window
+                setattr(agent_windows[agent], measure, {k: v for k, v in data.items() if k not in ('time', 'project', 'agent')})
+
+        return agent_windows
+
+    def _read_single_windows(self, keys: [(int, str)], resolution: str=None) -> {str: datamodel.Window}:
+        """
+        Fetches all requested windows with a single query (single point layout)
+        """
+        times = [time for time, agent in keys]
+        wanted = set(keys)
+        query = 'SELECT * FROM {source} WHERE "project" = \'{project}\' and time >= {start} and time <= {end}'.format(
+            source=self._from(misc.WINDOW_MEASUREMENT, resolution),
+            project=self.conf.project_name,
+            start=min(times),
+            end=max(times),
+        )
+
+        agent_windows = {}
+        for row in self.get_influxdb().query(query, epoch='ns').get_points(misc.WINDOW_MEASUREMENT):
+            window = datamodel.Window.from_influxdb_point(row)
+            if (window.start, window.agent) in wanted:
+                agent_windows[window.agent] = window
+
+        return agent_windows
+
+    def _single_keys(self, keys: [(int, str)], resolution: str=None) -> {(int, str)}:
+        """Returns the keys of the windows, which are stored in the single layout"""
+        times = [time for time, agent in keys]
+        query = 'SELECT "agent", "relayed" FROM {source} WHERE "project" = \'{project}\' and time >= {start} and time <= {end}'.format(
+            source=self._from(misc.WINDOW_MEASUREMENT, resolution),
+            project=self.conf.project_name,
+            start=min(times),
+            end=max(times),
+        )
+
+        stored = {(row['time'], row['agent']) for row in self.get_influxdb().query(query, epoch='ns').get_points(misc.WINDOW_MEASUREMENT)}
+        return stored & set(keys)
+
+    def mark_relayed(self, keys: [(int, str)], resolution: str=None) -> None:
+        if not keys:
+            return
+
+        single = self._single_keys(keys, resolution)
+        data = []
+        for time, agent in keys:
+            # rewriting the point with the same time and tags only updates the given field
+            schema = misc.SCHEMA_SINGLE if (time, agent) in single else misc.SCHEMA_SPLIT
+            data.append({
+                'time': time,
+                'measurement': STATUS_MEASUREMENTS[schema],
+                'tags': {
+                    'project': self.conf.project_name,
+                    'agent': agent,
+                },
+                'fields': {
+                    'relayed': True
+                }
+            })
+
+        self._write_window_points(data, resolution)
+
+    def get_windows(self, start: int, end: int, resolution: str=None):
+        points = self._query_status('SELECT * FROM {{source}} WHERE "project" = \'{project}\' and time > {start} and time < {end} ORDER BY time DESC'.format(
+            project=self.conf.project_name,
+            start=start,
+            end=end,
+        ), resolution, epoch='ns')
+
+        # interleave the windows of both layouts, latest first
+        for schema, data in sorted(points, key=lambda point: point[1]['time'], reverse=True):
+            # construct window datamodel
+            self.log.debug(data)
+            if schema == misc.SCHEMA_SINGLE:
+                # the point already contains the whole window
+                yield datamodel.Window.from_influxdb_point(data)
+            else:
+                window = datamodel.Window(
+                    data['time'],
+                    data['agent'],
+                    misc.parse_epoch(data.get('end_ns') or data.get('end'))
+                )
+                window.trace = _trace_from_fields(data)
+
+                # fill it with the measurements
+                yield self._query_measurements(window, resolution)
+
+    def _query_measurements(self, window: datamodel.Window, resolution: str=None):
+        queries = []
+
+        for measure in misc.MEASUREMENTS:
+            queries.append(
+                'SELECT * FROM {source} WHERE "project" = \'{project}\' and "agent" = \'{agent}\' and time = {time} LIMIT 1'.format(
+                    project=self.conf.project_name,
+                    agent=window.agent,
+                    time=window.start,
+                    source=self._from(measure, resolution),
+                )
+            )
+
+        self.log.debug(f"Execute InfluxDB queries: \"{'; '.join(queries)}\"")
+        result = self.get_influxdb().query('; '.join(queries), epoch='ns')
+        for resultset in result:
+            if len(resultset.items()) <= 0:
+                # no items in resultset
+                self.log.warn(f"Got empty resultset for InfluxDB query\"{queries[result.index(resultset)]}\"")
+                continue
+
+            (measure, group), data = resultset.items()[0]
+            data = next(data)
+            # writes values to window
+            setattr(window, measure, {k: v for k, v in data.items() if k not in ('time', 'project', 'agent')})
+
+        return window
+
+    def write_results(self, points: [{}]) -> None:
+        self.get_influxdb().write_points(points, time_precision='n')
+
+    def setup(self) -> None:
+        if self.conf.parse_influxdb_url()['scheme'] == 'udp':
+            self.log.warn("Cannot set up retention policies and continuous queries via UDP")
+            return
+
+        client = self.get_influxdb()
+        database = self.conf.parse_influxdb_url()['db']
+        client.create_database(database)
+
+        policies = {policy['name']: policy for policy in client.get_list_retention_policies(database)}
+        default_policy = next((name for name, policy in policies.items() if policy['default']), 'autogen')
+        client.alter_retention_policy(default_policy, database=database, duration=self.conf.get_retention('raw'))
+
+        for resolution, seconds in misc.ROLLUPS:
+            policy = rollup_policy(resolution)
+            duration = self.conf.get_retention(resolution)
+            if policy in policies:
+                client.alter_retention_policy(policy, database=database, duration=duration)
+            else:
+                self.log.info(f"Create retention policy {policy} with duration {duration}")
+                client.create_retention_policy(policy, duration, 1, database=database)
+
+        if SERIES_POLICY not in policies:
+            client.create_retention_policy(SERIES_POLICY, misc.RETENTION_INFINITE, 1, database=database)
+        client.write_points(series_points(default_policy), time_precision='n', retention_policy=SERIES_POLICY)
+
+        existing = {query['name']: query['query'] for query in client.query('SHOW CONTINUOUS QUERIES').get_points(database)}
+        measurements = ('agent_status', misc.WINDOW_MEASUREMENT) + misc.MEASUREMENTS + tuple(misc.RESULT_AGGREGATES.keys())
+        for measurement in OrderedDict.fromkeys(measurements):
+            for resolution, seconds in misc.ROLLUPS:
+                name = f'bob_{measurement}_{resolution}'
+                query = rollup_query(database, measurement, resolution)
+                if name in existing:
+                    # created by an older version, which did not resample late data or summed up all fields
+                    outdated = 'RESAMPLE' not in existing[name].upper() or ('sum(*)' in existing[name] and 'sum(*)' not in query)
+                    if not outdated:
+                        continue
+
+                    self.log.info(f"Replace continuous query {name}")
+                    client.query(f'DROP CONTINUOUS QUERY "{name}" ON "{database}"')
+
+                self.log.info(f"Create continuous query rolling up {measurement} to {resolution}")
+                client.query(query)
@@ -0,0 +1,448 @@
+"""
+Embedded storage backend persisting windows and analyser results in a local SQLite file
+
+Windows are stored in one row per agent window, the counter dicts (and the trace record)
+are serialised as JSON into one column per measurement. Analyser results are stored in a narrow
+table with one row per field, so they can be aggregated within SQLite. Their window_resolution
+column holds the resolution tag of the results of rolled-up windows ('' for the agent windows).
+Rolled-up series (cf. misc.ROLLUPS) are kept in the same narrow format in the rollups table.
+Windows rolled up to a coarser resolution are stored in a windows table per resolution (e.g. windows_15m).
+The roll-ups track the rows of the windows and results tables by their explicit id column, which (unlike
+the implicit rowid) is kept by VACUUM and never reused.
+"""
+import json
+import sqlite3
+import threading
+
+from .base import BaseStorage
+from .. import datamodel, misc
+
+
+_COUNTER_COLUMNS = ', '.join(f'{measurement} TEXT' for measurement in misc.MEASUREMENTS)
+
+# statements creating a windows table, formatted with its name
+_WINDOWS_SCHEMA = (
+    '''CREATE TABLE IF NOT EXISTS {table} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        project TEXT NOT NULL,
+        agent TEXT NOT NULL,
+        start INTEGER NOT NULL,
+        end INTEGER,
+        window_length INTEGER,
+        count INTEGER,
+        relayed INTEGER NOT NULL DEFAULT 0,
+        {counters},
+        trace TEXT,
+        UNIQUE (project, start, agent)
+    )''',
+    'CREATE INDEX IF NOT EXISTS {table}_unrelayed ON {table} (project, relayed, agent, start)',
+)
+
+# statements creating the tables of the analyser results, which are part of _SCHEMA
+_RESULTS_SCHEMA = {
+    'results': '''CREATE TABLE IF NOT EXISTS results (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        measurement TEXT NOT NULL,
+        project TEXT NOT NULL,
+        agent TEXT NOT NULL,
+        window_resolution TEXT NOT NULL DEFAULT '',
+        time INTEGER NOT NULL,
+        field TEXT NOT NULL,
+        value REAL,
+        UNIQUE (measurement, project, agent, window_resolution, time, field)
+    )''',
+    'rollups': '''CREATE TABLE IF NOT EXISTS rollups (
+        resolution TEXT NOT NULL,
+        measurement TEXT NOT NULL,
+        project TEXT NOT NULL,
+        agent TEXT NOT NULL,
+        window_resolution TEXT NOT NULL DEFAULT '',
+        time INTEGER NOT NULL,
+        field TEXT NOT NULL,
+        value REAL,
+        PRIMARY KEY (resolution, measurement, project, agent, window_resolution, time, field)
+    )''',
+}
+
+_SCHEMA = tuple(statement.format(table='windows', counters=_COUNTER_COLUMNS) for statement in _WINDOWS_SCHEMA) + (
+    _RESULTS_SCHEMA['results'],
+    _RESULTS_SCHEMA['rollups'],
+    # latest id of the windows and results tables, which was rolled up
+    'CREATE TABLE IF NOT EXISTS rollup_progress (source TEXT PRIMARY KEY, last_rowid INTEGER NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS results_time ON results (time)',
+    'CREATE INDEX IF NOT EXISTS rollups_time ON rollups (resolution, time)',
+)
+
+# tables, whose rows are rolled up
+_ROLLUP_SOURCES = ('windows', 'results')
+
+
+def window_table(resolution: str=None) -> str:
+    """Name of the table holding the windows of resolution (None for the windows of the agents)"""
+    if not resolution:
+        return 'windows'
+
+    # validates the resolution, since it becomes part of the SQL
+    misc.parse_duration(resolution)
+    return f'windows_{resolution}'
+
+
+def _bucket_sql(column: str, seconds: int) -> str:
+    """SQL expression truncating the timestamp column to the start of its bucket"""
+    return f"(({column} / {seconds * misc.NS_PER_SECOND}) * {seconds * misc.NS_PER_SECOND})"
+
+
+class SqliteStorage(BaseStorage):
+    """Storage backend using a SQLite database file, which does not need any server"""
+    LOGGER_NAME = 'SQLITE'
+
+    def __init__(self, conf, path: str):
+        """
+        Attributes:
+            conf                Config object
+            path                Path to the database file (':memory:' for a volatile database)
+        """
+        super().__init__(conf)
+        self.path = path
+        # the collector relays from a thread pool, so the connection is shared and guarded by a lock
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self.db:
+            for statement in _SCHEMA:
+                self.db.execute(statement)
+            self._add_trace_column('windows')
+            self._add_window_resolution_column()
+            self._add_id_column('windows', _WINDOWS_SCHEMA)
+            self._add_id_column('results', (_RESULTS_SCHEMA['results'], ))
+
+        # window tables of the resolutions, which are known to exist
+        self._window_tables = {'windows'}
+
+        self.log.info(f"Opened SQLite storage at {path}")
+
+    def _table(self, resolution: str=None) -> str:
+        """Returns the windows table of resolution and creates it on first use"""
+        table = window_table(self.get_resolution(resolution))
+        if table not in self._window_tables:
+            with self._lock, self.db:
+                for statement in _WINDOWS_SCHEMA:
+                    self.db.execute(statement.format(table=table, counters=_COUNTER_COLUMNS))
+                self._add_trace_column(table)
+                self._add_id_column(table, _WINDOWS_SCHEMA)
+
+            self._window_tables.add(table)
+
+        return table
+
+    def _add_trace_column(self, table: str) -> None:
+        """Adds the trace column to a windows table created by an older version"""
+        columns = [row[1] for row in self.db.execute(f'PRAGMA table_info({table})')]
+        if 'trace' not in columns:
+            self.log.info(f"Add the trace column to table {table}")
+            self.db.execute(f'ALTER TABLE {table} ADD COLUMN trace TEXT')
+
+    def _add_window_resolution_column(self) -> None:
+        """Recreates the result tables created by an older version with the window_resolution column
+        The column is part of the primary key, which cannot be altered in place.
+        """
+        for table, statement in _RESULTS_SCHEMA.items():
+            columns = [row[1] for row in self.db.execute(f'PRAGMA table_info({table})')]
+            if 'window_resolution' in columns:
+                continue
+
+            self.log.info(f"Add the window_resolution column to table {table}")
+            self.db.execute(f'ALTER TABLE {table} RENAME TO {table}_old')
+            self.db.execute(statement)
+            self.db.execute(f"INSERT INTO {table} ({', '.join(columns)}) SELECT {', '.join(columns)} FROM {table}_old")
+            self.db.execute(f'DROP TABLE {table}_old')
+            # the copied rows got new rowids, so roll them up again
+            self.db.execute('DELETE FROM rollup_progress WHERE source = ?', (table, ))
+            # the indexes were dropped along with the old table
+            for statement in _SCHEMA:
+                self.db.execute(statement)
+
+    def _add_id_column(self, table: str, statements: (str, )) -> None:
+        """Recreates a table created by an older version with the id column
+        An INTEGER PRIMARY KEY cannot be added in place. The rows keep their rowids as ids,
+        so the progress of the roll-ups stays valid.
+        """
+        columns = [row[1] for row in self.db.execute(f'PRAGMA table_info({table})')]
+        if 'id' in columns:
+            return
+
+        self.log.info(f"Add the id column to table {table}")
+        self.db.execute(f'ALTER TABLE {table} RENAME TO {table}_old')
+        self.db.execute(statements[0].format(table=table, counters=_COUNTER_COLUMNS))
+        self.db.execute(f"INSERT INTO {table} (id, {', '.join(columns)}) SELECT rowid, {', '.join(columns)} FROM {table}_old")
+        self.db.execute(f'DROP TABLE {table}_old')
+        # the indexes were dropped along with the old table
+        for statement in statements[1:]:
+            self.db.execute(statement.format(table=table, counters=_COUNTER_COLUMNS))
+        for statement in _SCHEMA:
+            self.db.execute(statement)
+
+    def _window_from_row(self, row) -> datamodel.Window:
+        start, agent, end = row[:3]
+        window = datamodel.Window(start, agent, end)
+        for measurement, value in zip(misc.MEASUREMENTS, row[3:-1]):
+            setattr(window, measurement, json.loads(value) if value else {})
+        window.trace = json.loads(row[-1]) if row[-1] else {}
+
+        return window
+
+    @property
+    def _window_columns(self) -> str:
+        return ', '.join(('start', 'agent', 'end') + misc.MEASUREMENTS + ('trace', ))
+
+    def write_windows(self, windows: [datamodel.Window], resolution: str=None) -> None:
+        table = self._table(resolution)
+        rows = []
+        for window in windows:
+            rows.append((
+                self.conf.project_name,
+                window.agent,
+                window.start,
+                window.end,
+                (window.end - window.start) // misc.NS_PER_SECOND,
+                sum(window.priority.values()),
+            ) + tuple(json.dumps(getattr(window, measurement)) for measurement in misc.MEASUREMENTS) + (
+                json.dumps(window.trace) if window.trace else None,
+            ))
+
+        with self._lock, self.db:
+            self.db.executemany(
+                'INSERT OR REPLACE INTO {table} (project, agent, start, end, window_length, count, {counters}, trace) VALUES ({placeholders})'.format(
+                    table=table,
+                    counters=', '.join(misc.MEASUREMENTS),
+                    placeholders=', '.join('?' * (7 + len(misc.MEASUREMENTS))),
+                ),
+                rows
+            )
+
+    def get_unrelayed_windows(self, limit: int=8, resolution: str=None) -> [(int, str)]:
+        table = self._table(resolution)
+        with self._lock:
+            agents = [row[0] for row in self.db.execute(
+                f'SELECT DISTINCT agent FROM {table} WHERE project = ? and relayed = 0', (self.conf.project_name, ))]
+
+            rows = []
+            for agent in agents:
+                rows.extend(self.db.execute(
+                    f'SELECT start, agent FROM {table} WHERE project = ? and relayed = 0 and agent = ? ORDER BY start DESC LIMIT ?',
+                    (self.conf.project_name, agent, limit)
+                ))
+
+        return [(start, agent) for start, agent in rows]
+
+    def count_unrelayed_windows(self, resolution: str=None) -> int:
+        table = self._table(resolution)
+        with self._lock:
+            return self.db.execute(f'SELECT COUNT(*) FROM {table} WHERE project = ? and relayed = 0',
+                                   (self.conf.project_name, )).fetchone()[0]
+
+    def read_windows(self, keys: [(int, str)], resolution: str=None) -> {str: datamodel.Window}:
+        table = self._table(resolution)
+        agent_windows = {}
+        with self._lock:
+            for time, agent in keys:
+                row = self.db.execute(
+                    f'SELECT {self._window_columns} FROM {table} WHERE project = ? and agent = ? and start = ?',
+                    (self.conf.project_name, agent, time)
+                ).fetchone()
+
+                if row:
+                    agent_windows[agent] = self._window_from_row(row)
+                else:
+                    self.log.warn(f"Window of agent {agent} at {time} does not exist")
+
+        return agent_windows
+
+    def mark_relayed(self, keys: [(int, str)], resolution: str=None) -> None:
+        table = self._table(resolution)
+        with self._lock, self.db:
+            self.db.executemany(
+                f'UPDATE {table} SET relayed = 1 WHERE project = ? and agent = ? and start = ?',
+                [(self.conf.project_name, agent, time) for time, agent in keys]
+            )
+
+    def get_windows(self, start: int, end: int, resolution: str=None):
+        table = self._table(resolution)
+        with self._lock:
+            rows = self.db.execute(
+                f'SELECT {self._window_columns} FROM {table} WHERE project = ? and start > ? and start < ? ORDER BY start DESC',
+                (self.conf.project_name, start, end)
+            ).fetchall()
+
+        for row in rows:
+            yield self._window_from_row(row)
+
+    def write_results(self, points: [{}]) -> None:
+        rows = []
+        for point in points:
+            for field, value in point['fields'].items():
+                rows.append((
+                    point['measurement'],
+                    point['tags'].get('project', self.conf.project_name),
+                    point['tags'].get('agent', ''),
+                    point['tags'].get('resolution', ''),
+                    point['time'],
+                    field,
+                    float(value),
+                ))
+
+        with self._lock, self.db:
+            self.db.executemany(
+                'INSERT OR REPLACE INTO results (measurement, project, agent, window_resolution, time, field, value) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                rows
+            )
+
+    def maintain(self) -> None:
+        # rows are inserted (or replaced) with increasing ids, so every row above the id rolled up
+        # last is new, no matter how late it arrived (e.g. results of a backtest)
+        with self._lock:
+            done = dict(self.db.execute('SELECT source, last_rowid FROM rollup_progress').fetchall())
+            latest = {source: self.db.execute(f'SELECT MAX(id) FROM {source}').fetchone()[0] or 0
+                      for source in _ROLLUP_SOURCES}
+        ids = {source: (done.get(source, 0), latest[source]) for source in _ROLLUP_SOURCES}
+
+        finer = None
+        for resolution, seconds in misc.ROLLUPS:
+            rows = []
+            buckets = self._changed_buckets('results', 'time', seconds, *ids['results'])
+            if buckets:
+                rows.extend(self._rollup_results(seconds, buckets))
+
+            buckets = self._changed_buckets('windows', 'start', seconds, *ids['windows'])
+            if buckets:
+                rows.extend(self._rollup_windows(seconds, buckets, finer))
+            finer = resolution
+
+            if not rows:
+                continue
+
+            with self._lock, self.db:
+                # changed buckets are recomputed as a whole, so replace them
+                self.db.executemany(
+                    'INSERT OR REPLACE INTO rollups (resolution, measurement, project, agent, window_resolution, time, field, value) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    [(resolution, ) + row for row in rows]
+                )
+
+            self.log.debug(f"Rolled up {len(rows)} values to {resolution}")
+
+        with self._lock, self.db:
+            # the ids never decrease, even if the latest rows were deleted in the meantime
+            self.db.executemany('INSERT OR REPLACE INTO rollup_progress (source, last_rowid) VALUES (?, MAX(?, ?))',
+                                [(source, latest[source], done.get(source, 0)) for source in _ROLLUP_SOURCES])
+
+        self._enforce_retention()
+
+    def _changed_buckets(self, table: str, column: str, seconds: int, after: int, until: int) -> set:
+        """Returns the starts of the buckets, which rows with an id in (after, until] fall into"""
+        if until <= after:
+            return set()
+
+        with self._lock:
+            return {row[0] for row in self.db.execute(
+                f'SELECT DISTINCT {_bucket_sql(column, seconds)} FROM {table} WHERE id > ? and id <= ?', (after, until))}
+
+    def _rollup_results(self, seconds: int, buckets: set) -> [()]:
+        """Aggregates the analyser results of the buckets"""
+        with self._lock:
+            result = self.db.execute(
+                f'''SELECT measurement, project, agent, window_resolution, {_bucket_sql('time', seconds)} AS bucket, field,
+                    SUM(value), AVG(value) FROM results WHERE time >= ? and time < ?
+                    GROUP BY measurement, project, agent, window_resolution, bucket, field''',
+                (min(buckets), max(buckets) + seconds * misc.NS_PER_SECOND)
+            ).fetchall()
+
+        rows = []
+        for measurement, project, agent, window_resolution, bucket, field, value_sum, value_mean in result:
+            if bucket not in buckets:
+                continue
+
+            func = misc.RESULT_AGGREGATES.get(measurement, {}).get(field, 'mean')
+            rows.append((measurement, project, agent, window_resolution, bucket, field, value_sum if func == 'sum' else value_mean))
+
+        return rows
+
+    def _rollup_windows(self, seconds: int, buckets: set, finer: str=None) -> [()]:
+        """Aggregates the agent status and sums up the counters of the buckets
+        The counters are summed up from the rolled-up series of the finer resolution, if given,
+        so only the finest one parses the counters of the single windows.
+        """
+        start, end = min(buckets), max(buckets) + seconds * misc.NS_PER_SECOND
+        with self._lock:
+            status = self.db.execute(
+                f'''SELECT project, agent, {_bucket_sql('start', seconds)} AS bucket, SUM(count), SUM(window_length)
+                    FROM windows WHERE start >= ? and start < ? GROUP BY project, agent, bucket''',
+                (start, end)
+            ).fetchall()
+            if finer:
+                counters = self.db.execute(
+                    f'''SELECT measurement, project, agent, window_resolution, {_bucket_sql('time', seconds)} AS bucket, field, SUM(value)
+                        FROM rollups WHERE resolution = ? and measurement IN ({', '.join('?' * len(misc.MEASUREMENTS))})
+                        and time >= ? and time < ? GROUP BY measurement, project, agent, window_resolution, bucket, field''',
+                    (finer, ) + misc.MEASUREMENTS + (start, end)
+                ).fetchall()
+            else:
+                windows = self.db.execute(
+                    f'''SELECT project, agent, {_bucket_sql('start', seconds)}, {', '.join(misc.MEASUREMENTS)}
+                        FROM windows WHERE start >= ? and start < ?''',
+                    (start, end)
+                ).fetchall()
+
+        rows = []
+        for project, agent, bucket, count, length in status:
+            if bucket in buckets:
+                rows.append(('agent_status', project, agent, '', bucket, 'count', count))
+                rows.append(('agent_status', project, agent, '', bucket, 'length', length))
+
+        if finer:
+            rows.extend(row for row in counters if row[4] in buckets)
+            return rows
+
+        counters = {}  # {(measurement, project, agent, bucket): {key: amount}}
+        for row in windows:
+            project, agent, bucket = row[:3]
+            if bucket not in buckets:
+                continue
+
+            for measurement, value in zip(misc.MEASUREMENTS, row[3:]):
+                counter = counters.setdefault((measurement, project, agent, bucket), {})
+                for key, amount in (json.loads(value) if value else {}).items():
+                    counter[key] = counter.get(key, 0) + (amount or 0)
+
+        for (measurement, project, agent, bucket), counter in counters.items():
+            rows.extend((measurement, project, agent, '', bucket, key, amount) for key, amount in counter.items())
+
+        return rows
+
+    def _enforce_retention(self) -> None:
+        """Deletes raw and rolled-up data older than the configured retention durations
+        The windows rolled up to a resolution are kept as long as the series of their table (e.g. windows_15m).
+        """
+        now = misc.now_epoch()
+        raw = misc.parse_duration(self.conf.get_retention('raw'))
+        with self._lock, self.db:
+            if raw:
+                cutoff = now - misc.duration_to_ns(raw)
+                self.db.execute('DELETE FROM windows WHERE start < ?', (cutoff, ))
+                self.db.execute('DELETE FROM results WHERE time < ?', (cutoff, ))
+
+            tables = [row[0] for row in self.db.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' and name LIKE 'windows\\_%' ESCAPE '\\'")]
+            for table in tables:
+                duration = misc.parse_duration(self.conf.get_retention(table))
+                if duration:
+                    self.db.execute(f'DELETE FROM {table} WHERE start < ?', (now - misc.duration_to_ns(duration), ))
+
+            for resolution, seconds in misc.ROLLUPS:
+                duration = misc.parse_duration(self.conf.get_retention(resolution))
+                if duration:
+                    self.db.execute('DELETE FROM rollups WHERE resolution = ? and time < ?',
+                                    (resolution, now - misc.duration_to_ns(duration)))
+
+    def close(self) -> None:
+        with self._lock:
+            self.db.close()
@@ -0,0 +1,257 @@
+"""
+Reproducible synthetic KNX traffic for benchmarks and load tests
+
+The traffic of an agent is drawn from a TrafficProfile: a population of device (source)
+and group (destination) addresses with skewed popularity, mixes of APCIs, priorities,
+payload lengths and hop counts, and a Poisson arrival rate, which is multiplied during
+periodic bursts. All values are drawn from seeded random generators, so the same seed
+always produces the same telegrams and windows.
+"""
+import math
+import random
+from collections import Counter, OrderedDict
+
+from attr import attrs, attrib, Factory
+
+from . import datamodel, misc
+
+
+DEFAULT_APCI_MIX = {'GroupValueWrite': 70, 'GroupValueResponse': 20, 'GroupValueRead': 10}
+DEFAULT_PRIORITY_MIX = {'LOW': 90, 'NORMAL': 8, 'URGENT': 1, 'SYSTEM': 1}
+DEFAULT_LENGTH_MIX = {1: 60, 2: 20, 3: 12, 4: 8}
+DEFAULT_HOP_COUNT_MIX = {6: 95, 5: 4, 4: 1}
+
+# 4 bit APCI codes of the group services and 2 bit priority codes of the control field (KNX standard frame)
+_APCI_CODES = {'GroupValueRead': 0x0, 'GroupValueResponse': 0x1, 'GroupValueWrite': 0x2}
+_PRIORITY_CODES = {'SYSTEM': 0b00, 'NORMAL': 0b01, 'URGENT': 0b10, 'LOW': 0b11}
+
+
+@attrs
+class TrafficProfile(object):
+    """Describes the synthetic traffic of one agent
+
+    Attributes:
+        devices             Number of device addresses sending telegrams
+        groups              Number of group addresses receiving telegrams
+        skew                Popularity of the n-th address is proportional to 1 / n ** skew
+        rate                Mean number of telegrams per second
+        burst_interval      Seconds between the starts of two bursts (0 disables bursts)
+        burst_length        Duration of a burst in seconds
+        burst_factor        Multiplier of the rate during a burst
+        apci_mix            Relative weights of the APCIs (only group services can be encoded to frames)
+        priority_mix        Relative weights of the priorities
+        length_mix          Relative weights of the payload lengths
+        hop_count_mix       Relative weights of the hop counts
+    """
+
+    devices = attrib(default=64)  # type: int
+    groups = attrib(default=256)  # type: int
+    skew = attrib(default=1.0)  # type: float
+    rate = attrib(default=5.0)  # type: float
+    burst_interval = attrib(default=0)  # type: int
+    burst_length = attrib(default=10)  # type: int
+    burst_factor = attrib(default=10.0)  # type: float
+    apci_mix = attrib(default=Factory(lambda: dict(DEFAULT_APCI_MIX)))  # type: dict
+    priority_mix = attrib(default=Factory(lambda: dict(DEFAULT_PRIORITY_MIX)))  # type: dict
+    length_mix = attrib(default=Factory(lambda: dict(DEFAULT_LENGTH_MIX)))  # type: dict
+    hop_count_mix = attrib(default=Factory(lambda: dict(DEFAULT_HOP_COUNT_MIX)))  # type: dict
+
+
+class SyntheticTelegram(object):
+    """Telegram with the attributes of the parsed telegrams read by AgentWindow.process_telegram
+
+    Addresses, APCI and priority are plain strings (e.g. 1.1.5, 0/1/12, GroupValueWrite, LOW).
+    """
+    __slots__ = ('timestamp', 'src', 'dest', 'apci', 'payload_length', 'hop_count', 'priority')
+
+    def __init__(self, timestamp: int, src: str, dest: str, apci: str, payload_length: int, hop_count: int, priority: str):
+        self.timestamp = timestamp
+        self.src = src
+        self.dest = dest
+        self.apci = apci
+        self.payload_length = payload_length
+        self.hop_count = hop_count
+        self.priority = priority
+
+
+def _cum_weights(weights: []) -> []:
+    total = 0
+    cum_weights = []
+    for weight in weights:
+        total += weight
+        cum_weights.append(total)
+
+    return cum_weights
+
+
+class _Choice(object):
+    """Draws values according to their relative weights"""
+
+    def __init__(self, weights: {}):
+        self.values = list(weights.keys())
+        self.cum_weights = _cum_weights(weights.values())
+
+    def one(self, rnd: random.Random):
+        return rnd.choices(self.values, cum_weights=self.cum_weights)[0]
+
+    def count(self, rnd: random.Random, k: int) -> {}:
+        return dict(Counter(rnd.choices(self.values, cum_weights=self.cum_weights, k=k)))
+
+
+class TrafficGenerator(object):
+
+    def __init__(self, profile: TrafficProfile=None, seed=0, line: int=1):
+        """Generates the telegrams and windows of one agent
+
+        Attributes:
+            profile             TrafficProfile of the agent (defaults to TrafficProfile())
+            seed                Seed of the random generator (e.g. the agent name)
+            line                Line of the device addresses (area.line.device), so agents
+                                can be given disjoint device populations
+        """
+        self.profile = profile or TrafficProfile()
+        self.random = random.Random(seed)
+
+        devices = [f"{1 + (line + i // 255) // 16}.{(line + i // 255) % 16}.{i % 255 + 1}" for i in range(self.profile.devices)]
+        # group addresses are spread over the whole 3-level address space (main/middle/sub)
+        groups = [f"{v >> 11}/{(v >> 8) & 0x7}/{v & 0xff}" for v in self.random.sample(range(1, 0x8000), self.profile.groups)]
+        # the order is random, so the popular addresses differ between the seeds
+        self.random.shuffle(devices)
+
+        self.src = _Choice({addr: 1 / (rank + 1) ** self.profile.skew for rank, addr in enumerate(devices)})
+        self.dest = _Choice({addr: 1 / (rank + 1) ** self.profile.skew for rank, addr in enumerate(groups)})
+        self.apci = _Choice(self.profile.apci_mix)
+        self.priority = _Choice(self.profile.priority_mix)
+        self.length = _Choice(self.profile.length_mix)
+        self.hop_count = _Choice(self.profile.hop_count_mix)
+
+    def rate_at(self, time: int) -> float:
+        """Returns the telegrams per second at time (nanoseconds since the epoch)"""
+        profile = self.profile
+        if profile.burst_interval and (time // misc.NS_PER_SECOND) % profile.burst_interval < profile.burst_length:
+            return profile.rate * profile.burst_factor
+
+        return profile.rate
+
+    def _poisson(self, lam: float) -> int:
+        if lam <= 0:
+            return 0
+        elif lam > 50:
+            # normal approximation, drawing every single arrival gets too slow
+            return max(0, int(round(self.random.gauss(lam, math.sqrt(lam)))))
+
+        # Knuth's algorithm
+        limit = math.exp(-lam)
+        k = 0
+        p = self.random.random()
+        while p > limit:
+            k += 1
+            p *= self.random.random()
+
+        return k
+
+    def telegram(self, timestamp: int) -> SyntheticTelegram:
+        rnd = self.random
+        return SyntheticTelegram(timestamp, self.src.one(rnd), self.dest.one(rnd), self.apci.one(rnd),
+                                 self.length.one(rnd), self.hop_count.one(rnd), self.priority.one(rnd))
+
+    def iter_telegrams(self, start: int, count: int=None, end: int=None):
+        """Generator returning telegrams with Poisson arrivals from start until count or end is reached"""
+        time = start
+        n = 0
+        while (count is None or n < count) and (end is None or time < end):
+            yield self.telegram(time)
+            n += 1
+            time += int(self.random.expovariate(self.rate_at(time)) * misc.NS_PER_SECOND)
+
+    def window(self, agent: str, start: int, length: int) -> datamodel.Window:
+        """Returns a finished window of length (in nanoseconds), whose counters are drawn directly,
+        which is much faster than processing every single telegram
+        """
+        rnd = self.random
+        n = self._poisson(self.rate_at(start) * length / misc.NS_PER_SECOND)
+
+        window = datamodel.Window(start, agent, start + length)
+        window.src_addr = self.src.count(rnd, n)
+        window.dest_addr = self.dest.count(rnd, n)
+        window.apci = self.apci.count(rnd, n)
+        window.length = self.length.count(rnd, n)
+        window.hop_count = self.hop_count.count(rnd, n)
+        window.priority = self.priority.count(rnd, n)
+        return window
+
+
+class SyntheticAgents(object):
+
+    def __init__(self, agents: [str], profile: TrafficProfile=None, seed=0, window_length: int=10 * misc.NS_PER_SECOND,
+                 start: int=None):
+        """Generates the windows of multiple agents, one list per window length like SimulatedAgent.iter_windows
+
+        Attributes:
+            agents              Names of the agents
+            profile             TrafficProfile of all agents
+            seed                Seed, from which the seeds of the agents are derived
+            window_length       Length of a window in nanoseconds
+            start               Start of the first windows (defaults to now, aligned to the window length)
+        """
+        self.agent_set = set(agents)
+        self.window_length = window_length
+        self.start = start if start is not None else misc.now_epoch() // window_length * window_length
+        # every agent gets its own device line and random generator
+        self.generators = OrderedDict((agent, TrafficGenerator(profile, seed=f"{seed}-{agent}", line=i % 16))
+                                      for i, agent in enumerate(agents))
+
+    def iter_windows(self, count: int=None):
+        """Generator returning the windows of all agents for count window lengths (endless if None)"""
+        start = self.start
+        n = 0
+        while count is None or n < count:
+            yield [generator.window(agent, start, self.window_length) for agent, generator in self.generators.items()]
+            start += self.window_length
+            n += 1
+
+
+def encode_telegram(telegram: SyntheticTelegram) -> bytes:
+    """Encodes the telegram as KNX standard frame (control field, addresses, NPCI, TPCI/APCI, data, checksum)"""
+    if telegram.apci not in _APCI_CODES:
+        raise ValueError(f"Cannot encode APCI {telegram.apci}, only {', '.join(_APCI_CODES)} are supported")
+
+    area, line, device = (int(v) for v in telegram.src.split('.'))
+    main, middle, sub = (int(v) for v in telegram.dest.split('/'))
+    src = (area << 12) | (line << 8) | device
+    dest = (main << 11) | (middle << 8) | sub
+    apci = _APCI_CODES[telegram.apci]
+
+    # the first data byte shares the octet with the lower APCI bits, the others follow it
+    frame = bytearray([
+        0xb0 | (_PRIORITY_CODES[telegram.priority] << 2),
+        src >> 8, src & 0xff,
+        dest >> 8, dest & 0xff,
+        0x80 | (telegram.hop_count << 4) | telegram.payload_length,
+        apci >> 2,
+        (apci & 0x3) << 6,
+    ])
+    frame.extend(0 for i in range(telegram.payload_length - 1))
+    checksum = 0xff
+    for b in frame:
+        checksum ^= b
+    frame.append(checksum)
+
+    return bytes(frame)
+
+
+def write_dump(fp, telegrams, log_format: str='old') -> int:
+    """Writes the telegrams in the format of the dumps read by SimulatedAgent and returns their number"""
+    count = 0
+    for telegram in telegrams:
+        dt = misc.from_epoch(telegram.timestamp)
+        frame = encode_telegram(telegram).hex()
+        if log_format == 'old':
+            fp.write(f"{dt:%H:%M:%S}\t{dt:%Y-%m-%d}\t{telegram.src}\t{telegram.dest}\t{telegram.apci}\t{frame}\n")
+        elif log_format == 'new':
+            fp.write(f"{dt:%Y-%m-%d %H:%M:%S};\"b'{frame}'\"\n")
+        else:
+            raise KeyError(f"Unknown log format: {log_format}")
+        count += 1
+
+    return count
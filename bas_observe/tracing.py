@@ -0,0 +1,88 @@
+"""
+End-to-end latency of the windows from the agents to the analyser results
+
+Every window carries a trace record with the times it passed the hops of the system
+(cf. datamodel.TRACE_STAGES). The agents, the collector and the analysers add their
+hop, the collector keeps the record in the storage along with the window until it is
+relayed. Once the results are written, the analysers turn the records into the
+seconds spent in every stage, i.e. since the previous hop (the agent stage since the end
+of the window). All windows are recorded in the latency histograms of the metrics,
+a sample of them is written as pipeline_latency points to the storage.
+
+The total latency is measured from the start of the window, so it bounds the time from
+any event within the window until its result is available.
+The times are taken from the clocks of the different hosts, so they need to be synchronised
+(e.g. via NTP). Windows of replayed dumps end long before the agent finished them.
+"""
+import zlib
+from collections import OrderedDict
+
+from . import datamodel, metrics, misc
+
+
+LATENCY_MEASUREMENT = 'pipeline_latency'
+
+
+def is_sampled(window: datamodel.Window, rate: float) -> bool:
+    """Draws the window into the sample of rate (between 0 and 1)
+    The decision only depends on agent and start, so all analysers sample the same windows.
+    """
+    if rate >= 1:
+        return True
+    elif rate <= 0:
+        return False
+
+    return zlib.crc32(f'{window.agent}-{window.start}'.encode()) < rate * 2 ** 32
+
+
+def stage_latencies(window: datamodel.Window, trace: {}) -> OrderedDict:
+    """Returns the seconds spent in the stages of the trace record, which are present"""
+    latencies = OrderedDict()
+    previous = window.end
+    for stage in datamodel.TRACE_STAGES:
+        time = trace.get(stage, None)
+        if time is None:
+            continue
+
+        if previous is not None:
+            latencies[stage] = (time - previous) / misc.NS_PER_SECOND
+        previous = time
+
+    return latencies
+
+
+def latency_points(windows: [datamodel.Window], component: str, project_name: str, sample_rate: float, **stages) -> [{}]:
+    """Records the latencies of the windows in the metrics and returns the points of the sampled ones
+
+    Attributes:
+        windows             Windows, whose results were written
+        component           Analyser, which wrote the results
+        project_name        Name of the project
+        sample_rate         Share of the windows (between 0 and 1) returned as points
+        stages              Times of the hops of the analyser (e.g. analyser, scored and written),
+                            which are not recorded in the windows, since they may be shared
+    """
+    points = []
+    for window in windows:
+        trace = dict(window.trace, **stages)
+        if not trace:
+            continue
+
+        fields = stage_latencies(window, trace)
+        fields['total'] = (max(trace.values()) - window.start) / misc.NS_PER_SECOND
+        for stage, seconds in fields.items():
+            metrics.WINDOW_LATENCY.labels(component, stage).observe(seconds)
+
+        if is_sampled(window, sample_rate):
+            points.append({
+                'time': window.start,
+                'measurement': LATENCY_MEASUREMENT,
+                'tags': {
+                    'project': project_name,
+                    'agent': window.agent,
+                    'component': component,
+                },
+                'fields': dict(fields),
+            })
+
+    return points
@@ -4,13 +4,29 @@ This module contains functions to help vectorise (parts of) the window datamodel
 from datetime import datetime, timedelta
 import math
 import numpy as np
+from scipy import sparse
 
 import baos_knx_parser as knx
 
-from . import datamodel
+from . import datamodel, misc
 
 
 _APCI_KEYS = list(knx.APCI(None)._attr_map.keys())
+# number of dimensions produced by vectorise_window
+WINDOW_VECTOR_SIZE = 1 + 16 + 16 + 4 + 8 + 10 + len(_APCI_KEYS)
+# has to be increased whenever vectorise_window changes, so cached feature vectors are invalidated
+WINDOW_VECTOR_VERSION = 1
+# size of the KNX address space, i.e. the number of dimensions of each raw address histogram
+ADDR_SPACE_SIZE = 2 ** 16
+
+# offsets of the blocks of vectorise_window (the sparse vectors use the same layout)
+_OFFSET_SRC_ADDR = 1
+_OFFSET_DEST_ADDR = _OFFSET_SRC_ADDR + 16
+_OFFSET_PRIORITY = _OFFSET_DEST_ADDR + 16
+_OFFSET_HOP_COUNT = _OFFSET_PRIORITY + 4
+_OFFSET_LENGTH = _OFFSET_HOP_COUNT + 8
+_OFFSET_APCI = _OFFSET_LENGTH + 10
+_APCI_INDEX = {name: index for index, name in enumerate(_APCI_KEYS)}
 
 
 def vectorise_knx_addr(addr: (knx.KnxAddress, str)):
@@ -62,18 +78,19 @@ def vectorise_apci_dict(apcis):
         return np.sum(vects, axis=0) / size
 
 
-def vectorise_time_of_week(dt: datetime):
+def vectorise_time_of_week(ns: int):
     # time of week, calculate passed seconds since the start of the week (Monday)
-    tow = dt.weekday() * (24 * 60 * 60)
-    # add seconds passed in the current day
-    tow += (dt.hour * 60 * 60) + (dt.minute * 60) + dt.second
+    # the epoch (1970-01-01) was a Thursday, so shift by 3 days
+    seconds = ns // misc.NS_PER_SECOND
+    tow = (seconds + 3 * (24 * 60 * 60)) % (7 * 24 * 60 * 60)
     # normalise against the seconds per week
     return np.array([tow / (7 * 24 * 60 * 60)])
 
 
-def vectorise_time_of_year(dt: datetime):
+def vectorise_time_of_year(ns: int):
     # time of year, calcute passed seconds since the beginning of the year
-    toy = dt - datetime(dt.year, 1, 1)
+    dt = misc.from_epoch(ns)
+    toy = dt - datetime(dt.year, 1, 1, tzinfo=dt.tzinfo)
     return np.array([toy.total_seconds() / timedelta(days=365).total_seconds()])
 
 
@@ -130,13 +147,18 @@ def vectorise_payload_length(length: int):
     return np.array([length / 255])
 
 
+def _length_bucket(length, buckets: int=10) -> int:
+    # the maximum length (255) falls into the last bucket
+    return min(math.floor((int(length) / 255) * buckets), buckets - 1)
+
+
 def vectorise_payload_length_dict(lengths, buckets=10):
     # buckets = number of dimensions use to represent the length (so it is not overrepresented)
     vect = [0] * buckets
     size = 0
 
     for length, amount in lengths.items():
-        bucket = math.floor((int(length) / 255) * buckets)
+        bucket = _length_bucket(length, buckets)
         vect[bucket] += amount if amount else 0
         size += amount if amount else 0
 
@@ -154,10 +176,92 @@ def vectorise_window(window: datamodel.Window):
             vectorise_knx_addr_dict(window.src_addr),           # 16
             vectorise_knx_addr_dict(window.dest_addr),          # 16
             vectorise_priority_dict(window.priority),           # 4
-            vectorise_hop_count_dict(window.hop_count),         # 7
+            vectorise_hop_count_dict(window.hop_count),         # 8
             vectorise_payload_length_dict(window.length),       # 10 (buckets)
             vectorise_apci_dict(window.apci),                   # 37
         ), axis=0)
     except ValueError as e:
         print(window.to_dict())
         raise e
+
+
+def sparse_vector_size(addr_histogram: bool=False) -> int:
+    """Number of dimensions of the sparse window vectors"""
+    return WINDOW_VECTOR_SIZE + (2 * ADDR_SPACE_SIZE if addr_histogram else 0)
+
+
+def _int_knx_addr(addr: (knx.KnxAddress, str)) -> int:
+    if isinstance(addr, str):
+        addr = knx.KnxAddress(str=addr, group='/' in addr)
+
+    return int(addr)
+
+
+def _add_normalised(entries: {}, counter: {}, get_index) -> None:
+    """Adds the amounts of counter normalised by their sum to entries at get_index(key)
+    get_index returns a list of indices (e.g. all set bits of an address) for a key
+    """
+    size = sum(amount for amount in counter.values() if amount and amount > 0)
+    if size == 0:
+        return
+
+    for key, amount in counter.items():
+        if amount and amount > 0:
+            for index in get_index(key):
+                entries[index] = entries.get(index, 0) + amount / size
+
+
+def _addr_bit_indices(offset: int):
+    def get_index(addr):
+        value = _int_knx_addr(addr)
+        # most significant bit first, like vectorise_knx_addr
+        return [offset + 15 - bit for bit in range(16) if value >> bit & 1]
+
+    return get_index
+
+
+def sparse_window_entries(window: datamodel.Window, addr_histogram: bool=False) -> (np.ndarray, np.ndarray):
+    """Returns the indices and values of the non-zero entries of the window vector
+    They are computed from the window counters directly, the first WINDOW_VECTOR_SIZE
+    dimensions equal vectorise_window. With addr_histogram the relative amount of every
+    source and destination address follows, each in its own block of ADDR_SPACE_SIZE dimensions.
+    """
+    entries = {}
+    time_of_week = vectorise_time_of_week(window.start)[0]
+    if time_of_week:
+        entries[0] = time_of_week
+
+    _add_normalised(entries, window.src_addr, _addr_bit_indices(_OFFSET_SRC_ADDR))
+    _add_normalised(entries, window.dest_addr, _addr_bit_indices(_OFFSET_DEST_ADDR))
+    _add_normalised(entries, window.priority, lambda prio: [_OFFSET_PRIORITY + _priority_to_int(prio)])
+    _add_normalised(entries, window.hop_count, lambda hop_count: [_OFFSET_HOP_COUNT + int(hop_count)])
+    _add_normalised(entries, window.length, lambda length: [_OFFSET_LENGTH + _length_bucket(length)])
+    _add_normalised(entries, window.apci, lambda apci: [_OFFSET_APCI + _APCI_INDEX[str(apci)]] if str(apci) in _APCI_INDEX else [])
+
+    if addr_histogram:
+        _add_normalised(entries, window.src_addr, lambda addr: [WINDOW_VECTOR_SIZE + _int_knx_addr(addr)])
+        _add_normalised(entries, window.dest_addr, lambda addr: [WINDOW_VECTOR_SIZE + ADDR_SPACE_SIZE + _int_knx_addr(addr)])
+
+    indices = np.fromiter(sorted(entries.keys()), dtype=np.int32, count=len(entries))
+    values = np.fromiter((entries[index] for index in indices), dtype=np.float64, count=len(entries))
+    return indices, values
+
+
+def sparse_rows_to_csr(rows: [(np.ndarray, np.ndarray)], width: int) -> sparse.csr_matrix:
+    """Assembles (indices, values) rows into a CSR matrix without densifying them"""
+    indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(indices) for indices, values in rows])
+    if rows:
+        indices = np.concatenate([indices for indices, values in rows])
+        data = np.concatenate([values for indices, values in rows])
+    else:
+        indices = np.zeros(0, dtype=np.int32)
+        data = np.zeros(0)
+
+    return sparse.csr_matrix((data, indices, indptr), shape=(len(rows), width))
+
+
+def vectorise_windows_sparse(windows: [datamodel.Window], addr_histogram: bool=False) -> sparse.csr_matrix:
+    """Vectorises a batch of windows into a CSR matrix (one row per window)"""
+    rows = [sparse_window_entries(window, addr_histogram=addr_histogram) for window in windows]
+    return sparse_rows_to_csr(rows, sparse_vector_size(addr_histogram))
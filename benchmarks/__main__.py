@@ -0,0 +1,60 @@
+"""
+Runs the benchmarks and writes the report as JSON
+
+    python -m benchmarks --output results.json
+    python -m benchmarks --only score_lof --only score_svm --compare results.json
+"""
+import json
+import logging
+import tempfile
+import traceback
+
+import click
+
+from . import harness
+from .hot_paths import BENCHMARKS
+
+
+@click.command()
+@click.option('-o', '--output', default=None, help="Write the JSON report to this file (default: stdout)")
+@click.option('--only', multiple=True, type=click.Choice(list(BENCHMARKS)), help="Only run these benchmarks")
+@click.option('--size', type=int, default=200, help="Number of messages (or windows) per benchmark")
+@click.option('--quick', is_flag=True, help="Reduce the size to a quick smoke run")
+@click.option('--seed', default='0', help="Seed of the synthetic traffic")
+@click.option('--compare', default=None, help="Print the change of the throughput against this former report")
+@click.option('-l', '--log-level', default='ERROR', type=click.Choice(['DEBUG', 'INFO', 'WARN', 'ERROR', 'CRITICAL']))
+def main(output, only, size, quick, seed, compare, log_level):
+    logging.basicConfig(level=log_level)
+    size = 20 if quick else size
+
+    report = {'environment': harness.environment(), 'seed': seed, 'size': size, 'benchmarks': {}}
+    with tempfile.TemporaryDirectory(prefix='bob-benchmarks-') as workdir:
+        for name, bench in BENCHMARKS.items():
+            if only and name not in only:
+                continue
+
+            click.echo(f"Run {name}", err=True)
+            try:
+                op, args = bench(workdir, seed, size)
+                report['benchmarks'][name] = harness.measure(op, args)
+            except Exception as e:
+                # e.g. the KNX parser is missing, keep measuring the others
+                click.echo(traceback.format_exc(), err=True)
+                report['benchmarks'][name] = {'error': f"{e.__class__.__name__}: {e}"}
+
+    data = json.dumps(report, indent=2)
+    if output:
+        with open(output, mode='w') as fp:
+            fp.write(data)
+    else:
+        click.echo(data)
+
+    if compare:
+        with open(compare) as fp:
+            former = json.load(fp)
+        for name, before, after, change in harness.compare(former, report):
+            click.echo(f"{name:<24} {before:>14.1f} -> {after:>14.1f} ops/s  {change:>+8.1%}", err=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+In-memory stand-ins for the AMQP channel and the storage backends, so the hot paths
+can be measured without RabbitMQ or InfluxDB
+"""
+from bas_observe import datamodel
+from bas_observe.storage.base import BaseStorage
+
+
+class FakeMethod(object):
+
+    def __init__(self, delivery_tag: int):
+        self.delivery_tag = delivery_tag
+
+
+class FakeChannel(object):
+    """Records the published messages and counts the acknowledgements"""
+
+    def __init__(self):
+        self.published = []
+        self.acks = 0
+
+    def basic_publish(self, exchange: str, routing_key: str, body) -> None:
+        self.published.append((exchange, body))
+
+    def basic_ack(self, delivery_tag: int, multiple: bool=False) -> None:
+        self.acks += 1
+
+    def basic_nack(self, delivery_tag: int, multiple: bool=False, requeue: bool=True) -> None:
+        pass
+
+
+class FakeInfluxDBClient(object):
+    """Counts the written points instead of sending them to an InfluxDB"""
+
+    def __init__(self):
+        self.points = 0
+
+    def write_points(self, points: [{}], time_precision: str=None, **kwargs) -> bool:
+        self.points += len(points)
+        return True
+
+
+class MemoryStorage(BaseStorage):
+    """Keeps the windows and results in memory (enough to train and score the analysers)"""
+
+    def __init__(self, conf, windows: [datamodel.Window]=None):
+        super().__init__(conf)
+        self.windows = list(windows or [])
+        self.results = []
+
+    def write_windows(self, windows: [datamodel.Window], resolution: str=None) -> None:
+        self.windows.extend(windows)
+
+    def get_windows(self, start: int, end: int, resolution: str=None):
+        windows = [window for window in self.windows if start < window.start < end]
+        return iter(sorted(windows, key=lambda window: window.start, reverse=True))
+
+    def write_results(self, points: [{}]) -> None:
+        self.results.extend(points)
@@ -0,0 +1,89 @@
+"""
+Timing and reporting of the benchmarks
+
+Every benchmark provides an operation and the arguments of its calls. Each call is
+timed on its own, the report contains the throughput (ops/s over the whole run) and
+the percentiles of the latencies of the single calls in microseconds.
+"""
+import gc
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+PERCENTILES = (50, 90, 99)
+
+
+def measure(op, args: [], warmup: int=10) -> {}:
+    """Calls op for every argument and returns its throughput and latencies"""
+    for arg in args[:warmup]:
+        op(arg)
+
+    latencies = np.empty(len(args))
+    # a collection in the middle of the run would end up as outlier of a random call
+    gc.collect()
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        clock = time.perf_counter
+        begin = clock()
+        for i, arg in enumerate(args):
+            start = clock()
+            op(arg)
+            latencies[i] = clock() - start
+        duration = clock() - begin
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    latencies *= 1e6
+    result = {
+        'ops': len(args),
+        'seconds': duration,
+        'ops_per_s': len(args) / duration if duration else None,
+        'mean_us': float(latencies.mean()),
+        'max_us': float(latencies.max()),
+    }
+    for percentile, value in zip(PERCENTILES, np.percentile(latencies, PERCENTILES)):
+        result[f"p{percentile}_us"] = float(value)
+
+    return result
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment() -> {}:
+    """Describes the run, so reports of different machines or versions can be told apart"""
+    import scipy
+    import sklearn
+
+    return {
+        'time': datetime.now(timezone.utc).isoformat(),
+        'git': _git_revision(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'numpy': np.__version__,
+        'scipy': scipy.__version__,
+        'sklearn': sklearn.__version__,
+    }
+
+
+def compare(old: {}, new: {}) -> [(str, float, float, float)]:
+    """Returns (name, old ops/s, new ops/s, relative change) of the benchmarks in both reports"""
+    rows = []
+    for name, result in new['benchmarks'].items():
+        before = old['benchmarks'].get(name, {}).get('ops_per_s')
+        after = result.get('ops_per_s')
+        if before and after:
+            rows.append((name, before, after, after / before - 1))
+
+    return rows
@@ -0,0 +1,144 @@
+"""
+Benchmarks of the hot paths of agent, collector and analysers
+
+Every benchmark is a function taking the working directory, the seed and the number of
+operations. It returns the operation and the list of arguments it is called with.
+"""
+import json
+import os.path
+from collections import OrderedDict
+
+from bas_observe import config, datamodel, misc, synthetic, vectoriser
+from bas_observe.analyse.addr import AddrAnalyser
+from bas_observe.analyse.entropy import EntropyAnalyser
+from bas_observe.analyse.lof import LofAnalyser
+from bas_observe.analyse.svm import SvmAnalyser
+from bas_observe.manage.agent import AgentWindow, SimulatedAgent
+
+from .fakes import FakeChannel, FakeInfluxDBClient, FakeMethod, MemoryStorage
+
+
+AGENTS = ['agent1', 'agent2', 'agent3', 'agent4']
+# 2018-01-01T00:00:00Z, so all runs use the same times of the week
+START = 1514764800 * misc.NS_PER_SECOND
+# windows of each agent the analysers are trained on
+TRAINING_WINDOWS = 720
+# telegrams per requested operation of the telegram benchmarks
+FAST_OPS_FACTOR = 100
+# window lengths (with a window of each agent) per requested operation of the window benchmarks
+WINDOW_OPS_FACTOR = 10
+
+BENCHMARKS = OrderedDict()  # {name: function}
+
+
+def benchmark(name: str):
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+
+    return register
+
+
+def get_config() -> config.Config:
+    """Config whose InfluxDB connection is an in-memory fake"""
+    return config.Config(project_name='benchmark', amqp_url='amqp://localhost', storage_url='http://localhost:8086/benchmark',
+                         influxdb_connection=FakeInfluxDBClient())
+
+
+def get_windows(seed, frames: int) -> [[datamodel.Window]]:
+    return list(synthetic.SyntheticAgents(AGENTS, seed=seed, start=START).iter_windows(frames))
+
+
+def get_window_list(seed, size: int) -> [datamodel.Window]:
+    return [window for windows in get_windows(seed, size * WINDOW_OPS_FACTOR) for window in windows]
+
+
+@benchmark('process_telegram')
+def bench_process_telegram(workdir: str, seed, size: int):
+    telegrams = list(synthetic.TrafficGenerator(seed=seed).iter_telegrams(START, count=size * FAST_OPS_FACTOR))
+    return AgentWindow(START, AGENTS[0]).process_telegram, telegrams
+
+
+def _bench_read_log(workdir: str, seed, size: int, log_format: str):
+    path = os.path.join(workdir, f"dump_{log_format}.txt")
+    count = size * FAST_OPS_FACTOR
+    with open(path, mode='w') as fp:
+        # a few more telegrams, than are read during warmup and measurement
+        synthetic.write_dump(fp, synthetic.TrafficGenerator(seed=seed).iter_telegrams(START, count=count + 100), log_format=log_format)
+
+    agent = SimulatedAgent(get_config(), path, agent_filter={None: AGENTS[0]}, log_format=log_format)
+    telegrams = agent.read_log() if log_format == 'old' else agent.read_new_log()
+    return lambda i: next(telegrams), list(range(count))
+
+
+@benchmark('read_log')
+def bench_read_log(workdir: str, seed, size: int):
+    return _bench_read_log(workdir, seed, size, 'old')
+
+
+@benchmark('read_new_log')
+def bench_read_new_log(workdir: str, seed, size: int):
+    return _bench_read_log(workdir, seed, size, 'new')
+
+
+@benchmark('vectorise_window')
+def bench_vectorise_window(workdir: str, seed, size: int):
+    return vectoriser.vectorise_window, get_window_list(seed, size)
+
+
+@benchmark('window_to_dict')
+def bench_window_to_dict(workdir: str, seed, size: int):
+    return lambda window: window.to_dict(), get_window_list(seed, size)
+
+
+@benchmark('window_from_dict')
+def bench_window_from_dict(workdir: str, seed, size: int):
+    return AgentWindow.from_dict, [window.to_dict() for window in get_window_list(seed, size)]
+
+
+@benchmark('window_json_roundtrip')
+def bench_window_json_roundtrip(workdir: str, seed, size: int):
+    """to_dict/from_dict including the JSON (de)serialisation of the messages between the processes"""
+    return (lambda window: AgentWindow.from_dict(json.loads(json.dumps(window.to_dict()))),
+            get_window_list(seed, size))
+
+
+def _bench_scoring(workdir: str, seed, size: int, analyser_class, name: str):
+    """Trains the analyser on synthetic windows and scores one message per window length,
+    each with the windows of all agents (like the messages relayed by the collector)
+    """
+    model = os.path.join(workdir, f"{name}.json")
+    # the scored windows follow the training period (with the same address populations)
+    frames = get_windows(seed, TRAINING_WINDOWS + size)
+    training = [window for windows in frames[:TRAINING_WINDOWS] for window in windows]
+    trainer = analyser_class(get_config(), model)
+    trainer.storage = MemoryStorage(trainer.conf, training)
+    trainer.train(START - 1, training[-1].end)
+
+    analyser = analyser_class(get_config(), model)
+    analyser.prepare_scoring()
+    channel = FakeChannel()
+    method = FakeMethod(1)
+    messages = [json.dumps([window.to_dict() for window in windows]).encode() for windows in frames[TRAINING_WINDOWS:]]
+
+    return lambda body: analyser.on_message(channel, method, None, body), messages
+
+
+@benchmark('score_addr')
+def bench_score_addr(workdir: str, seed, size: int):
+    return _bench_scoring(workdir, seed, size, AddrAnalyser, 'addr')
+
+
+@benchmark('score_entropy')
+def bench_score_entropy(workdir: str, seed, size: int):
+    return _bench_scoring(workdir, seed, size, EntropyAnalyser, 'entropy')
+
+
+@benchmark('score_lof')
+def bench_score_lof(workdir: str, seed, size: int):
+    return _bench_scoring(workdir, seed, size, LofAnalyser, 'lof')
+
+
+@benchmark('score_svm')
+def bench_score_svm(workdir: str, seed, size: int):
+    return _bench_scoring(workdir, seed, size, SvmAnalyser, 'svm')
@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+
+from bas_observe.analyse.approx_svm import ApproxOneClassSVM
+
+
+@pytest.fixture
+def X():
+    return np.random.RandomState(0).normal(size=(1000, 5))
+
+
+@pytest.mark.parametrize('approximation', ['nystroem', 'rff'])
+def test_flags_nu_of_small_training_data(X, approximation):
+    model = ApproxOneClassSVM(nu=0.05, approximation=approximation, n_components=100, random_state=0).fit(X)
+
+    assert np.mean(model.predict(X) == -1) == pytest.approx(0.05, abs=0.01)
+    assert (model.predict(X[:10] + 10) == -1).all()
+
+
+def test_partial_fit_keeps_flagging_nu(X):
+    model = ApproxOneClassSVM(nu=0.05, n_components=100, random_state=0).fit(X[:500])
+
+    model.partial_fit(X[500:])
+
+    assert np.mean(model.predict(X[500:]) == -1) == pytest.approx(0.05, abs=0.01)
+    assert model.decision_function(X[:10] + 10).max() < 0
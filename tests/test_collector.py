@@ -0,0 +1,80 @@
+import json
+
+import pytest
+
+from bas_observe import datamodel, misc
+from bas_observe.config import Config
+from bas_observe.manage.collector import Collector
+
+
+START = 1514764800 * misc.NS_PER_SECOND
+WINDOW_LENGTH = 10 * misc.NS_PER_SECOND
+
+
+class Method(object):
+
+    def __init__(self, delivery_tag: int):
+        self.delivery_tag = delivery_tag
+
+
+class Channel(object):
+    """Records the acknowledgements of the collector"""
+
+    def __init__(self):
+        self.acks = []
+        self.nacks = []
+
+    def basic_ack(self, delivery_tag: int, multiple: bool=False) -> None:
+        self.acks.append((delivery_tag, multiple))
+
+    def basic_nack(self, delivery_tag: int, multiple: bool=False, requeue: bool=True) -> None:
+        self.nacks.append((delivery_tag, multiple, requeue))
+
+
+@pytest.fixture
+def collector():
+    collector = Collector(Config('test', 'amqp://localhost', 'sqlite://', collector_prefetch=3), {'a1'}, relay=False)
+    collector.channel = Channel()
+    yield collector
+    collector.get_storage().close()
+
+
+def receive(collector: Collector, index: int) -> None:
+    start = START + index * WINDOW_LENGTH
+    window = datamodel.Window(start, 'a1', end=start + WINDOW_LENGTH)
+    window.priority = {'LOW': 1}
+    collector.on_agent_message(collector.channel, Method(index + 1), None, json.dumps(window.to_dict()))
+
+
+def test_full_batch_is_written_and_acked_at_once(collector):
+    for index in range(4):
+        receive(collector, index)
+
+    assert collector.channel.acks == [(3, True)]
+    assert collector.get_storage().count_unrelayed_windows() == 3
+
+
+def test_flush_acks_partial_batch(collector):
+    for index in range(2):
+        receive(collector, index)
+    assert collector.channel.acks == []
+
+    collector.flush_windows()
+    collector.flush_windows()
+
+    assert collector.channel.acks == [(2, True)]
+    assert collector.get_storage().count_unrelayed_windows() == 2
+
+
+def test_failed_write_requeues_batch(collector, monkeypatch):
+    def write_windows(windows, resolution=None):
+        raise IOError("disk full")
+    monkeypatch.setattr(collector.get_storage(), 'write_windows', write_windows)
+
+    for index in range(3):
+        receive(collector, index)
+
+    assert collector.channel.nacks == [(3, True, True)]
+    assert collector.channel.acks == []
+    # the requeued messages are delivered again, so nothing stays buffered
+    assert collector._pending_tags == []
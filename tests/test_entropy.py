@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from bas_observe import datamodel, misc
+from bas_observe.analyse.entropy import EntropyAnalyser
+from bas_observe.config import Config
+
+
+START = 1514764800 * misc.NS_PER_SECOND
+WINDOW_LENGTH = 10 * misc.NS_PER_SECOND
+
+
+def make_window(agent: str, src_addr: {}) -> datamodel.Window:
+    window = datamodel.Window(START, agent, end=START + WINDOW_LENGTH)
+    window.src_addr = src_addr
+    window.priority = {'LOW': sum(src_addr.values())}
+    return window
+
+
+def make_analyser(tmp_path, **kwargs) -> EntropyAnalyser:
+    analyser = EntropyAnalyser(Config('test', 'amqp://localhost', 'sqlite://'), str(tmp_path / 'model.json'), **kwargs)
+    analyser.model = {}
+    return analyser
+
+
+def entropies(analyser: EntropyAnalyser, window: datamodel.Window) -> (float, float):
+    fields = analyser.score_windows([window])[0]['fields']
+    return fields['entropy1'], fields['entropy2']
+
+
+def test_online_learns_new_agents(tmp_path):
+    analyser = make_analyser(tmp_path, online=True)
+    window = make_window('a1', {'1.1.1': 4})
+
+    assert entropies(analyser, window) == (99999.9, 99999.9)
+    assert entropies(analyser, window) == (0.0, 0.0)
+    assert set(analyser.model.keys()) == {'a1'}
+
+
+def test_offline_keeps_the_baseline(tmp_path):
+    analyser = make_analyser(tmp_path)
+    window = make_window('a1', {'1.1.1': 4})
+
+    assert entropies(analyser, window) == (99999.9, 99999.9)
+    assert entropies(analyser, window) == (99999.9, 99999.9)
+    assert analyser.model == {}
+
+
+def test_decay_weights_former_windows_less(tmp_path):
+    analyser = make_analyser(tmp_path, online=True, decay=0.5)
+    agent_model = {'buckets': [None], 'count': np.zeros(1)}
+
+    for vect in ([4., 0.], [0., 4.], [0., 4.]):
+        analyser.update_baseline(agent_model, 0, np.array(vect))
+
+    # weights 0.25, 0.5 and 1 of the three windows
+    np.testing.assert_allclose(agent_model['buckets'][0] / agent_model['count'][0], [4 / 7, 24 / 7])
+
+
+def test_update_threshold_skips_anomalous_windows(tmp_path):
+    analyser = make_analyser(tmp_path, online=True, update_threshold=0.1)
+    usual = make_window('a1', {'1.1.1': 4})
+    entropies(analyser, usual)
+
+    unusual = make_window('a1', {'1.1.1': 1, '15.15.255': 3})
+    first = entropies(analyser, unusual)
+
+    assert min(first) > 0.1
+    assert entropies(analyser, unusual) == pytest.approx(first)
+    assert entropies(analyser, usual) == (0.0, 0.0)
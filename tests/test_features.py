@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+
+from bas_observe import datamodel, features, misc, vectoriser
+
+
+DAY = 24 * 60 * 60 * misc.NS_PER_SECOND
+HOUR = 60 * 60 * misc.NS_PER_SECOND
+START = 1514764800 * misc.NS_PER_SECOND
+
+
+class Windows(object):
+    """Hourly windows of two agents, which records the time ranges read"""
+
+    def __init__(self, days: int):
+        self.windows = []
+        for index in range(days * 24):
+            for agent in ('a1', 'a2'):
+                window = datamodel.Window(START + index * HOUR, agent, end=START + (index + 1) * HOUR)
+                window.src_addr = {'1.1.1': index + 1}
+                window.hop_count = {6: 1}
+                self.windows.append(window)
+        self.reads = []
+
+    def get_windows(self, start: int, end: int):
+        self.reads.append((start, end))
+        return [window for window in self.windows if start < window.start < end]
+
+
+@pytest.fixture
+def now(monkeypatch):
+    now = {'time': START + 10 * DAY}
+    monkeypatch.setattr(misc, 'now_epoch', lambda: now['time'])
+    return now
+
+
+def assert_matrix(matrix: features.FeatureMatrix, windows: Windows, start: int, end: int) -> None:
+    for agent in ('a1', 'a2'):
+        expected = [vectoriser.vectorise_window(window) for window in windows.windows
+                    if window.agent == agent and start < window.start < end]
+        np.testing.assert_allclose(np.sort(matrix.for_agent(agent), axis=0), np.sort(np.array(expected), axis=0))
+
+
+def test_slots(tmp_path):
+    store = features.FeatureStore(str(tmp_path), 'test')
+
+    assert store.slots(START - 1, START + 2 * DAY) == [(START, START + DAY), (START + DAY, START + 2 * DAY)]
+    assert store.slots(START, START + 2 * DAY + HOUR) == [(START + DAY, START + 2 * DAY)]
+
+
+def test_caches_past_slots(tmp_path, now):
+    windows = Windows(days=3)
+    store = features.FeatureStore(str(tmp_path), 'test')
+
+    matrix = store.build_matrix(START - 1, START + 3 * DAY, windows.get_windows)
+
+    assert_matrix(matrix, windows, START - 1, START + 3 * DAY)
+    assert store.covered_ranges() == [(START, START + 3 * DAY)]
+
+    # a new store reads the cached slots from disk
+    windows.reads = []
+    store = features.FeatureStore(str(tmp_path), 'test')
+    matrix = store.build_matrix(START - 1, START + 3 * DAY, windows.get_windows)
+
+    assert_matrix(matrix, windows, START - 1, START + 3 * DAY)
+    assert windows.reads == []
+
+
+def test_reads_partial_slots_uncached(tmp_path, now):
+    windows = Windows(days=3)
+    store = features.FeatureStore(str(tmp_path), 'test')
+
+    matrix = store.build_matrix(START + 12 * HOUR, START + 2 * DAY + 12 * HOUR, windows.get_windows)
+
+    assert_matrix(matrix, windows, START + 12 * HOUR, START + 2 * DAY + 12 * HOUR)
+    assert store.covered_ranges() == [(START + DAY, START + 2 * DAY)]
+
+
+def test_does_not_cache_slots_within_lag(tmp_path, now):
+    windows = Windows(days=3)
+    now['time'] = START + 3 * DAY + 30 * 60 * misc.NS_PER_SECOND
+    store = features.FeatureStore(str(tmp_path), 'test', lag=HOUR)
+
+    matrix = store.build_matrix(START - 1, START + 3 * DAY, windows.get_windows)
+
+    # the last slot may still receive late windows
+    assert_matrix(matrix, windows, START - 1, START + 3 * DAY)
+    assert store.covered_ranges() == [(START, START + 2 * DAY)]
+
+
+def test_ignores_cache_of_other_vector_version(tmp_path, now, monkeypatch):
+    windows = Windows(days=1)
+    features.FeatureStore(str(tmp_path), 'test').build_matrix(START - 1, START + DAY, windows.get_windows)
+
+    monkeypatch.setattr(vectoriser, 'WINDOW_VECTOR_VERSION', vectoriser.WINDOW_VECTOR_VERSION + 1)
+    store = features.FeatureStore(str(tmp_path), 'test')
+
+    assert store.covered_ranges() == []
@@ -0,0 +1,171 @@
+import re
+
+import pytest
+from influxdb.resultset import ResultSet
+
+from bas_observe import datamodel, misc
+from bas_observe.config import Config
+from bas_observe.storage import influx
+
+
+START = 1514764800 * misc.NS_PER_SECOND
+WINDOW_LENGTH = 10 * misc.NS_PER_SECOND
+
+_STATEMENT = re.compile(r'SELECT (?P<select>.+) FROM (?P<source>\S+) WHERE (?P<where>.+?)'
+                        r'(?: GROUP BY "agent")?(?: ORDER BY time DESC)?(?: LIMIT (?P<limit>\d+))?$')
+_CONDITION = re.compile(r'"?(?P<key>\w+)"? (?P<op>=|>=|<=|>|<) (?P<value>.+)')
+_OPERATORS = {
+    '=': lambda a, b: a == b,
+    '>=': lambda a, b: a >= b,
+    '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b,
+    '<': lambda a, b: a < b,
+}
+
+
+class InfluxDBClient(object):
+    """In-memory InfluxDB answering the queries of the InfluxStorage"""
+
+    def __init__(self):
+        # (measurement, time, agent) -> fields incl. tags
+        self.points = {}
+
+    def write_points(self, points: [{}], time_precision: str=None, retention_policy: str=None) -> bool:
+        for point in points:
+            key = (point['measurement'], point['time'], point['tags']['agent'])
+            # points with the same time and tags update the fields of the existing one
+            self.points.setdefault(key, {}).update(point['tags'], **point['fields'])
+
+        return True
+
+    def measurements(self) -> {str}:
+        return {measurement for measurement, time, agent in self.points.keys()}
+
+    def _select(self, statement: str) -> ResultSet:
+        match = _STATEMENT.match(statement)
+        measurement = match.group('source').split('.')[-1].strip('"')
+
+        rows = []
+        for (name, time, agent), fields in sorted(self.points.items(), key=lambda item: item[0][1], reverse=True):
+            row = dict(fields, time=time)
+            if name == measurement and all(self._matches(row, condition) for condition in match.group('where').split(' and ')):
+                rows.append(row)
+
+        if match.group('limit'):
+            per_agent = {}
+            rows = [row for row in rows if per_agent.setdefault(row['agent'], []).append(row) or
+                    len(per_agent[row['agent']]) <= int(match.group('limit'))]
+
+        if match.group('select').startswith('count('):
+            rows = [{'time': 0, 'count': len(rows)}] if rows else []
+        if not rows:
+            return ResultSet({'statement_id': 0})
+
+        columns = sorted({column for row in rows for column in row.keys()})
+        return ResultSet({'series': [{'name': measurement, 'columns': columns,
+                                      'values': [[row.get(column) for column in columns] for row in rows]}]})
+
+    @staticmethod
+    def _matches(row: {}, condition: str) -> bool:
+        key, op, value = _CONDITION.match(condition).groups()
+        value = {'false': False, 'true': True}.get(value, value.strip("'"))
+        if key == 'time':
+            value = int(value)
+
+        return _OPERATORS[op](row.get(key), value)
+
+    def _show_measurement(self, statement: str) -> ResultSet:
+        measurement = statement.split(' = ')[-1].strip('"')
+        if measurement not in self.measurements():
+            return ResultSet({'statement_id': 0})
+
+        return ResultSet({'series': [{'name': 'measurements', 'columns': ['name'], 'values': [[measurement]]}]})
+
+    def query(self, query: str, epoch: str=None):
+        results = [self._show_measurement(statement) if statement.startswith('SHOW MEASUREMENTS') else self._select(statement)
+                   for statement in query.split('; ')]
+        return results[0] if len(results) == 1 else results
+
+
+def make_window(agent: str, index: int) -> datamodel.Window:
+    start = START + index * WINDOW_LENGTH
+    window = datamodel.Window(start, agent, end=start + WINDOW_LENGTH)
+    window.src_addr = {'1.1.1': index + 1}
+    window.priority = {'LOW': index + 1}
+    window.mark('agent', window.end + 1)
+    return window
+
+
+def make_storage(client: InfluxDBClient, schema: str) -> influx.InfluxStorage:
+    return Config('test', 'amqp://localhost', 'http://localhost:8086/test', storage_schema=schema,
+                  influxdb_connection=client).get_storage()
+
+
+@pytest.fixture
+def client():
+    client = InfluxDBClient()
+    # the database was switched to the single layout after the first three windows
+    make_storage(client, misc.SCHEMA_SPLIT).write_windows([make_window(agent, index) for index in range(3) for agent in ('a1', 'a2')])
+    make_storage(client, misc.SCHEMA_SINGLE).write_windows([make_window(agent, index) for index in range(3, 6) for agent in ('a1', 'a2')])
+    return client
+
+
+def test_schema_of_mixed_database_is_single(client):
+    assert make_storage(client, misc.SCHEMA_SPLIT).get_schema() == misc.SCHEMA_SINGLE
+
+
+def test_unrelayed_windows_of_both_layouts(client):
+    storage = make_storage(client, misc.SCHEMA_SPLIT)
+
+    assert storage.count_unrelayed_windows() == 12
+    assert storage.get_unrelayed_windows(limit=4) == [
+        (START + index * WINDOW_LENGTH, agent) for agent in ('a1', 'a2') for index in (5, 4, 3, 2)]
+
+
+def test_read_windows_of_both_layouts(client):
+    storage = make_storage(client, misc.SCHEMA_SPLIT)
+
+    for index in (2, 3):
+        windows = storage.read_windows([(START + index * WINDOW_LENGTH, 'a1'), (START + index * WINDOW_LENGTH, 'a2')])
+
+        assert set(windows.keys()) == {'a1', 'a2'}
+        window = windows['a1']
+        assert (window.start, window.end) == (START + index * WINDOW_LENGTH, START + (index + 1) * WINDOW_LENGTH)
+        assert (window.src_addr, window.priority) == ({'1.1.1': index + 1}, {'LOW': index + 1})
+        assert window.trace == {'agent': window.end + 1}
+
+
+def test_mark_relayed_in_layout_of_window(client):
+    storage = make_storage(client, misc.SCHEMA_SPLIT)
+
+    storage.mark_relayed([(START + index * WINDOW_LENGTH, 'a1') for index in (2, 3)])
+
+    assert storage.count_unrelayed_windows() == 10
+    assert client.points[('agent_status', START + 2 * WINDOW_LENGTH, 'a1')]['relayed'] is True
+    assert client.points[(misc.WINDOW_MEASUREMENT, START + 3 * WINDOW_LENGTH, 'a1')]['relayed'] is True
+    # no partial points in the other layout
+    assert ('agent_status', START + 3 * WINDOW_LENGTH, 'a1') not in client.points
+    assert (misc.WINDOW_MEASUREMENT, START + 2 * WINDOW_LENGTH, 'a1') not in client.points
+
+
+def test_get_windows_of_both_layouts(client):
+    storage = make_storage(client, misc.SCHEMA_SPLIT)
+
+    windows = list(storage.get_windows(START - 1, START + 6 * WINDOW_LENGTH))
+
+    assert [window.start for window in windows if window.agent == 'a1'] == [
+        START + index * WINDOW_LENGTH for index in range(5, -1, -1)]
+    assert all(window.src_addr == {'1.1.1': (window.start - START) // WINDOW_LENGTH + 1} for window in windows)
+
+
+@pytest.mark.parametrize('measurement', ['agent_status', misc.WINDOW_MEASUREMENT])
+def test_rollup_query_only_sums_up_counters(measurement):
+    query = influx.rollup_query('test', measurement, '1h')
+
+    assert 'sum("count") AS "count", sum("length") AS "length"' in query
+    assert 'sum(*)' not in query
+    assert (f'sum(/{misc.COUNTER_SEPARATOR}/)' in query) == (measurement == misc.WINDOW_MEASUREMENT)
+
+
+def test_rollup_query_sums_up_all_counters_of_split_measurements():
+    assert 'SELECT sum(*) INTO "test"."rollup_1h"."src_addr"' in influx.rollup_query('test', 'src_addr', '1h')
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from bas_observe import datamodel, misc
+from bas_observe.analyse.lof import LofAnalyser
+from bas_observe.analyse.lof_index import IndexedLof
+from bas_observe.config import Config
+
+
+START = 1514764800 * misc.NS_PER_SECOND
+WINDOW_LENGTH = 10 * misc.NS_PER_SECOND
+
+
+def make_window(agent: str, index: int, src_addr: {}) -> datamodel.Window:
+    start = START + index * WINDOW_LENGTH
+    window = datamodel.Window(start, agent, end=start + WINDOW_LENGTH)
+    window.src_addr = src_addr
+    window.dest_addr = {'0/0/1': 10}
+    window.priority = {'LOW': 10}
+    window.hop_count = {6: 10}
+    window.length = {9: 10}
+    return window
+
+
+@pytest.fixture
+def analyser(tmp_path):
+    analyser = LofAnalyser(Config('test', 'amqp://localhost', 'sqlite://'), str(tmp_path / 'model.json'))
+    analyser.model = {}
+
+    random = np.random.RandomState(0)
+    training = [make_window('a1', index, {'1.1.1': telegrams, '1.1.2': 20 - telegrams})
+                for index, telegrams in enumerate(random.randint(0, 21, size=200))]
+    for agent in ('__world_model__', 'a1'):
+        analyser.model[agent] = None
+        analyser._model_cache.put(agent, IndexedLof(n_neighbors=20, contamination=0.1, index='brute').fit(
+            analyser.vectorise(training)))
+
+    return analyser
+
+
+def test_local_and_world_flag_the_same_outliers(analyser):
+    windows = [make_window('a1', 0, {'1.1.1': 10, '1.1.2': 10}), make_window('a1', 1, {'15.15.255': 10})]
+
+    fields = [point['fields'] for point in analyser.score_windows(windows)]
+
+    # the agent model equals the world model, so both have to agree
+    assert [(field['local'], field['world']) for field in fields] == [(0, 0), (1, 1)]
+    assert [field['local_inlier'] for field in fields] == [1, 0]
+    assert fields[1]['local_lof'] > fields[0]['local_lof']
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+from scipy import sparse
+
+from bas_observe.analyse.lof_index import IndexedLof, evaluate_lof
+
+
+@pytest.fixture
+def X():
+    return np.random.RandomState(0).normal(size=(300, 4))
+
+
+def reference_scores(X_train: np.ndarray, X: np.ndarray, k: int) -> np.ndarray:
+    """Negated LOF of the rows in X computed by the textbook definition"""
+    def neighbours(Q, exclude_self):
+        dist = np.sqrt(((Q[:, np.newaxis, :] - X_train[np.newaxis, :, :]) ** 2).sum(axis=2))
+        ind = np.argsort(dist, axis=1)[:, int(exclude_self):k + int(exclude_self)]
+        return dist[np.arange(Q.shape[0])[:, np.newaxis], ind], ind
+
+    dist, ind = neighbours(X_train, True)
+    k_distance = dist[:, -1]
+    lrd = 1. / np.maximum(dist, k_distance[ind]).mean(axis=1)
+
+    dist, ind = neighbours(X, False)
+    lrd_X = 1. / np.maximum(dist, k_distance[ind]).mean(axis=1)
+    return -lrd[ind].mean(axis=1) / lrd_X
+
+
+@pytest.mark.parametrize('index', ['kd_tree', 'ball_tree', 'brute'])
+def test_scores_equal_exact_lof(X, index):
+    model = IndexedLof(n_neighbors=10, index=index).fit(X[:200])
+
+    np.testing.assert_allclose(model.decision_function(X[200:]), reference_scores(X[:200], X[200:], 10), rtol=1e-6)
+
+
+def test_sparse_rows_score_like_dense_ones(X):
+    X = np.where(X > 0, X, 0)
+    dense = IndexedLof(n_neighbors=10, index='brute').fit(X[:200])
+    sparse_model = IndexedLof(n_neighbors=10, index='brute').fit(sparse.csr_matrix(X[:200]))
+
+    np.testing.assert_allclose(sparse_model.decision_function(sparse.csr_matrix(X[200:])), dense.decision_function(X[200:]))
+
+
+def test_sparse_rows_require_brute_index(X):
+    with pytest.raises(ValueError):
+        IndexedLof(index='kd_tree').fit(sparse.csr_matrix(X))
+
+
+def test_threshold_flags_contamination(X):
+    model = IndexedLof(n_neighbors=20, contamination=0.1).fit(X)
+
+    assert np.mean(model.predict(X) == -1) == pytest.approx(0.1, abs=0.02)
+    assert model.predict(X[:3] + 10).tolist() == [-1, -1, -1]
+
+
+def test_coreset_keeps_at_most_coreset_size_rows(X):
+    model = IndexedLof(n_neighbors=10, index='brute', coreset_size=100, random_state=0).fit(X)
+
+    assert model.fit_X_.shape[0] == 100
+    assert model.predict(X[:3] + 10).tolist() == [-1, -1, -1]
+
+
+def test_evaluate_against_itself(X):
+    model = IndexedLof(n_neighbors=10).fit(X)
+
+    result = evaluate_lof(model, model, X[:50])
+
+    assert (result['outlier_recall'], result['agreement']) == (1.0, 1.0)
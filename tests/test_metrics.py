@@ -0,0 +1,87 @@
+import math
+
+import pytest
+
+from bas_observe import metrics
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    registry = metrics.Registry()
+    monkeypatch.setattr(metrics, 'REGISTRY', registry)
+    return registry
+
+
+def test_counter_exposition(registry):
+    counter = metrics.Counter('bob_test_total', "Test counter", ['component', 'stage'])
+    counter.labels('LOF ANALYSER', 'score').inc()
+    counter.labels('LOF ANALYSER', 'score').inc(2)
+    counter.labels('COLLECTOR', 'decode').inc()
+
+    assert registry.expose() == (
+        '# HELP bob_test_total Test counter\n'
+        '# TYPE bob_test_total counter\n'
+        'bob_test_total{component="LOF ANALYSER",stage="score"} 3.0\n'
+        'bob_test_total{component="COLLECTOR",stage="decode"} 1.0\n'
+    )
+
+
+def test_gauge_reads_function(registry):
+    values = [4]
+    gauge = metrics.Gauge('bob_test_entries', "Test gauge")
+    gauge.labels().set_function(lambda: values[0])
+
+    values[0] = 7
+
+    assert registry.expose().splitlines()[-1] == 'bob_test_entries 7.0'
+
+
+def test_failing_function_exposes_nan(registry):
+    gauge = metrics.Gauge('bob_test_entries', "Test gauge", ['component'])
+    gauge.labels('a').set_function(lambda: 1 / 0)
+
+    assert registry.expose().splitlines()[-1] == 'bob_test_entries{component="a"} nan'
+
+
+def test_histogram_exposition(registry):
+    histogram = metrics.Histogram('bob_test_seconds', "Test histogram", ['component'], buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.labels('a').observe(value)
+
+    assert registry.expose().splitlines()[2:] == [
+        'bob_test_seconds_bucket{component="a",le="0.1"} 2.0',
+        'bob_test_seconds_bucket{component="a",le="1.0"} 3.0',
+        'bob_test_seconds_bucket{component="a",le="+Inf"} 4.0',
+        'bob_test_seconds_sum{component="a"} 3.65',
+        'bob_test_seconds_count{component="a"} 4.0',
+    ]
+
+
+def test_label_values_are_escaped(registry):
+    metrics.Counter('bob_test_total', "Test counter", ['component']).labels('a "b"\\\n').inc()
+
+    assert registry.expose().splitlines()[-1] == 'bob_test_total{component="a \\"b\\"\\\\\\n"} 1.0'
+
+
+def test_duplicate_names_are_rejected(registry):
+    metrics.Counter('bob_test_total', "Test counter")
+
+    with pytest.raises(ValueError):
+        metrics.Counter('bob_test_total', "Test counter")
+
+
+def test_timed_only_records_successful_blocks(registry, monkeypatch):
+    for name in ('MESSAGES', 'WINDOWS'):
+        monkeypatch.setattr(metrics, name, metrics.Counter(f'bob_test_{name.lower()}_total', name, ['component', 'stage']))
+    monkeypatch.setattr(metrics, 'STAGE_SECONDS', metrics.Histogram('bob_test_seconds', "Test", ['component', 'stage']))
+
+    with metrics.timed('COLLECTOR', 'decode', windows=3):
+        pass
+    with pytest.raises(KeyError):
+        with metrics.timed('COLLECTOR', 'decode', windows=3):
+            raise KeyError()
+
+    assert metrics.MESSAGES.labels('COLLECTOR', 'decode').get() == 1
+    assert metrics.WINDOWS.labels('COLLECTOR', 'decode').get() == 3
+    assert sum(metrics.STAGE_SECONDS.labels('COLLECTOR', 'decode').counts) == 1
+    assert not math.isnan(metrics.STAGE_SECONDS.labels('COLLECTOR', 'decode').sum)
@@ -0,0 +1,65 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from bas_observe import misc
+
+
+def test_epoch_round_trip():
+    ns = 1514764800 * misc.NS_PER_SECOND + 123456000
+
+    dt = misc.from_epoch(ns)
+
+    assert dt == datetime(2018, 1, 1, 0, 0, 0, 123456, tzinfo=timezone.utc)
+    assert misc.to_epoch(dt) == ns
+
+
+def test_to_epoch_considers_naive_datetimes_utc():
+    assert misc.to_epoch(datetime(2018, 1, 1)) == 1514764800 * misc.NS_PER_SECOND
+    assert misc.to_epoch(datetime(2018, 1, 1, 1, tzinfo=timezone(timedelta(hours=1)))) == 1514764800 * misc.NS_PER_SECOND
+
+
+@pytest.mark.parametrize('value', [
+    1514764800 * misc.NS_PER_SECOND,
+    float(1514764800 * misc.NS_PER_SECOND),
+    '2018-01-01T00:00:00+0000',
+    '2018-01-01T00:00:00',
+    '2018-01-01T00:00:00Z',
+    '2018-01-01 00:00:00',
+])
+def test_parse_epoch(value):
+    assert misc.parse_epoch(value) == 1514764800 * misc.NS_PER_SECOND
+
+
+def test_parse_epoch_keeps_none():
+    assert misc.parse_epoch(None) is None
+
+
+def test_parse_epoch_rejects_unknown_formats():
+    with pytest.raises(ValueError):
+        misc.parse_epoch('01.01.2018')
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('90s', timedelta(seconds=90)),
+    ('15m', timedelta(minutes=15)),
+    ('12h', timedelta(hours=12)),
+    ('7d', timedelta(days=7)),
+    ('4w', timedelta(weeks=4)),
+])
+def test_parse_duration(value, expected):
+    assert misc.parse_duration(value) == expected
+
+
+@pytest.mark.parametrize('value', [None, '', 'INF', 'inf'])
+def test_parse_duration_infinite(value):
+    assert misc.parse_duration(value) is None
+
+
+def test_parse_duration_rejects_unknown_units():
+    with pytest.raises(ValueError):
+        misc.parse_duration('3y')
+
+
+def test_duration_to_ns():
+    assert misc.duration_to_ns(misc.parse_duration('1m')) == 60 * misc.NS_PER_SECOND
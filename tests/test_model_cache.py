@@ -0,0 +1,76 @@
+import numpy as np
+
+from bas_observe.analyse.model_cache import ModelCache, estimate_model_size
+
+
+class Model(object):
+
+    def __init__(self, size: int):
+        self.X = np.zeros(size // 8)
+
+
+def test_evicts_least_recently_used():
+    evicted = []
+    cache = ModelCache(max_entries=2, on_evict=lambda agent, model: evicted.append(agent))
+    cache.put('a1', Model(8))
+    cache.put('a2', Model(8))
+
+    cache.get('a1')
+    cache.put('a3', Model(8))
+
+    assert evicted == ['a2']
+    assert set(cache.keys()) == {'a1', 'a3'}
+    assert cache.stats()['evictions'] == 1
+
+
+def test_evicts_down_to_memory_budget():
+    cache = ModelCache(max_bytes=2048)
+    for agent in ('a1', 'a2', 'a3'):
+        cache.put(agent, Model(1024))
+
+    assert set(cache.keys()) == {'a2', 'a3'}
+    assert cache.bytes == 2048
+
+
+def test_keeps_new_model_exceeding_budget():
+    cache = ModelCache(max_bytes=1024)
+    cache.put('a1', Model(512))
+
+    cache.put('a2', Model(4096))
+
+    assert list(cache.keys()) == ['a2']
+    assert cache.bytes == 4096
+
+
+def test_replace_keeps_accounting():
+    cache = ModelCache()
+    cache.put('a1', Model(1024))
+    cache.put('a1', Model(512))
+
+    assert len(cache) == 1
+    assert cache.bytes == 512
+    assert cache.pop('a1').X.nbytes == 512
+    assert cache.bytes == 0
+
+
+def test_stats():
+    cache = ModelCache()
+    cache.put('a1', Model(8), load_seconds=0.5)
+    cache.put('a2', Model(8), load_seconds=1.5)
+
+    cache.get('a1')
+    cache.get('a3')
+
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['hit_ratio']) == (1, 1, 0.5)
+    assert (stats['loads'], stats['load_seconds'], stats['mean_load_seconds']) == (2, 2.0, 1.0)
+
+
+def test_estimate_model_size_ignores_memory_maps(tmp_path):
+    path = str(tmp_path / 'X.npy')
+    np.save(path, np.zeros(128))
+    model = Model(1024)
+    model.mapped = np.load(path, mmap_mode='r')
+    model.nested = {'arrays': [np.zeros(16), np.zeros(16)]}
+
+    assert estimate_model_size(model) == 1024 + 2 * 128
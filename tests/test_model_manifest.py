@@ -0,0 +1,48 @@
+import json
+
+from bas_observe.analyse.base import MODEL_MANIFEST_VERSION, read_model_manifest
+
+
+def write_json(tmp_path, data) -> str:
+    path = str(tmp_path / 'model.json')
+    with open(path, mode='w') as fp:
+        json.dump(data, fp)
+
+    return path
+
+
+def test_reads_current_manifest(tmp_path):
+    manifest = {
+        'version': MODEL_MANIFEST_VERSION,
+        'generation': 7,
+        'models': {'a1': 'test-LofAnalyser-a1.1.joblib'},
+        'projection': 'test-LofAnalyser-projection.1.npz',
+        'features': {'sparse': True, 'addr_histogram': True},
+    }
+
+    assert read_model_manifest(write_json(tmp_path, manifest)) == manifest
+
+
+def test_reads_plain_dict_of_first_version(tmp_path):
+    manifest = read_model_manifest(write_json(tmp_path, {'a1': 'a1.joblib', '__world_model__': 'world.joblib'}))
+
+    assert manifest == {
+        'version': 1,
+        'generation': 0,
+        'models': {'a1': 'a1.joblib', '__world_model__': 'world.joblib'},
+        'projection': None,
+        'features': {'sparse': False, 'addr_histogram': False},
+    }
+
+
+def test_agent_named_models_is_a_plain_dict(tmp_path):
+    manifest = read_model_manifest(write_json(tmp_path, {'models': 'models.joblib'}))
+
+    assert manifest['models'] == {'models': 'models.joblib'}
+
+
+def test_fills_in_missing_keys(tmp_path):
+    manifest = read_model_manifest(write_json(tmp_path, {'version': 2, 'models': {}}))
+
+    assert (manifest['generation'], manifest['projection']) == (0, None)
+    assert manifest['features'] == {'sparse': False, 'addr_histogram': False}
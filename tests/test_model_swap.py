@@ -0,0 +1,78 @@
+import os
+
+import numpy as np
+import pytest
+
+from bas_observe.analyse.base import read_model_manifest
+from bas_observe.analyse.lof import LofAnalyser
+from bas_observe.analyse.lof_index import IndexedLof
+from bas_observe.config import Config
+
+
+AGENTS = ('__world_model__', 'a1')
+
+
+def make_analyser(tmp_path) -> LofAnalyser:
+    analyser = LofAnalyser(Config('test', 'amqp://localhost', 'sqlite://'), str(tmp_path / 'model.json'), index='brute')
+    analyser.model = {}
+    return analyser
+
+
+def train(analyser: LofAnalyser, seed: int) -> None:
+    """Fits and saves new models of all agents, e.g. like an external training"""
+    X = np.random.RandomState(seed).normal(loc=seed, size=(50, 3))
+    for agent in AGENTS:
+        analyser.model.setdefault(agent, None)
+        analyser._model_cache.put(agent, IndexedLof(n_neighbors=10, index='brute').fit(X))
+        analyser.mark_dirty(agent)
+
+    analyser.save_model()
+
+
+@pytest.fixture
+def running(tmp_path):
+    analyser = make_analyser(tmp_path)
+    train(analyser, 0)
+    return analyser
+
+
+def test_reload_swaps_models_between_messages(tmp_path, running):
+    old_files = set(read_model_manifest(running.model_path)['models'].values())
+    # written by another process, e.g. bob train
+    train(make_analyser(tmp_path), 5)
+    new_files = set(read_model_manifest(running.model_path)['models'].values())
+
+    running.reload_models()
+
+    # nothing changes until the message loop swaps the models in
+    assert running.get_model_for_agent('a1').fit_X_.mean() == pytest.approx(0, abs=0.5)
+
+    running.swap_models()
+
+    assert running.get_model_for_agent('a1').fit_X_.mean() == pytest.approx(5, abs=0.5)
+    assert set(running.model.values()) == new_files
+    assert set(read_model_manifest(running.model_path)['models'].values()) == new_files
+    assert not any(os.path.exists(str(tmp_path / filename)) for filename in old_files)
+
+
+def test_failed_reload_keeps_models(tmp_path, running):
+    files = dict(running.model)
+    os.unlink(running.model_path)
+
+    running.reload_models()
+    running.swap_models()
+
+    assert running.model == files
+    assert running.get_model_for_agent('a1').fit_X_.mean() == pytest.approx(0, abs=0.5)
+
+
+def test_swap_keeps_models_failing_to_load(tmp_path, running):
+    train(make_analyser(tmp_path), 5)
+    manifest = read_model_manifest(running.model_path)
+    os.unlink(str(tmp_path / manifest['models']['a1']))
+
+    running.reload_models()
+    running.swap_models()
+
+    assert running.get_model_for_agent('__world_model__').fit_X_.mean() == pytest.approx(5, abs=0.5)
+    assert running.get_model_for_agent('a1').fit_X_.mean() == pytest.approx(0, abs=0.5)
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+from scipy import sparse
+
+from bas_observe.analyse.projection import Projection
+
+
+@pytest.fixture
+def X():
+    random = np.random.RandomState(0)
+    # 3 informative dimensions spread over 8 features
+    return random.normal(size=(200, 3)).dot(random.normal(size=(3, 8))) + 5
+
+
+def test_pca_centers_and_keeps_variance(X):
+    projection = Projection.fit(X, 3, 'pca')
+
+    Y = projection.transform(X)
+
+    assert Y.shape == (200, 3)
+    np.testing.assert_allclose(Y.mean(axis=0), 0, atol=1e-9)
+    # the rank is 3, so nothing is lost
+    np.testing.assert_allclose(Y.var(axis=0).sum(), X.var(axis=0).sum())
+
+
+def test_svd_on_sparse_vectors(X):
+    X_sparse = sparse.csr_matrix(np.where(X > 5, X, 0))
+
+    projection = Projection.fit(X_sparse, 2, 'svd')
+
+    np.testing.assert_allclose(projection.offset, 0)
+    np.testing.assert_allclose(projection.transform(X_sparse), X_sparse.toarray().dot(projection.components))
+
+
+def test_pca_rejects_sparse_vectors(X):
+    with pytest.raises(ValueError):
+        Projection.fit(sparse.csr_matrix(X), 2, 'pca')
+
+
+def test_rejects_unknown_reduction(X):
+    with pytest.raises(ValueError):
+        Projection.fit(X, 2, 'ica')
+
+
+def test_clips_number_of_components(X):
+    assert Projection.fit(X, 100, 'pca').n_components == 8
+    assert Projection.fit(X, 100, 'svd').n_components == 7
+    assert Projection.fit(X[:4], 100, 'pca').n_components == 4
+
+
+def test_save_and_load(X, tmp_path):
+    projection = Projection.fit(X, 3, 'pca')
+    path = str(tmp_path / 'projection.npz')
+
+    projection.save(path)
+    loaded = Projection.load(path)
+
+    np.testing.assert_allclose(loaded.transform(X), projection.transform(X))
@@ -0,0 +1,69 @@
+import pytest
+
+from bas_observe import datamodel, misc
+from bas_observe.manage import rollup
+
+
+START = 1514764800 * misc.NS_PER_SECOND
+WINDOW_LENGTH = 10 * misc.NS_PER_SECOND
+
+
+def make_window(agent: str, index: int, **counters) -> datamodel.Window:
+    start = START + index * WINDOW_LENGTH
+    window = datamodel.Window(start, agent, end=start + WINDOW_LENGTH)
+    for measurement, counter in counters.items():
+        setattr(window, measurement, counter)
+
+    return window
+
+
+def test_merge_windows_sums_counters():
+    windows = [
+        make_window('a1', 0, src_addr={'1.1.1': 2}, apci={'GROUP_VALUE_WRITE': 2}),
+        make_window('a1', 1, src_addr={'1.1.1': 1, '1.1.2': 3}, apci={'GROUP_VALUE_READ': 4}),
+        make_window('a1', 2, src_addr={'1.1.2': None}),
+    ]
+
+    merged = datamodel.merge_windows(windows)
+
+    assert merged.agent == 'a1'
+    assert (merged.start, merged.end) == (START, START + 3 * WINDOW_LENGTH)
+    assert merged.src_addr == {'1.1.1': 3, '1.1.2': 3}
+    assert merged.apci == {'GROUP_VALUE_WRITE': 2, 'GROUP_VALUE_READ': 4}
+    assert merged.dest_addr == {}
+
+
+def test_merge_windows_takes_given_bounds():
+    merged = datamodel.merge_windows([make_window('a1', 3)], start=START, end=START + 60 * misc.NS_PER_SECOND)
+
+    assert (merged.start, merged.end) == (START, START + 60 * misc.NS_PER_SECOND)
+
+
+def test_merge_windows_rejects_empty_list():
+    with pytest.raises(ValueError):
+        datamodel.merge_windows([])
+
+
+def test_rollup_windows_per_agent_and_bucket():
+    length = rollup.resolution_to_ns('1m')
+    windows = [make_window(agent, index, priority={'LOW': 1}) for index in range(9) for agent in ('a1', 'a2')]
+
+    rolled_up = rollup.rollup_windows(windows, length)
+
+    assert [(window.start, window.agent) for window in rolled_up] == [
+        (START, 'a1'), (START, 'a2'), (START + length, 'a1'), (START + length, 'a2'),
+    ]
+    assert all(window.end == window.start + length for window in rolled_up)
+    assert [window.priority['LOW'] for window in rolled_up] == [6, 6, 3, 3]
+
+
+def test_bucket_start():
+    length = rollup.resolution_to_ns('15m')
+
+    assert rollup.bucket_start(START + length + 1, length) == START + length
+    assert rollup.bucket_start(START, length) == START
+
+
+def test_resolution_to_ns_rejects_infinite_durations():
+    with pytest.raises(ValueError):
+        rollup.resolution_to_ns('INF')
@@ -0,0 +1,188 @@
+import sqlite3
+
+import pytest
+
+from bas_observe import datamodel, misc
+from bas_observe.config import Config
+
+
+START = 1514764800 * misc.NS_PER_SECOND
+WINDOW_LENGTH = 10 * misc.NS_PER_SECOND
+MINUTE = 60 * misc.NS_PER_SECOND
+
+
+@pytest.fixture
+def storage():
+    storage = Config('test', 'amqp://localhost', 'sqlite://').get_storage()
+    yield storage
+    storage.close()
+
+
+def make_window(agent: str, index: int) -> datamodel.Window:
+    start = START + index * WINDOW_LENGTH
+    window = datamodel.Window(start, agent, end=start + WINDOW_LENGTH)
+    window.src_addr = {'1.1.1': 2, '1.1.2': 1}
+    window.priority = {'LOW': 3}
+    window.mark('agent', window.end + 1)
+    return window
+
+
+def lof_point(agent: str, time: int, local: int, **tags) -> {}:
+    return {
+        'time': time,
+        'measurement': 'lof',
+        'tags': dict({'project': 'test', 'agent': agent}, **tags),
+        'fields': {'local': local, 'local_lof': float(local + 1)},
+    }
+
+
+def rollups(storage, resolution: str, field: str) -> {}:
+    return {(agent, window_resolution, time): value for agent, window_resolution, time, value in storage.db.execute(
+        'SELECT agent, window_resolution, time, value FROM rollups WHERE resolution = ? and measurement = ? and field = ?',
+        (resolution, 'lof', field))}
+
+
+def test_window_round_trip(storage):
+    windows = [make_window(agent, index) for index in range(3) for agent in ('a1', 'a2')]
+    storage.write_windows(windows)
+
+    read = storage.read_windows([(START + WINDOW_LENGTH, 'a1'), (START + WINDOW_LENGTH, 'a2')])
+
+    assert set(read.keys()) == {'a1', 'a2'}
+    window = read['a1']
+    assert (window.start, window.end) == (START + WINDOW_LENGTH, START + 2 * WINDOW_LENGTH)
+    assert window.src_addr == {'1.1.1': 2, '1.1.2': 1}
+    assert window.priority == {'LOW': 3}
+    assert window.trace == {'agent': window.end + 1}
+
+
+def test_get_windows_excludes_bounds(storage):
+    storage.write_windows([make_window('a1', index) for index in range(4)])
+
+    windows = list(storage.get_windows(START, START + 3 * WINDOW_LENGTH))
+
+    # latest first
+    assert [window.start for window in windows] == [START + 2 * WINDOW_LENGTH, START + WINDOW_LENGTH]
+
+
+def test_relay_bookkeeping(storage):
+    storage.write_windows([make_window(agent, index) for index in range(10) for agent in ('a1', 'a2')])
+
+    unrelayed = storage.get_unrelayed_windows(limit=4)
+    assert len(unrelayed) == 8
+    assert storage.count_unrelayed_windows() == 20
+
+    storage.mark_relayed(unrelayed)
+
+    assert storage.count_unrelayed_windows() == 12
+    assert not set(unrelayed) & set(storage.get_unrelayed_windows(limit=10))
+
+
+def test_resolutions_are_stored_apart(storage):
+    storage.write_windows([make_window('a1', 0)], resolution='15m')
+
+    assert storage.count_unrelayed_windows() == 0
+    assert storage.count_unrelayed_windows(resolution='15m') == 1
+    assert list(storage.get_windows(START - 1, START + 1)) == []
+
+
+def test_maintain_rolls_up_results(storage):
+    storage.write_results([lof_point('a1', START + index * WINDOW_LENGTH, index % 2) for index in range(12)])
+
+    storage.maintain()
+
+    assert rollups(storage, '1m', 'local') == {('a1', '', START): 3, ('a1', '', START + MINUTE): 3}
+    assert rollups(storage, '1m', 'local_lof') == {('a1', '', START): 1.5, ('a1', '', START + MINUTE): 1.5}
+    assert rollups(storage, '1h', 'local') == {('a1', '', START): 6}
+    assert rollups(storage, '1d', 'local') == {('a1', '', START): 6}
+
+
+def test_maintain_rolls_up_late_results(storage):
+    storage.write_results([lof_point('a1', START + MINUTE + index * WINDOW_LENGTH, 1) for index in range(6)])
+    storage.maintain()
+
+    # e.g. a backtest writing results long after the first roll-up
+    storage.write_results([lof_point('a1', START + index * WINDOW_LENGTH, 1) for index in range(3)])
+    storage.maintain()
+
+    assert rollups(storage, '1m', 'local') == {('a1', '', START): 3, ('a1', '', START + MINUTE): 6}
+    assert rollups(storage, '1h', 'local') == {('a1', '', START): 9}
+    assert rollups(storage, '1d', 'local') == {('a1', '', START): 9}
+
+
+def test_maintain_keeps_resolutions_apart(storage):
+    storage.write_results([lof_point('a1', START, 1), lof_point('a1', START, 0, resolution='15m')])
+
+    storage.maintain()
+
+    assert rollups(storage, '1h', 'local') == {('a1', '', START): 1, ('a1', '15m', START): 0}
+
+
+def test_maintain_sums_up_window_counters(storage):
+    storage.write_windows([make_window('a1', index) for index in range(12)])
+
+    storage.maintain()
+
+    counters = dict(storage.db.execute(
+        'SELECT field, value FROM rollups WHERE resolution = ? and measurement = ? and time = ?', ('1d', 'src_addr', START)))
+    assert counters == {'1.1.1': 24, '1.1.2': 12}
+    status = dict(storage.db.execute(
+        'SELECT field, value FROM rollups WHERE resolution = ? and measurement = ? and time = ?', ('1h', 'agent_status', START)))
+    assert status == {'count': 36, 'length': 120}
+
+
+def test_maintain_rolls_up_results_after_deletes_and_vacuum(storage):
+    storage.write_results([lof_point(agent, START + index * WINDOW_LENGTH, 1) for agent in ('a1', 'a2') for index in range(6)])
+    storage.maintain()
+
+    # e.g. the results of a backtest removed again, VACUUM may renumber the implicit rowids of the remaining rows
+    with storage.db:
+        storage.db.execute("DELETE FROM results WHERE agent = 'a2'")
+    storage.db.execute('VACUUM')
+    storage.write_results([lof_point('a1', START + MINUTE, 1)])
+    storage.maintain()
+
+    assert rollups(storage, '1m', 'local') == {('a1', '', START): 6, ('a2', '', START): 6, ('a1', '', START + MINUTE): 1}
+
+
+def test_migrates_tables_without_id(tmp_path):
+    path = str(tmp_path / 'old.db')
+    db = sqlite3.connect(path)
+    with db:
+        db.execute('''CREATE TABLE results (measurement TEXT NOT NULL, project TEXT NOT NULL, agent TEXT NOT NULL,
+                      window_resolution TEXT NOT NULL DEFAULT '', time INTEGER NOT NULL, field TEXT NOT NULL, value REAL,
+                      PRIMARY KEY (measurement, project, agent, window_resolution, time, field))''')
+        db.execute('CREATE TABLE rollup_progress (source TEXT PRIMARY KEY, last_rowid INTEGER NOT NULL)')
+        db.executemany("INSERT INTO results (rowid, measurement, project, agent, time, field, value) VALUES (?, 'lof', 'test', 'a1', ?, 'local', 1)",
+                       [(5, START), (7, START + MINUTE)])
+        db.execute("INSERT INTO rollup_progress VALUES ('results', 5)")
+    db.close()
+
+    storage = Config('test', 'amqp://localhost', f'sqlite:///{path}').get_storage()
+    storage.maintain()
+
+    assert storage.db.execute('SELECT id, time FROM results ORDER BY id').fetchall() == [(5, START), (7, START + MINUTE)]
+    # only the row after the progress is rolled up
+    assert rollups(storage, '1m', 'local') == {('a1', '', START + MINUTE): 1}
+    storage.close()
+
+
+def test_retention_of_rolled_up_windows(monkeypatch):
+    storage = Config('test', 'amqp://localhost', 'sqlite://', retention={'raw': '1d', 'windows_15m': '7d'}).get_storage()
+    monkeypatch.setattr(misc, 'now_epoch', lambda: START + 3 * 24 * 60 * MINUTE)
+    storage.write_windows([make_window('a1', 0), make_window('a1', 30000)])
+    storage.write_windows([make_window('a1', 0)], resolution='15m')
+    storage.write_windows([make_window('a1', 0)], resolution='1h')
+
+    storage.maintain()
+
+    assert storage.db.execute('SELECT start FROM windows').fetchall() == [(START + 30000 * WINDOW_LENGTH, )]
+    assert storage.count_unrelayed_windows(resolution='15m') == 1
+    assert storage.count_unrelayed_windows(resolution='1h') == 1
+
+    monkeypatch.setattr(misc, 'now_epoch', lambda: START + 8 * 24 * 60 * MINUTE)
+    storage.maintain()
+
+    assert storage.count_unrelayed_windows(resolution='15m') == 0
+    assert storage.count_unrelayed_windows(resolution='1h') == 1
+    storage.close()
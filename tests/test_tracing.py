@@ -0,0 +1,62 @@
+import pytest
+
+from bas_observe import datamodel, misc, tracing
+
+
+START = 1514764800 * misc.NS_PER_SECOND
+END = START + 10 * misc.NS_PER_SECOND
+
+
+def test_stage_latencies_since_previous_hop():
+    window = datamodel.Window(START, 'a1', end=END)
+    trace = {
+        'agent': END + misc.NS_PER_SECOND // 2,
+        'collector': END + misc.NS_PER_SECOND,
+        'relay': END + 3 * misc.NS_PER_SECOND,
+        'analyser': END + 4 * misc.NS_PER_SECOND,
+    }
+
+    latencies = tracing.stage_latencies(window, trace)
+
+    assert list(latencies.items()) == [('agent', 0.5), ('collector', 0.5), ('relay', 2.0), ('analyser', 1.0)]
+
+
+def test_stage_latencies_skip_missing_stages():
+    window = datamodel.Window(START, 'a1', end=END)
+
+    # e.g. a window of an agent without tracing, which was not relayed from the storage
+    latencies = tracing.stage_latencies(window, {'collector': END + misc.NS_PER_SECOND, 'scored': END + 3 * misc.NS_PER_SECOND})
+
+    assert dict(latencies) == {'collector': 1.0, 'scored': 2.0}
+
+
+def test_stage_latencies_of_unfinished_window():
+    window = datamodel.Window(START, 'a1')
+
+    latencies = tracing.stage_latencies(window, {'agent': END, 'collector': END + misc.NS_PER_SECOND})
+
+    assert dict(latencies) == {'collector': 1.0}
+
+
+def test_latency_points_sample_and_total():
+    windows = [datamodel.Window(START, 'a1', end=END), datamodel.Window(START, 'a2', end=END)]
+    for window in windows:
+        window.mark('agent', END + misc.NS_PER_SECOND)
+
+    points = tracing.latency_points(windows, 'LOF ANALYSER', 'test', 1.0, analyser=END + 2 * misc.NS_PER_SECOND)
+
+    assert [point['tags'] for point in points] == [
+        {'project': 'test', 'agent': 'a1', 'component': 'LOF ANALYSER'},
+        {'project': 'test', 'agent': 'a2', 'component': 'LOF ANALYSER'},
+    ]
+    assert points[0]['fields'] == {'agent': 1.0, 'analyser': 1.0, 'total': 12.0}
+    assert tracing.latency_points(windows, 'LOF ANALYSER', 'test', 0.0, analyser=END) == []
+
+
+@pytest.mark.parametrize('rate', [0.1, 0.5])
+def test_is_sampled_approximates_rate(rate):
+    windows = [datamodel.Window(START + index * 10 * misc.NS_PER_SECOND, 'a1') for index in range(10000)]
+
+    sampled = sum(tracing.is_sampled(window, rate) for window in windows)
+
+    assert sampled == pytest.approx(rate * len(windows), rel=0.1)
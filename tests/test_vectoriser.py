@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from bas_observe import datamodel, misc, vectoriser
+
+
+def make_window(length: {}, start: int=misc.to_epoch(misc.parse_datetime('2018-01-03T12:00:00'))) -> datamodel.Window:
+    window = datamodel.Window(start, 'agent1', end=start + 10 * misc.NS_PER_SECOND)
+    window.src_addr = {'1.1.3': 3, '1.1.20': 1}
+    window.dest_addr = {'0/1/2': 2, '4/0/17': 2}
+    window.priority = {'LOW': 3, 'SYSTEM': 1}
+    window.hop_count = {6: 4}
+    window.length = length
+    window.apci = {vectoriser._APCI_KEYS[0]: 3, vectoriser._APCI_KEYS[-1]: 1}
+    return window
+
+
+@pytest.mark.parametrize('length', [
+    {1: 4},
+    {9: 1, 24: 2, 100: 1},
+    {254: 1, 255: 3},
+    {},
+])
+def test_sparse_equals_dense(length):
+    window = make_window(length)
+
+    dense = vectoriser.vectorise_window(window)
+    sparse = vectoriser.vectorise_windows_sparse([window]).toarray()[0]
+
+    assert sparse.shape == (vectoriser.WINDOW_VECTOR_SIZE, )
+    np.testing.assert_allclose(sparse, dense)
+
+
+def test_sparse_addr_histogram_appends_addresses():
+    window = make_window({8: 4})
+
+    row = vectoriser.vectorise_windows_sparse([window], addr_histogram=True).toarray()[0]
+
+    assert row.shape == (vectoriser.sparse_vector_size(addr_histogram=True), )
+    np.testing.assert_allclose(row[:vectoriser.WINDOW_VECTOR_SIZE], vectoriser.vectorise_window(window))
+    histogram = row[vectoriser.WINDOW_VECTOR_SIZE:]
+    assert histogram.sum() == pytest.approx(2)
+    assert histogram[vectoriser._int_knx_addr('1.1.3')] == pytest.approx(0.75)
+
+
+def test_max_payload_length_in_last_bucket():
+    vect = vectoriser.vectorise_payload_length_dict({255: 1, 0: 1})
+
+    assert len(vect) == 10
+    assert vect[9] == pytest.approx(0.5)
+    assert vect[0] == pytest.approx(0.5)